@@ -0,0 +1,259 @@
+"""Measure the cold start of the Lambda functions offline.
+
+Every function is loaded in a fresh Python process, like a new execution
+environment, against the local stand-ins of benchmarks/stand_ins.py, with the
+indices of the sample documents kept by the embedded vector store. For every
+function the report gives the median and maximum over --runs processes of:
+
+- init_ms: the import of the handler module, which is the init phase of Lambda
+- first_invocation_ms: the first invocation, which creates the clients lazily
+- second_invocation_ms: the next invocation, served by a warm container
+- boto3_import_ms: the import of boto3, made by the stand-ins before the init
+
+and the third-party packages imported during the init. The Index Lambda indexes
+the smallest sample document into a new index, the Retrieval and Response Lambdas
+answer the first question of benchmarks/questions.json, and the Classification
+Lambda runs the whole pipeline in process.
+
+Run it from the template folder, no AWS account is needed:
+
+    python benchmarks/cold_start.py --output cold-start-results.json
+
+With --baseline the run fails when a duration increased by more than --tolerance
+compared with a previous report.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_PATH)
+import run_benchmarks  # noqa: E402
+from run_benchmarks import BUCKET_NAME, CONTENT_PATH, LAMBDAS_PATH, LambdaContext  # noqa: E402
+
+REPORT_SCHEMA_VERSION = 1
+
+# Handler module and folder of every function
+FUNCTIONS = {
+    "index": ("index_data_lambda", "index_data_lambda"),
+    "retrieval": ("retrieval_lambda", "retrieval_lambda"),
+    "response": ("generate_response_lambda", "response_lambda"),
+    "classification": ("classify_lambda", "classification_lambda"),
+}
+
+# The classifier routes every question without asking the LLM stand-in, which cannot classify.
+# The classification prompt is set by the template rather than the sample configuration.
+PARAMETER_OVERRIDES = {
+    "router_margin": "0",
+    "router_min_similarity": "-1",
+    "classification_prompt": "Human: Which of the topics {topics} is the question \"{question}\" about? {string} Assistant:",
+    "bedrock_ingestion_max_rps": "0",
+}
+
+TIMINGS = ("init_ms", "first_invocation_ms", "second_invocation_ms", "boto3_import_ms")
+
+
+def s3_event(key, size):
+    return {
+        "Records": [{
+            "eventVersion": "2.1",
+            "eventSource": "aws:s3",
+            "eventName": "ObjectCreated:Put",
+            "s3": {"bucket": {"name": BUCKET_NAME}, "object": {"key": key, "size": size}},
+        }]
+    }
+
+
+def _start_environment(vector_store_path, overrides, extra_objects=None):
+    """Install the stand-ins with the sample documents, and the parameters of the benchmark."""
+    started = time.perf_counter()
+    # Imported once here to measure it, the functions then find it in sys.modules
+    importlib.import_module("boto3")
+    boto3_import_ms = (time.perf_counter() - started) * 1000
+
+    run_benchmarks._prepare_environment(os.environ.get("POWERTOOLS_LOG_LEVEL", "WARNING"), "local")
+    os.environ["VECTOR_STORE_PATH"] = vector_store_path
+    for _, folder in FUNCTIONS.values():
+        path = os.path.join(LAMBDAS_PATH, folder)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import stand_ins
+
+    parameters = run_benchmarks.load_parameters({**PARAMETER_OVERRIDES, **overrides})
+    objects = run_benchmarks.load_documents(os.path.join(CONTENT_PATH, "sample-files"))
+    objects.update(extra_objects or {})
+    stand_ins.install(
+        ssm=stand_ins.LocalSSM({f"/opa/gen-ai/{os.environ['APP_NAME']}/{name}": value for name, value in parameters.items()}),
+        s3=stand_ins.LocalS3(objects),
+        bedrock_runtime=stand_ins.LocalBedrockRuntime(),
+        opensearch=stand_ins.LocalOpenSearch(),
+    )
+    return objects, boto3_import_ms
+
+
+def setup(vector_store_path, overrides, events_path):
+    """Index the sample documents and write the events of the measured invocations."""
+    objects, _ = _start_environment(vector_store_path, overrides)
+    index_lambda = importlib.import_module("index_data_lambda")
+    retrieval_lambda = importlib.import_module("retrieval_lambda")
+    for number, key in enumerate(objects):
+        index_lambda.lambda_handler(s3_event(key, len(objects[key])), LambdaContext("index-data", aws_request_id=f"setup-{number}"))
+
+    with open(os.path.join(BENCHMARKS_PATH, "questions.json")) as questions_file:
+        question = json.load(questions_file)[0]
+    retrieval_event = {"message": question["question"], "index": question["index"]}
+    retrieval = retrieval_lambda.lambda_handler(retrieval_event, LambdaContext("retrieval", aws_request_id="setup"))
+    smallest = min(objects, key=lambda key: len(objects[key]))
+    events = {
+        "index": {"key": smallest},
+        "retrieval": retrieval_event,
+        "response": {"message": question["question"], "response": json.loads(retrieval["body"])["response"]},
+        "classification": {
+            "httpMethod": "POST",
+            "body": json.dumps({"message": question["question"], "operation_mode": "inclusive"}),
+        },
+    }
+    with open(events_path, "w") as events_file:
+        json.dump(events, events_file)
+
+
+def measure(function, run, vector_store_path, overrides, events_path, result_path):
+    """Load `function` in this process and invoke it twice, writing the timings to `result_path`."""
+    with open(events_path) as events_file:
+        events = json.load(events_file)
+    extra_objects = {}
+    if function == "index":
+        # Every run indexes the document into a new index, so runs do the same work
+        source_key = events["index"]["key"]
+        key = f"cold-start-{run}/{os.path.basename(source_key)}"
+        with open(os.path.join(CONTENT_PATH, "sample-files", source_key), "rb") as document:
+            extra_objects[key] = document.read()
+        events["index"] = s3_event(key, len(extra_objects[key]))
+
+    _, boto3_import_ms = _start_environment(vector_store_path, overrides, extra_objects)
+    modules_before = set(sys.modules)
+    module_name, _ = FUNCTIONS[function]
+
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    init_ms = (time.perf_counter() - started) * 1000
+    packages = sorted({
+        name.split(".")[0] for name in set(sys.modules) - modules_before
+        if name.split(".")[0] not in sys.stdlib_module_names
+        and not os.path.dirname(getattr(sys.modules[name], "__file__", None) or "").startswith(LAMBDAS_PATH)
+    })
+
+    durations = []
+    for number in range(2):
+        context = LambdaContext(function, aws_request_id=f"cold-start-{run}-{number}")
+        started = time.perf_counter()
+        response = module.lambda_handler(events[function], context)
+        durations.append((time.perf_counter() - started) * 1000)
+        status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+        if status != 200:
+            raise RuntimeError(f"{function} failed: {response}")
+
+    with open(result_path, "w") as result_file:
+        json.dump({
+            "init_ms": init_ms,
+            "first_invocation_ms": durations[0],
+            "second_invocation_ms": durations[1],
+            "boto3_import_ms": boto3_import_ms,
+            "packages": packages,
+        }, result_file)
+
+
+def _run_child(arguments, log_path):
+    with open(log_path, "ab") as log_file:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *arguments],
+            check=True, stdout=log_file, stderr=subprocess.STDOUT,
+        )
+
+
+def summarize(runs):
+    summary = {"runs": len(runs)}
+    for timing in TIMINGS:
+        values = [run[timing] for run in runs]
+        summary[timing] = {"median_ms": round(statistics.median(values), 2), "max_ms": round(max(values), 2)}
+    summary["packages"] = runs[0]["packages"]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="cold-start-results.json", help="Path of the JSON report")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per function")
+    parser.add_argument("--function", action="append", choices=sorted(FUNCTIONS), help="Function to measure, all by default")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE", help="Override an app parameter")
+    parser.add_argument("--baseline", help="Report of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change reported as a regression")
+    parser.add_argument("--child", nargs=5, metavar=("FUNCTION", "RUN", "VECTOR_STORE_PATH", "EVENTS", "RESULT"), help=argparse.SUPPRESS)
+    parser.add_argument("--setup", nargs=2, metavar=("VECTOR_STORE_PATH", "EVENTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    overrides = dict(value.split("=", 1) for value in args.param)
+
+    if args.setup:
+        vector_store_path, events_path = args.setup
+        setup(vector_store_path, overrides, events_path)
+        return 0
+    if args.child:
+        function, run, vector_store_path, events_path, result_path = args.child
+        measure(function, int(run), vector_store_path, overrides, events_path, result_path)
+        return 0
+
+    work_path = tempfile.mkdtemp(prefix="cold-start-")
+    vector_store_path = os.path.join(work_path, "vector-store")
+    events_path = os.path.join(work_path, "events.json")
+    log_path = os.path.join(work_path, "functions.log")
+    params = [argument for value in args.param for argument in ("--param", value)]
+    _run_child(["--setup", vector_store_path, events_path, *params], log_path)
+
+    results = {}
+    for function in args.function or FUNCTIONS:
+        runs = []
+        for run in range(args.runs):
+            result_path = os.path.join(work_path, f"{function}-{run}.json")
+            _run_child(["--child", function, str(run), vector_store_path, events_path, result_path, *params], log_path)
+            with open(result_path) as result_file:
+                runs.append(json.load(result_file))
+        results[function] = summarize(runs)
+
+    report = {
+        "schema_version": REPORT_SCHEMA_VERSION,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": run_benchmarks._git_commit(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {"runs": args.runs, "parameters": {**PARAMETER_OVERRIDES, **overrides}},
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        report["baseline"] = {"git_commit": baseline.get("git_commit"), "tolerance": args.tolerance}
+        report["regressions"] = run_benchmarks.compare(results, baseline.get("results", {}), args.tolerance)
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+        output_file.write("\n")
+
+    summary = {
+        function: {timing: metrics[timing]["median_ms"] for timing in TIMINGS} for function, metrics in results.items()
+    }
+    sys.stderr.write(json.dumps(summary, indent=2) + "\n")
+    sys.stderr.write(f"Report written to {args.output}, function logs in {log_path}\n")
+    if report.get("regressions"):
+        sys.stderr.write(f"Regressions against {args.baseline}: {json.dumps(report['regressions'], indent=2)}\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
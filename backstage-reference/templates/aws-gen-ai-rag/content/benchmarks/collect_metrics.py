@@ -0,0 +1,43 @@
+"""Summarize the per-stage metrics written by the lambda functions as EMF log lines.
+
+Every invocation of a function wrapped with rag_common.metrics.record_metrics logs
+the duration of its stages and its token and chunk counts as CloudWatch embedded
+metric format lines. This script reads log files (or stdin), keeps the EMF lines,
+whatever their prefix, and prints the histogram and percentiles of every metric,
+grouped by function.
+
+Run it from the template folder on the logs of a deployed app or of a local run:
+
+    sam logs --stack-name <stack> --start-time '10min ago' > app.log
+    PYTHONPATH=lambdas/common_layer python benchmarks/collect_metrics.py app.log
+
+Percentiles are the upper bounds of the histogram buckets, capped by the maximum.
+"""
+import argparse
+import fileinput
+import json
+import sys
+from rag_common.metrics import MetricsCollector
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("logs", nargs="*", help="Log files, stdin when none is given")
+    parser.add_argument("--output", help="Write the summary to this JSON file instead of stdout")
+    args = parser.parse_args(argv)
+
+    collector = MetricsCollector()
+    with fileinput.input(args.logs) as lines:
+        for line in lines:
+            collector.add_line(line)
+
+    summary = json.dumps({"emf_lines": collector.lines, "functions": collector.summary()}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(summary + "\n")
+    else:
+        sys.stdout.write(summary + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Measure the recall lost by storing embeddings with a compact index profile.
+
+The documents are split like the Index Lambda splits them, and the chunks and the
+questions are embedded and encoded with a baseline profile (full precision Titan v1
+by default) and with a candidate profile. For every question the k nearest chunks
+are found by exact search in both representations, and recall@k is the share of the
+baseline neighbors the candidate also returns. Exact search isolates the loss due
+to the representation from the loss due to the HNSW parameters of the profiles.
+
+Run it from the template folder with AWS credentials allowing Bedrock calls:
+
+    pip install -r lambdas/index_data_lambda/requirements.txt numpy
+    PYTHONPATH=lambdas/common_layer:lambdas/index_data_lambda REGION=<region> \\
+        EMBEDDING_CACHE_PATH=.embedding-cache.sqlite \\
+        python benchmarks/recall_loss.py --documents sample-files --profile compact_byte
+
+Embeddings are cached in the SQLite file, so runs after the first one only call
+Bedrock for new chunks. Custom profiles are passed as JSON with --profile-json.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import numpy as np
+from embedding_engine import EmbeddingEngine
+from text_splitter import RecursiveCharacterTextSplitter
+from rag_common.index_profiles import IndexProfile, get_index_profile
+
+BYTES_PER_DIMENSION = {"float": 4, "fp16": 2, "byte": 1}
+
+
+class _StaticConfig:
+    """Configuration holding only the custom profiles given on the command line."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+
+def load_chunks(documents_path, chunk_size, chunk_overlap):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    chunks = []
+    for root, _, files in os.walk(documents_path):
+        for file_name in sorted(files):
+            if file_name.endswith(".txt"):
+                with open(os.path.join(root, file_name), encoding="utf-8", errors="replace") as document:
+                    chunks.extend(splitter.split_text(document.read()))
+    return chunks
+
+
+def sample_questions(chunks, count, seed):
+    """Use the first sentence of randomly chosen chunks as questions."""
+    rng = random.Random(seed)
+    questions = []
+    for chunk in rng.sample(chunks, min(count, len(chunks))):
+        sentence = re.split(r"(?<=[.!?])\s", chunk.strip(), maxsplit=1)[0]
+        questions.append(sentence[:300])
+    return questions
+
+
+def embed(profile, texts, region_name):
+    engine = EmbeddingEngine(
+        region_name,
+        model_id=profile.embedding_model,
+        model_kwargs=profile.embedding_kwargs(),
+        cache_id=profile.embedding_cache_id,
+    )
+    return np.asarray([profile.encode_vector(vector) for vector in engine.embed(texts)], dtype=np.float32)
+
+
+def nearest(profile, chunk_vectors, question_vectors, k):
+    """Return the indices of the k nearest chunks of every question, with the metric of the profile."""
+    if profile.space_type == "cosinesimil":
+        chunk_vectors = chunk_vectors / np.maximum(np.linalg.norm(chunk_vectors, axis=1, keepdims=True), 1e-12)
+        question_vectors = question_vectors / np.maximum(np.linalg.norm(question_vectors, axis=1, keepdims=True), 1e-12)
+    scores = question_vectors @ chunk_vectors.T
+    if profile.space_type == "l2":
+        # Ranking by -|q - c|^2 is ranking by 2 q.c - |c|^2
+        scores = 2 * scores - np.sum(chunk_vectors ** 2, axis=1)
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall_at(baseline, candidate, k):
+    hits = [len(set(expected[:k]) & set(found[:k])) / min(k, len(expected)) for expected, found in zip(baseline, candidate)]
+    return round(float(np.mean(hits)), 4) if hits else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", required=True, help="Folder of .txt documents, searched recursively")
+    parser.add_argument("--profile", required=True, help="Index profile to evaluate")
+    parser.add_argument("--baseline", default="high_recall", help="Full precision index profile to compare with")
+    parser.add_argument("--profile-json", action="append", default=[], metavar="NAME=JSON", help="Custom index profile")
+    parser.add_argument("--questions", help="File with one question per line, sampled from the chunks by default")
+    parser.add_argument("--sample-questions", type=int, default=50)
+    parser.add_argument("--k", default="1,3,10", help="Comma separated values of k")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--chunk-overlap", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report to this JSON file instead of stdout")
+    args = parser.parse_args(argv)
+
+    custom = {}
+    for value in args.profile_json:
+        name, profile_json = value.split("=", 1)
+        custom[f"index_profiles/{name}"] = profile_json
+    config = _StaticConfig(custom)
+    baseline = get_index_profile(config, args.baseline)
+    candidate = get_index_profile(config, args.profile)
+
+    chunks = load_chunks(args.documents, args.chunk_size, args.chunk_overlap)
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as questions_file:
+            questions = [line.strip() for line in questions_file if line.strip()]
+    else:
+        questions = sample_questions(chunks, args.sample_questions, args.seed)
+    ks = sorted(int(k) for k in args.k.split(","))
+    region_name = os.environ["REGION"]
+
+    neighbors = {}
+    for profile in (baseline, candidate):
+        chunk_vectors = embed(profile, chunks, region_name)
+        question_vectors = embed(profile, questions, region_name)
+        neighbors[profile.name] = nearest(profile, chunk_vectors, question_vectors, max(ks))
+
+    report = {
+        "documents": args.documents,
+        "chunks": len(chunks),
+        "questions": len(questions),
+        "baseline": _describe(baseline),
+        "profile": _describe(candidate),
+        "recall": {f"recall@{k}": recall_at(neighbors[baseline.name], neighbors[candidate.name], k) for k in ks},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+def _describe(profile: IndexProfile):
+    return {
+        "name": profile.name,
+        "embedding_model": profile.embedding_model,
+        "dimension": profile.dimension,
+        "data_type": profile.data_type,
+        "space_type": profile.space_type,
+        "vector_bytes": profile.dimension * BYTES_PER_DIMENSION[profile.data_type],
+    }
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""Benchmark the ingestion and retrieval code paths of the lambda functions offline.
+
+The Index, Retrieval and Response Lambda handlers run in this process against the
+local stand-ins of benchmarks/stand_ins.py, with the documents of sample-files as
+the content of the data bucket. The suite reports:
+
+- chunking: S3 range reads and text splitting throughput
+- embedding: throughput of the embedding engine, in chunks and batches per second
+- indexing: end to end throughput of the Index Lambda, in documents and chunks per second
+- retrieval: latency percentiles of the Retrieval Lambda and recall@k on benchmarks/questions.json
+- response: latency percentiles of the Response Lambda
+
+The per-stage metrics the functions log as EMF lines (see rag_common.metrics) are
+collected for the indexing, retrieval and response sections and reported as
+histograms under `stages`, they are not compared with the baseline.
+
+A question is recalled at k when one of its first k chunks contains its expected
+text. The app parameters are read from events/set-configuration.json, and can be
+overridden with --param. The report is written as JSON, and compared with the
+report of a previous run with --baseline, which makes the run fail when a metric
+regressed by more than --tolerance.
+
+Run it from the template folder, no AWS account is needed:
+
+    pip install -r lambdas/index_data_lambda/requirements.txt numpy aws-lambda-powertools aws-xray-sdk
+    python benchmarks/run_benchmarks.py --output benchmark-results.json
+
+Set --bedrock-latency-ms, --opensearch-latency-ms and --s3-latency-ms to add a fixed latency to
+every call to the stand-ins. With --vector-store local the indices are kept by the
+embedded vector store in a temporary folder instead of the OpenSearch stand-in.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+
+CONTENT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS_PATH = os.path.join(CONTENT_PATH, "lambdas")
+BENCHMARKS_PATH = os.path.join(CONTENT_PATH, "benchmarks")
+
+REPORT_SCHEMA_VERSION = 1
+BUCKET_NAME = "benchmark-data-bucket"
+# Latency changes smaller than this are timer noise, whatever their relative size
+MIN_LATENCY_CHANGE_MS = 1.0
+
+# Parameters of the benchmark that differ from the sample configuration
+PARAMETER_OVERRIDES = {
+    "topics": "['amazon', 'apple', 'google', 'meta']",
+    # Small enough chunks for recall@k to distinguish retrieval quality
+    "chunk_size": "2000",
+    "chunk_overlap": "200",
+    # The stand-ins have no quota, indexing is measured without the production cap
+    "bedrock_ingestion_max_rps": "0",
+}
+
+
+@dataclass
+class LambdaContext:
+    function_name: str
+    memory_limit_in_mb: int = 1024
+    aws_request_id: str = ""
+    timeout_ms: int = 900000
+
+    @property
+    def invoked_function_arn(self):
+        return f"arn:aws:lambda:us-east-1:123456789012:function:{self.function_name}"
+
+    def get_remaining_time_in_millis(self):
+        return self.timeout_ms
+
+
+def load_parameters(overrides):
+    """Return the sample configuration of events/set-configuration.json as SSM string values."""
+    with open(os.path.join(CONTENT_PATH, "events", "set-configuration.json")) as configuration_file:
+        # The sample documents optional parameters with // comments
+        text = "\n".join(line for line in configuration_file if not line.strip().startswith("//"))
+    parameters = {}
+    for name, value in json.loads(text)["parameters"].items():
+        parameters[name] = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+    parameters.update(PARAMETER_OVERRIDES)
+    parameters.update(overrides)
+    return parameters
+
+
+def load_documents(documents_path):
+    """Return the .txt files of `documents_path` keyed by their path, the S3 keys of the data bucket."""
+    objects = {}
+    for root, _, files in os.walk(documents_path):
+        for file_name in sorted(files):
+            if file_name.endswith(".txt"):
+                path = os.path.join(root, file_name)
+                with open(path, "rb") as document:
+                    objects[os.path.relpath(path, documents_path).replace(os.sep, "/")] = document.read()
+    return objects
+
+
+def percentiles(latencies_ms):
+    ordered = sorted(latencies_ms)
+
+    def rank(percentile):
+        # Nearest rank percentile
+        return round(ordered[max(0, -(-len(ordered) * percentile // 100) - 1)], 2)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": rank(50),
+        "p90_ms": rank(90),
+        "p99_ms": rank(99),
+        "max_ms": round(ordered[-1], 2),
+        "mean_ms": round(sum(ordered) / len(ordered), 2),
+    }
+
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text.replace("’", "'")).strip()
+
+
+def benchmark_chunking(index_lambda, s3, objects, s3_read_bytes):
+    from s3_stream import read_text_ranges, split_text_stream
+
+    chunks = {}
+    started = time.perf_counter()
+    for key in objects:
+        text_ranges = read_text_ranges(s3, BUCKET_NAME, key, s3_read_bytes)
+        chunks[key] = [chunk for texts, _ in split_text_stream(text_ranges, index_lambda.get_text_splitter()) for chunk in texts]
+    seconds = time.perf_counter() - started
+    total_bytes = sum(len(content) for content in objects.values())
+    chunk_count = sum(len(texts) for texts in chunks.values())
+    return chunks, {
+        "documents": len(objects),
+        "bytes": total_bytes,
+        "chunks": chunk_count,
+        "seconds": round(seconds, 3),
+        "megabytes_per_second": round(total_bytes / seconds / 1e6, 2),
+        "chunks_per_second": round(chunk_count / seconds, 2),
+    }
+
+
+def benchmark_embedding(index_lambda, config, texts):
+    from embedding_engine import EmbeddingEngine
+    from rag_common.index_profiles import get_index_profile
+
+    profile = get_index_profile(config)
+    engine = EmbeddingEngine(
+        os.environ["REGION"],
+        model_id=profile.embedding_model,
+        batch_size=config.get_int("embedding_batch_size"),
+        max_workers=config.get_int("embedding_concurrency"),
+        model_kwargs=profile.embedding_kwargs(),
+        # A cache of its own, so every text is embedded and the Index Lambda cache stays cold
+        cache_id=f"benchmark-{uuid.uuid4()}",
+    )
+    batches = []
+    embed_batch = engine._embed_batch
+
+    def counted_batch(batch):
+        batches.append(len(batch))
+        return embed_batch(batch)
+
+    engine._embed_batch = counted_batch
+    _, elapsed_ms = _timed(engine.embed, texts)
+    seconds = elapsed_ms / 1000
+    return {
+        "index_profile": profile.name,
+        "chunks": len(texts),
+        "batches": len(batches),
+        "seconds": round(seconds, 3),
+        "chunks_per_second": round(len(texts) / seconds, 2),
+        "batches_per_second": round(len(batches) / seconds, 2),
+    }
+
+
+def benchmark_indexing(index_lambda, objects):
+    latencies = []
+    indexed = failed = 0
+    for number, key in enumerate(objects):
+        event = {
+            "Records": [{
+                "eventVersion": "2.1",
+                "eventSource": "aws:s3",
+                "eventName": "ObjectCreated:Put",
+                "s3": {
+                    "bucket": {"name": BUCKET_NAME},
+                    "object": {"key": key, "size": len(objects[key])},
+                },
+            }]
+        }
+        context = LambdaContext("index-data", aws_request_id=f"index-{number}")
+        results, elapsed_ms = _timed(index_lambda.lambda_handler, event, context)
+        latencies.append(elapsed_ms)
+        for result in results:
+            if not isinstance(result, dict) or "indexed" not in result:
+                raise RuntimeError(f"Indexing {key} failed: {result}")
+            indexed += result["indexed"]
+            failed += result["failed"]
+    seconds = sum(latencies) / 1000
+    return {
+        "documents": len(objects),
+        "chunks_indexed": indexed,
+        "chunks_failed": failed,
+        "seconds": round(seconds, 3),
+        "documents_per_second": round(len(objects) / seconds, 3),
+        "chunks_per_second": round(indexed / seconds, 2),
+        "document_latency": percentiles(latencies),
+    }
+
+
+def benchmark_retrieval(retrieval_lambda, questions, ks, repetitions):
+    """Run every question `repetitions` times, the first run of a question embeds it."""
+    latencies = []
+    retrieved = []
+    for number, question in enumerate(questions):
+        event = {"message": question["question"], "index": question["index"]}
+        for repetition in range(repetitions):
+            context = LambdaContext("retrieval", aws_request_id=f"retrieval-{number}-{repetition}")
+            response, elapsed_ms = _timed(retrieval_lambda.lambda_handler, event, context)
+            if response["statusCode"] != 200:
+                raise RuntimeError(f"Retrieval of {event} failed: {response}")
+            latencies.append(elapsed_ms)
+        retrieved.append(json.loads(response["body"])["response"])
+
+    recall = {}
+    for k in ks:
+        hits = [
+            any(_normalize(question["expected"]) in _normalize(document["page_content"]) for document in documents[:k])
+            for question, documents in zip(questions, retrieved)
+        ]
+        recall[f"recall@{k}"] = round(sum(hits) / len(hits), 4)
+    return retrieved, {"questions": len(questions), "repetitions": repetitions, **percentiles(latencies), **recall}
+
+
+def benchmark_response(response_lambda, questions, retrieved, repetitions):
+    latencies = []
+    for number, (question, documents) in enumerate(zip(questions, retrieved)):
+        event = {"message": question["question"], "response": documents}
+        for repetition in range(repetitions):
+            context = LambdaContext("response", aws_request_id=f"response-{number}-{repetition}")
+            response, elapsed_ms = _timed(response_lambda.lambda_handler, event, context)
+            if response.get("statusCode", 200) != 200:
+                raise RuntimeError(f"Response to {question['question']} failed: {response}")
+            latencies.append(elapsed_ms)
+    return {"questions": len(questions), "repetitions": repetitions, **percentiles(latencies)}
+
+
+def compare(results, baseline, tolerance):
+    """Return the metrics of `results` that are worse than in `baseline` by more than `tolerance`.
+
+    Throughputs and recall are expected not to decrease, latencies not to increase.
+    """
+    regressions = []
+    for section, metrics in results.items():
+        for name, value in _flatten(metrics):
+            previous = dict(_flatten(baseline.get(section, {}))).get(name)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+                continue
+            change = (value - previous) / previous
+            if name.endswith("_ms"):
+                regressed = change > tolerance and value - previous >= MIN_LATENCY_CHANGE_MS
+            elif name.endswith("_per_second") or name.startswith("recall@"):
+                regressed = -change > tolerance
+            else:
+                continue
+            if regressed:
+                regressions.append({"metric": f"{section}.{name}", "baseline": previous, "value": value, "change": round(change, 4)})
+    return regressions
+
+
+def _flatten(metrics, prefix=""):
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{name}.")
+        else:
+            yield f"{prefix}{name}", value
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=CONTENT_PATH, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _prepare_environment(log_level, vector_store):
+    os.environ.update({
+        "VECTOR_STORE": vector_store,
+        "APP_NAME": "benchmark",
+        "REGION": "us-east-1",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "OPENSEARCH_ENDPOINT": "localhost",
+        # The parameters do not change during a run
+        "CONFIG_TTL_SECONDS": "3600",
+        "POWERTOOLS_TRACE_DISABLED": "true",
+        "POWERTOOLS_LOG_LEVEL": log_level,
+    })
+    # Only the in-memory embedding cache is used, so every run starts cold
+    os.environ.pop("EMBEDDING_CACHE_TABLE", None)
+    os.environ.pop("EMBEDDING_CACHE_PATH", None)
+    if vector_store == "local":
+        os.environ["VECTOR_STORE_PATH"] = tempfile.mkdtemp(prefix="benchmark-vector-store-")
+    for path in (
+        os.path.join(LAMBDAS_PATH, "common_layer"),
+        os.path.join(LAMBDAS_PATH, "index_data_lambda"),
+        os.path.join(LAMBDAS_PATH, "retrieval_lambda"),
+        os.path.join(LAMBDAS_PATH, "response_lambda"),
+        BENCHMARKS_PATH,
+    ):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", default=os.path.join(CONTENT_PATH, "sample-files"))
+    parser.add_argument("--questions", default=os.path.join(BENCHMARKS_PATH, "questions.json"))
+    parser.add_argument("--output", default="benchmark-results.json", help="Path of the JSON report")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE", help="Override an app parameter")
+    parser.add_argument("--k", default="1,3,5", help="Comma separated values of k for recall@k")
+    parser.add_argument("--repetitions", type=int, default=5, help="Runs of every question")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=0)
+    parser.add_argument("--opensearch-latency-ms", type=float, default=0)
+    parser.add_argument("--s3-latency-ms", type=float, default=0)
+    parser.add_argument("--baseline", help="Report of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change reported as a regression")
+    parser.add_argument("--vector-store", choices=("opensearch", "local"), default="opensearch")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the lambda functions")
+    args = parser.parse_args(argv)
+
+    _prepare_environment(args.log_level, args.vector_store)
+    import stand_ins
+
+    ks = sorted(int(k) for k in args.k.split(","))
+    overrides = dict(value.split("=", 1) for value in args.param)
+    # Retrieval returns enough chunks for the largest k
+    overrides.setdefault("relevant_documents_count", str(ks[-1]))
+    parameters = load_parameters(overrides)
+    objects = load_documents(args.documents)
+    with open(args.questions) as questions_file:
+        questions = json.load(questions_file)
+
+    bedrock_runtime = stand_ins.LocalBedrockRuntime(latency_ms=args.bedrock_latency_ms)
+    s3 = stand_ins.LocalS3(objects, latency_ms=args.s3_latency_ms)
+    stand_ins.install(
+        ssm=stand_ins.LocalSSM({f"/opa/gen-ai/{os.environ['APP_NAME']}/{name}": value for name, value in parameters.items()}),
+        s3=s3,
+        bedrock_runtime=bedrock_runtime,
+        opensearch=stand_ins.LocalOpenSearch(latency_ms=args.opensearch_latency_ms),
+    )
+
+    # The functions create their clients when they are imported, like in a cold container
+    index_lambda = importlib.import_module("index_data_lambda")
+    retrieval_lambda = importlib.import_module("retrieval_lambda")
+    response_lambda = importlib.import_module("generate_response_lambda")
+
+    from rag_common.metrics import MetricsCollector, set_sink
+
+    def collect_stages(section, benchmark, *args):
+        collector = MetricsCollector()
+        previous_sink = set_sink(collector.add_line)
+        try:
+            return benchmark(*args)
+        finally:
+            set_sink(previous_sink)
+            stages[section] = {name: histogram for metrics in collector.summary().values() for name, histogram in metrics.items()}
+
+    results = {}
+    stages = {}
+    chunks, results["chunking"] = benchmark_chunking(index_lambda, s3, objects, index_lambda.config.get_int("s3_read_bytes"))
+    results["embedding"] = benchmark_embedding(index_lambda, index_lambda.config, [text for texts in chunks.values() for text in texts])
+    results["indexing"] = collect_stages("indexing", benchmark_indexing, index_lambda, objects)
+    retrieved, results["retrieval"] = collect_stages(
+        "retrieval", benchmark_retrieval, retrieval_lambda, questions, ks, args.repetitions
+    )
+    results["response"] = collect_stages("response", benchmark_response, response_lambda, questions, retrieved, args.repetitions)
+
+    report = {
+        "schema_version": REPORT_SCHEMA_VERSION,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": _git_commit(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {
+            "documents": os.path.relpath(args.documents, CONTENT_PATH),
+            "questions": os.path.relpath(args.questions, CONTENT_PATH),
+            "repetitions": args.repetitions,
+            "vector_store": args.vector_store,
+            "bedrock_latency_ms": args.bedrock_latency_ms,
+            "opensearch_latency_ms": args.opensearch_latency_ms,
+            "s3_latency_ms": args.s3_latency_ms,
+            "parameters": {name: value for name, value in parameters.items() if name != "response_prompt"},
+        },
+        "bedrock_calls": dict(bedrock_runtime.calls),
+        "results": results,
+        "stages": stages,
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        report["baseline"] = {"git_commit": baseline.get("git_commit"), "tolerance": args.tolerance}
+        report["regressions"] = compare(results, baseline.get("results", {}), args.tolerance)
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+        output_file.write("\n")
+
+    summary = {section: {name: value for name, value in metrics.items() if not isinstance(value, dict)} for section, metrics in results.items()}
+    sys.stderr.write(json.dumps(summary, indent=2) + "\n")
+    sys.stderr.write(f"Report written to {args.output}\n")
+    if report.get("regressions"):
+        sys.stderr.write(f"Regressions against {args.baseline}: {json.dumps(report['regressions'], indent=2)}\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+"""Deterministic local stand-ins for the AWS services used by the lambda functions.
+
+They implement the subset of the SSM, S3, Bedrock runtime and OpenSearch client
+APIs the functions call, in memory, so the benchmarks measure the code of the
+functions rather than the network. Every call can be given a fixed latency to
+approximate a deployed environment.
+
+Embeddings are hashed bags of words: every word of a text adds a signed weight
+to one dimension chosen by its hash, and the vector is normalized. Texts sharing
+words get similar vectors, so retrieval quality is meaningful and reproducible
+while no model is involved.
+"""
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from unittest import mock
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Default index.max_result_window of OpenSearch, the deepest page a from/size search can reach
+MAX_RESULT_WINDOW = 10000
+STOP_WORDS = frozenset(
+    "a an and are as at be by did do does for from has have how in is it its of on or our that the their "
+    "this to was were what which who why will with".split()
+)
+
+
+class _Latency:
+    def __init__(self, latency_ms):
+        self.seconds = latency_ms / 1000
+
+    def wait(self):
+        if self.seconds:
+            time.sleep(self.seconds)
+
+
+def hashed_embedding(text, dimension):
+    """Return the deterministic unit vector of `text` with `dimension` dimensions."""
+    vector = [0.0] * dimension
+    words = Counter(word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS)
+    for word, count in words.items():
+        digest = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        sign = 1.0 if digest & 1 else -1.0
+        vector[(digest >> 1) % dimension] += sign * (1.0 + math.log(count))
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class LocalSSM:
+    """Parameter store holding string parameters in a dict."""
+
+    def __init__(self, parameters=None):
+        self.parameters = dict(parameters or {})
+        self._lock = threading.Lock()
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "get_parameters_by_path"
+        return self
+
+    def paginate(self, Path, Recursive=True):
+        with self._lock:
+            parameters = [
+                {"Name": name, "Value": value, "Type": "String"}
+                for name, value in sorted(self.parameters.items())
+                if name.startswith(Path) and (Recursive or "/" not in name[len(Path):])
+            ]
+        yield {"Parameters": parameters}
+
+    def get_parameter(self, Name):
+        with self._lock:
+            return {"Parameter": {"Name": Name, "Value": self.parameters[Name], "Type": "String"}}
+
+    def put_parameter(self, Name, Value, Type="String", Overwrite=False):
+        with self._lock:
+            self.parameters[Name] = Value
+        return {"Version": 1}
+
+
+class LocalS3:
+    """Read-only bucket serving the files of a local folder, keyed by their relative path."""
+
+    def __init__(self, objects, latency_ms=0):
+        self.objects = dict(objects)
+        self._latency = _Latency(latency_ms)
+
+    def head_object(self, Bucket, Key):
+        self._latency.wait()
+        content = self.objects[Key]
+        return {"ContentLength": len(content), "ETag": f'"{hashlib.md5(content).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        self._latency.wait()
+        content = self.objects[Key]
+        if IfMatch and IfMatch != f'"{hashlib.md5(content).hexdigest()}"':
+            raise RuntimeError(f"PreconditionFailed: {Key} changed")
+        if Range:
+            start, end = (int(value) for value in Range[len("bytes="):].split("-"))
+            content = content[start:end + 1]
+        return {"Body": io.BytesIO(content), "ContentLength": len(content)}
+
+
+class LocalBedrockRuntime:
+    """Titan embeddings and Claude completions computed locally.
+
+    Completions repeat the first words of the documents of the prompt, so their
+    length and the number of streamed tokens are stable between runs. Streams end
+    with the invocation metrics of Bedrock, counting words as tokens.
+    """
+
+    def __init__(self, latency_ms=0, answer_words=60, words_per_chunk=3):
+        self.answer_words = answer_words
+        self.words_per_chunk = words_per_chunk
+        self.calls = Counter()
+        self._latency = _Latency(latency_ms)
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, accept=None, contentType=None):
+        self._count("invoke_model")
+        self._latency.wait()
+        request = json.loads(body)
+        if "inputText" in request:
+            dimension = request.get("dimensions", 1536)
+            result = {"embedding": hashed_embedding(request["inputText"], dimension), "inputTextTokenCount": 0}
+        else:
+            result = {"completion": "".join(self._answer(request["prompt"])), "stop_reason": "stop_sequence"}
+        return {"body": io.BytesIO(json.dumps(result).encode()), "contentType": "application/json"}
+
+    def invoke_model_with_response_stream(self, modelId, body, accept=None, contentType=None):
+        self._count("invoke_model_with_response_stream")
+        self._latency.wait()
+        prompt = json.loads(body)["prompt"]
+        payloads = [{"completion": chunk} for chunk in self._answer(prompt)]
+        payloads[-1]["amazon-bedrock-invocationMetrics"] = {
+            "inputTokenCount": len(prompt.split()),
+            "outputTokenCount": sum(len(payload["completion"].split()) for payload in payloads),
+        }
+        return {"body": [{"chunk": {"bytes": json.dumps(payload).encode()}} for payload in payloads]}
+
+    def _answer(self, prompt):
+        documents = re.findall(r"<document>(.*?)</document>", prompt, flags=re.S)
+        words = " ".join(documents).split()[:self.answer_words] or ["No", "documents."]
+        return [
+            " " + " ".join(words[i:i + self.words_per_chunk])
+            for i in range(0, len(words), self.words_per_chunk)
+        ]
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+
+class _LocalIndices:
+    def __init__(self, store):
+        self._store = store
+
+    def exists(self, index):
+        self._store._latency.wait()
+        return index in self._store.local_indices
+
+    def create(self, index, body=None):
+        from rag_common.opensearch import RequestError
+
+        self._store._latency.wait()
+        with self._store._lock:
+            if index in self._store.local_indices:
+                raise RequestError(400, "resource_already_exists_exception", {})
+            self._store.local_indices[index] = _LocalIndex((body or {}).get("mappings", {}))
+        return {"acknowledged": True, "index": index}
+
+    def delete(self, index):
+        self._store._latency.wait()
+        with self._store._lock:
+            self._store._get(index)
+            del self._store.local_indices[index]
+        return {"acknowledged": True}
+
+    def get_mapping(self, index):
+        self._store._latency.wait()
+        return {index: {"mappings": self._store._get(index).mappings}}
+
+
+class _LocalIndex:
+    def __init__(self, mappings):
+        self.mappings = mappings
+        self.documents = {}
+        self._matrix = None
+        self._ids = None
+
+    @property
+    def space_type(self):
+        vector_field = next(
+            (field for field in self.mappings.get("properties", {}).values() if field.get("type") == "knn_vector"), {}
+        )
+        return vector_field.get("method", {}).get("space_type", "l2")
+
+    def vectors(self, field):
+        """Return the ids and the matrix of the vectors of `field`, rebuilt after every write."""
+        import numpy as np
+
+        if self._matrix is None:
+            self._ids = [doc_id for doc_id, source in self.documents.items() if field in source]
+            self._matrix = np.asarray([self.documents[doc_id][field] for doc_id in self._ids], dtype=np.float32)
+        return self._ids, self._matrix
+
+
+class LocalOpenSearch:
+    """Vector store answering knn queries by exact search, with the scores of OpenSearch."""
+
+    def __init__(self, latency_ms=0):
+        self.local_indices = {}
+        # Index APIs, named like the namespace of the OpenSearch client
+        self.indices = _LocalIndices(self)
+        self._latency = _Latency(latency_ms)
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def bulk(self, body):
+        self._latency.wait()
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = []
+        with self._lock:
+            position = 0
+            while position < len(lines):
+                action, metadata = next(iter(lines[position].items()))
+                index = self.local_indices.get(metadata["_index"])
+                if action == "delete":
+                    found = index is not None and index.documents.pop(metadata["_id"], None) is not None
+                    items.append({"delete": {"_id": metadata["_id"], "status": 200 if found else 404,
+                                             "result": "deleted" if found else "not_found"}})
+                    position += 1
+                else:
+                    if index is None:
+                        index = self.local_indices[metadata["_index"]] = _LocalIndex({})
+                    doc_id = metadata.get("_id") or self._new_id()
+                    index.documents[doc_id] = lines[position + 1]
+                    items.append({action: {"_id": doc_id, "status": 201, "result": "created"}})
+                    position += 2
+                if index is not None:
+                    index._matrix = None
+        return {"errors": False, "items": items}
+
+    def search(self, index, body):
+        self._latency.wait()
+        local_index = self._get(index)
+        query = body.get("query", {})
+        with self._lock:
+            if "knn" in query:
+                hits = self._knn(local_index, query["knn"], body.get("size", 10))
+            elif "match_phrase" in query:
+                field, phrase = next(iter(query["match_phrase"].items()))
+                hits = [
+                    {"_id": doc_id, "_score": 1.0, "_source": source}
+                    for doc_id, source in local_index.documents.items()
+                    if phrase in (source.get(field) or "")
+                ]
+                start, size = body.get("from", 0), body.get("size", 10)
+                if start + size > MAX_RESULT_WINDOW:
+                    from rag_common.opensearch import RequestError
+
+                    raise RequestError(400, "illegal_argument_exception", {"reason": "Result window is too large"})
+                if "sort" in body:
+                    hits = self._sorted(hits, body["sort"], body.get("search_after"))
+                hits = hits[start:start + size]
+            elif "function_score" in query:
+                # Random sample of the documents, like the one the topic router takes
+                sample = random.sample(list(local_index.documents.items()), min(body.get("size", 10), len(local_index.documents)))
+                hits = [{"_id": doc_id, "_score": 1.0, "_source": source} for doc_id, source in sample]
+            else:
+                raise NotImplementedError(f"LocalOpenSearch does not support the query {list(query)}")
+        return {"hits": {"total": {"value": len(hits)}, "hits": [self._project(hit, body.get("_source")) for hit in hits]}}
+
+    def _knn(self, local_index, knn, size):
+        import numpy as np
+
+        field, parameters = next(iter(knn.items()))
+        ids, matrix = local_index.vectors(field)
+        if not ids:
+            return []
+        query = np.asarray(parameters["vector"], dtype=np.float32)
+        scores = _scores(local_index.space_type, matrix, query)
+        best = np.argsort(-scores)[:min(parameters["k"], size)]
+        return [{"_id": ids[i], "_score": float(scores[i]), "_source": local_index.documents[ids[i]]} for i in best]
+
+    @staticmethod
+    def _sorted(hits, sort, search_after):
+        """Sort `hits` in ascending order on the fields of `sort`, missing values first, and page them with `search_after`."""
+        fields = [next(iter(field)) if isinstance(field, dict) else field for field in sort]
+
+        def values(hit):
+            return [hit["_id"] if field == "_id" else hit["_source"].get(field) for field in fields]
+
+        def key(sort_values):
+            return [(value is not None, value or "") for value in sort_values]
+
+        hits = sorted(({**hit, "sort": values(hit)} for hit in hits), key=lambda hit: key(hit["sort"]))
+        if search_after is not None:
+            hits = [hit for hit in hits if key(hit["sort"]) > key(search_after)]
+        return hits
+
+    @staticmethod
+    def _project(hit, source_filter):
+        source = hit["_source"]
+        if isinstance(source_filter, list):
+            source = {key: value for key, value in source.items() if key in source_filter}
+        elif isinstance(source_filter, dict):
+            excludes = source_filter.get("excludes", [])
+            source = {key: value for key, value in source.items() if key not in excludes}
+        return {**hit, "_source": source}
+
+    def _get(self, index):
+        from rag_common.opensearch import NotFoundError
+
+        if index not in self.local_indices:
+            raise NotFoundError(404, "index_not_found_exception", {"index": index})
+        return self.local_indices[index]
+
+    def _new_id(self):
+        self._next_id += 1
+        return f"doc-{self._next_id}"
+
+
+def _scores(space_type, matrix, query):
+    """Score the vectors of `matrix` against `query` like the OpenSearch k-NN plugin."""
+    import numpy as np
+
+    if space_type == "cosinesimil":
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        cosine = matrix @ query / np.maximum(norms, 1e-12)
+        return (1 + cosine) / 2
+    if space_type == "innerproduct":
+        product = matrix @ query
+        return np.where(product >= 0, product + 1, 1 / (1 - product))
+    distances = np.sum((matrix - query) ** 2, axis=1)
+    return 1 / (1 + distances)
+
+
+def install(ssm, s3, bedrock_runtime, opensearch):
+    """Route the boto3 and OpenSearch clients created from now on to the stand-ins.
+
+    Returns the patchers, stop them to restore the real clients.
+    """
+    services = {"ssm": ssm, "s3": s3, "bedrock-runtime": bedrock_runtime}
+
+    def client(service_name, *args, **kwargs):
+        return services[service_name]
+
+    session = mock.Mock()
+    session.client.side_effect = client
+    session.get_credentials.return_value = None
+    patchers = [
+        mock.patch("boto3.client", side_effect=client),
+        mock.patch("boto3.Session", return_value=session),
+        mock.patch("rag_common.opensearch.OpenSearchClient", return_value=opensearch),
+    ]
+    for patcher in patchers:
+        patcher.start()
+    return patchers
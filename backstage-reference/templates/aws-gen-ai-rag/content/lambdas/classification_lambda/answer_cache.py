@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from rag_common.vectors import normalize
+
+
+class AnswerCache:
+    """In-memory cache of answers keyed by question embedding, per warm container.
+
+    An entry is reused for a new question when the cosine similarity of the two
+    question embeddings is at least `threshold`, the entry was stored with the same
+    settings digest and the indices it was answered from still have the same versions.
+    Entries expire after `ttl_seconds` and the least recently used entry is evicted
+    once `max_entries` are stored.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding, settings_digest, index_versions):
+        """Return the cached entry for the most similar question, or None.
+
+        `index_versions` is called with the indices an entry was stored with and returns
+        their current versions.
+        """
+        query = normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            for entry_id in [key for key, entry in self._entries.items() if entry["expires_at"] <= now]:
+                del self._entries[entry_id]
+            candidates = [
+                (entry_id, entry)
+                for entry_id, entry in self._entries.items()
+                if entry["settings_digest"] == settings_digest
+            ]
+
+            best = None
+            if candidates:
+                similarities = np.stack([entry["embedding"] for _, entry in candidates]) @ query
+                for position in np.argsort(similarities)[::-1]:
+                    if similarities[position] < self.threshold:
+                        break
+                    entry_id, entry = candidates[position]
+                    if entry["index_versions"] == index_versions(entry["indices"]):
+                        best = dict(entry, similarity=float(similarities[position]))
+                        self._entries.move_to_end(entry_id)
+                        break
+                    # An index changed since the answer was generated
+                    del self._entries[entry_id]
+
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best
+
+    def store(self, embedding, answer, indices, settings_digest, index_versions):
+        with self._lock:
+            self._entries[self._next_id] = {
+                "embedding": normalize(embedding),
+                "answer": answer,
+                "indices": indices,
+                "settings_digest": settings_digest,
+                "index_versions": index_versions,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -1,36 +1,134 @@
 import os
 import boto3
+import hashlib
 import json
 from aws_lambda_powertools import Logger, Tracer
 from aws_lambda_powertools.event_handler import APIGatewayHttpResolver, CORSConfig
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from langchain.llms import Bedrock
-from langchain.vectorstores import OpenSearchVectorSearch
-from opensearchpy import RequestsHttpConnection
+from rag_common.bedrock import BedrockCompletions
+from rag_common.config import get_app_config, VERSION_PARAMETER
+from rag_common.clients import get_client, get_bedrock_runtime_client
+from rag_common.context_packer import estimate_tokens
+from rag_common.index_profiles import DEFAULT_PROFILE, IndexProfile
+from rag_common.index_versions import get_index_versions
+from rag_common.metrics import add_metric, get_recorder, record_metrics, timed
+from rag_common.payload_logging import log_payload, payload_logging
+from rag_common.rate_limiter import BedrockUnavailableError, too_many_requests
+from rag_common.stages import get_embeddings, get_index_profile_of
+from rag_common.vector_store import get_vector_store
+from answer_cache import AnswerCache
+from topic_router import TopicRouter, index_name_for_topic
+from pipeline import InProcessStages, LambdaStages, run_stages, LAMBDA_MODE
 
-param_values = {}
-params_to_retrieve = [ 'classification_prompt', 'topics', 'max_tokens_to_sample']
+tracer = Tracer()
+logger = Logger()
 
-ssm = boto3.client('ssm')
+# Optional parameters fall back to these defaults when they are not set in SSM
+param_defaults = {
+    'answer_cache_threshold': '0.95',
+    'answer_cache_ttl_seconds': '3600',
+    'answer_cache_size': '256',
+    'router_margin': '0.05',
+    'router_min_similarity': '0.0',
+    'router_sample_size': '1000',
+    'pipeline_mode': 'in_process',
+}
 
-app_name = os.environ["APP_NAME"]
+config = get_app_config(defaults=param_defaults)
 
-for param in params_to_retrieve:
-    param_name = f'/opa/gen-ai/{app_name}/{param}'
-    ssm_prompt_response = ssm.get_parameter(Name=param_name)
-    param_value = ssm_prompt_response['Parameter']['Value']
-    param_values[param] = param_value
+answer_cache = AnswerCache()
 
-prompt = param_values.get('classification_prompt')
-top = param_values.get('topics')
-max_tokens_to_sample = int(param_values.get('max_tokens_to_sample'))
 
-topics_str = top.strip("[]").strip()
-topics = [item.strip() for item in topics_str.split(",")]
+def get_topics():
+    topics_str = config.get('topics').strip("[]").strip()
+    return [item.strip() for item in topics_str.split(",")]
+
+
+def get_settings_digest():
+    """Digest of the parameters that shape an answer, so cached answers expire with them."""
+    settings = {
+        name: value
+        for name, value in config.values().items()
+        if name != VERSION_PARAMETER
+        and not name.startswith("answer_cache_")
+        and not name.startswith("router_")
+        and name != "pipeline_mode"
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def get_question_embedding(message_text):
+    return get_embeddings().embed_query(message_text)
+
+
+def index_versions_of(indices):
+    """Versions of every index an answer was retrieved from, so cached answers expire with them."""
+    index_versions = get_index_versions()
+    return tuple(index_versions.get(index_name) for index_name in indices)
+
+
+def get_topic_router():
+    router = get_client("topic_router", lambda: TopicRouter(get_vector_store()))
+    router.margin = config.get_float('router_margin')
+    router.min_similarity = config.get_float('router_min_similarity')
+    router.sample_size = config.get_int('router_sample_size')
+    return router
+
+
+def get_topic_embeddings(message_text, question_embedding, topics):
+    """Embed the question like the chunks of every topic index, once per embedding model and dimension.
+
+    `question_embedding` is the question embedded with the default profile. Indices whose
+    profile cannot be read are left out, and the router falls back to the LLM for them.
+    """
+    by_embedding = {IndexProfile(DEFAULT_PROFILE).embedding_cache_id: question_embedding}
+    embeddings = {}
+    for index_name in dict.fromkeys(index_name_for_topic(topic) for topic in topics if topic.strip()):
+        try:
+            profile = get_index_profile_of(index_name)
+        except Exception as e:
+            logger.warning(f"Could not read the profile of index {index_name}: {e}")
+            continue
+        if profile.embedding_cache_id not in by_embedding:
+            by_embedding[profile.embedding_cache_id] = get_embeddings(profile).embed_query(message_text)
+        embeddings[index_name] = by_embedding[profile.embedding_cache_id]
+    return embeddings
+
+
+def route_question(message_text, question_embedding, topics):
+    """Pick the topic index from the embeddings of the question, or return None to ask the LLM."""
+    try:
+        router = get_topic_router()
+        embeddings = get_topic_embeddings(message_text, question_embedding, topics)
+        decision = router.route(embeddings, topics, get_index_versions().get)
+    except Exception as e:
+        logger.warning(f"Topic routing failed, falling back to the LLM: {e}")
+        return None, None
+    logger.info({"topic_routing": decision})
+    return router, decision
+
+
+def get_pipeline_stages():
+    """Return the retrieval and response stages for the configured pipeline_mode."""
+    if config.get('pipeline_mode') == LAMBDA_MODE:
+        return get_client(
+            "lambda_stages",
+            lambda: LambdaStages(
+                boto3.client('lambda'),
+                os.environ["RETRIEVAL_FUNCTION"],
+                os.environ["RESPONSE_FUNCTION"],
+            ),
+        )
+    return InProcessStages()
+
+
+def response_headers():
+    return {
+        "Content-Type": "application/json",
+        "Server-Timing": get_recorder().server_timing(),
+    }
 
-tracer = Tracer()
-logger = Logger()
 # CORS will match when Origin is only https://www.example.com
 cors_config = CORSConfig(allow_origin="*", max_age=300)
 
@@ -47,62 +145,90 @@ def get_relevant_documents(event, context):
         body = json.loads(event.get('body', '{}'))
         message_text = body.get("message", "")
 
-        if "operation_mode" in body:
-            operation_mode= body.get('operation_mode','inclusive')
+        operation_mode = body.get('operation_mode', 'inclusive')
+        question_embedding = None
 
-        
-        # Log message_text and other information
-        logger.info(f"Received message: {message_text}")
-        logger.info(f"Prompt: {prompt}")
+        if operation_mode == 'inclusive':
+            answer_cache.threshold = config.get_float('answer_cache_threshold')
+            answer_cache.ttl_seconds = config.get_int('answer_cache_ttl_seconds')
+            answer_cache.max_entries = config.get_int('answer_cache_size')
+            with timed("query_embedding"):
+                question_embedding = get_question_embedding(message_text)
+            with timed("answer_cache"):
+                settings_digest = get_settings_digest()
+                try:
+                    cached = answer_cache.lookup(question_embedding, settings_digest, index_versions_of)
+                except Exception as e:
+                    # Without the versions of the indices cached answers cannot be trusted
+                    logger.warning(f"Answer cache lookup failed: {e}")
+                    cached = None
+            if cached:
+                logger.info(f"Answer cache hit (similarity {cached['similarity']:.4f}, indices {cached['indices']})")
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps(cached["answer"]),
+                    "headers": response_headers()
+                }
+
+        prompt = config.get('classification_prompt')
+        topics = get_topics()
+        max_tokens_to_sample = config.get_int('max_tokens_to_sample')
+
+        log_payload("message", message_text)
         logger.info(f"Topics: {topics}")
         
-        model_id = "anthropic.claude-instant-v1"
-        bedrock_region = os.environ["REGION"]
-
-        llm = Bedrock(
-                model_id=model_id,
-                region_name=bedrock_region,
-                client=get_bedrock_client(),
-                model_kwargs={"max_tokens_to_sample": max_tokens_to_sample}
-            )
-        logger.info(llm)
-        
-        formatted_prompt = prompt.format(question=message_text, topics=topics, string=string)
-        response = llm._call(prompt=formatted_prompt)
-        
-        # Extract the index from the response
-        index = json.loads(response)["topic"]
-        
+        if question_embedding is None:
+            with timed("query_embedding"):
+                question_embedding = get_question_embedding(message_text)
+        with timed("topic_routing"):
+            router, decision = route_question(message_text, question_embedding, topics)
+        index = decision["index"] if decision else None
+        # Ranked candidates for fan-out retrieval, the chosen index is searched first
+        candidates = [candidate for candidate, _ in decision["candidates"]] if decision else []
+
+        if index is None:
+            with timed("classification_llm"):
+                model_id = "anthropic.claude-instant-v1"
+
+                model_kwargs = {"max_tokens_to_sample": max_tokens_to_sample}
+                llm = get_client(
+                    ("llm", model_id, json.dumps(model_kwargs, sort_keys=True)),
+                    lambda: BedrockCompletions(get_bedrock_client(), model_id, model_kwargs),
+                )
+
+                formatted_prompt = prompt.format(question=message_text, topics=topics, string=string)
+                completion = llm.complete(formatted_prompt)
+            add_metric("classification_prompt_tokens", completion.prompt_tokens or estimate_tokens(formatted_prompt))
+            add_metric("classification_completion_tokens", completion.completion_tokens or estimate_tokens(completion.text))
+
+            # Extract the index from the response
+            index = json.loads(completion.text)["topic"]
+            if decision:
+                router.record_fallback(decision, index)
+
         if operation_mode == 'inclusive':
             
-            logger.info("inclusive mode")
+            logger.info(f"inclusive mode, pipeline mode: {config.get('pipeline_mode')}")
 
-            retrieval_function = os.environ["RETRIEVAL_FUNCTION"]
-            response_function = os.environ["RESPONSE_FUNCTION"]
-            
-            
-            logger.info(f"retrieval function name: {retrieval_function}")
-        
-            # Call Retrieval Function
-            try:
-                response_documents = call_retrieval_function(retrieval_function, message_text, index)
-                logger.info(f"Retrieved documents: {response_documents}")
-            except Exception as e:
-                logger.error(f"Error occurred during document retrieval: {e}")
-                            
-            # Call Response Function 
-            try:
-                response_answer = call_response_function(response_function, message_text, response_documents)
-                logger.info(f"Answer to Q: {response_answer}")
-            except Exception as e:
-                logger.error(f"Error occurred during response generation: {e}")
+            result = run_stages(get_pipeline_stages(), message_text, index, candidates)
+            log_payload("answer", result.answer)
+            logger.info(f"Stage timings: {get_recorder().durations()}")
+
+            if result.error:
+                # The answer was generated with a prompt that does not follow the template
+                response_answer = result.to_payload()
+            else:
+                response_answer = json.dumps(result.answer)
+                searched = tuple(dict.fromkeys([index, *candidates]))
+                try:
+                    answer_cache.store(question_embedding, response_answer, searched, settings_digest, index_versions_of(searched))
+                except Exception as e:
+                    logger.warning(f"Answer not cached: {e}")
 
             return {
                 "statusCode": 200,
                 "body": json.dumps(response_answer),
-                "headers": {
-                    "Content-Type": "application/json"
-                }
+                "headers": response_headers()
             }
 
 
@@ -110,18 +236,20 @@ def get_relevant_documents(event, context):
             # Create the final response including both question and index
             final_response = {
                 "message": message_text,
-                "index": index
+                "index": index,
+                "indices": candidates
             }    
-            logger.info(final_response)
+            logger.info(f"{final_response}, stage timings: {get_recorder().durations()}")
     
             return {
                 "statusCode": 200,
                 "body": json.dumps(final_response),
-                "headers": {
-                    "Content-Type": "application/json"
-                }
+                "headers": response_headers()
             }
                 
+    except BedrockUnavailableError as e:
+        logger.warning(f"Bedrock unavailable: {e}")
+        return too_many_requests(e)
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         # Return an error response
@@ -134,8 +262,10 @@ def get_relevant_documents(event, context):
         }
 
 
-@logger.inject_lambda_context(log_event=True, correlation_id_path=correlation_paths.API_GATEWAY_REST)
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
 @tracer.capture_lambda_handler
+@record_metrics
+@payload_logging
 def lambda_handler(event: dict, context: LambdaContext) -> dict:
     # Extract the HTTP method from the event object
     http_method = event['httpMethod'].upper()
@@ -153,51 +283,4 @@ def lambda_handler(event: dict, context: LambdaContext) -> dict:
 
 @tracer.capture_method
 def get_bedrock_client():
-    region_name = os.environ["REGION"]
-    endpoint_url = f"https://bedrock-runtime.{region_name}.amazonaws.com"
-    return boto3.client(
-        "bedrock-runtime",
-        region_name=region_name,
-        endpoint_url=endpoint_url,
-    )
-    
-def call_retrieval_function(retrieval_functon, message, index):
-    client = boto3.client('lambda')
-
-    body = '{"message": "' + message + '", "index": "' + index + '"}'
-    logger.info(f"body: {body}")
-
-    
-    
-    retrieval_response = client.invoke(
-        FunctionName = retrieval_functon,
-        InvocationType = 'RequestResponse',
-        Payload = body
-        )
-        
-    payload = json.loads(retrieval_response['Payload'].read())
-    documents=payload["body"]
-    logger.info(documents)
-
-    return documents
-    
-    
-def call_response_function(response_functon, message, payload):
-    client = boto3.client('lambda')
-  
-    body = {"message": message}
-    body.update(json.loads(payload))
-    print(type(body))
-    
-    response_function_response = client.invoke(
-        FunctionName = response_functon,
-        InvocationType = 'RequestResponse',
-        Payload = json.dumps(body)
-        )
-        
-    answer = json.loads(response_function_response['Payload'].read())
-    logger.info(answer)
-    print(answer)
-    
-    return answer["body"]
-
+    return get_bedrock_runtime_client()
@@ -0,0 +1,71 @@
+import json
+from dataclasses import asdict
+from aws_lambda_powertools import Logger
+from rag_common.metrics import timed
+from rag_common.rate_limiter import raise_for_too_many_requests
+from rag_common.stages import (
+    ResponseRequest,
+    ResponseResult,
+    RetrievalRequest,
+    RetrievalResult,
+    generate_response,
+    retrieve_documents,
+)
+
+logger = Logger(child=True)
+
+IN_PROCESS_MODE = "in_process"
+LAMBDA_MODE = "lambda"
+
+
+class InProcessStages:
+    """Run the retrieval and response stages as library calls in this function."""
+
+    def retrieve(self, request: RetrievalRequest) -> RetrievalResult:
+        return retrieve_documents(request)
+
+    def respond(self, request: ResponseRequest) -> ResponseResult:
+        return generate_response(request)
+
+
+class LambdaStages:
+    """Run the retrieval and response stages by invoking their lambda functions."""
+
+    def __init__(self, lambda_client, retrieval_function, response_function):
+        self.lambda_client = lambda_client
+        self.retrieval_function = retrieval_function
+        self.response_function = response_function
+
+    def retrieve(self, request: RetrievalRequest) -> RetrievalResult:
+        with timed("invoke_retrieval"):
+            payload = self._invoke(self.retrieval_function, asdict(request))
+        raise_for_too_many_requests(payload)
+        if payload.get("statusCode") != 200:
+            raise RuntimeError(f"Retrieval function failed: {payload}")
+        return RetrievalResult.from_payload(json.loads(payload["body"]))
+
+    def respond(self, request: ResponseRequest) -> ResponseResult:
+        with timed("invoke_response"):
+            payload = self._invoke(self.response_function, request.to_payload())
+        raise_for_too_many_requests(payload)
+        if payload.get("statusCode", 200) != 200:
+            raise RuntimeError(f"Response function failed: {payload}")
+        return ResponseResult.from_payload(payload)
+
+    def _invoke(self, function_name, body):
+        response = self.lambda_client.invoke(
+            FunctionName=function_name,
+            InvocationType='RequestResponse',
+            Payload=json.dumps(body),
+        )
+        return json.loads(response['Payload'].read())
+
+
+def run_stages(stages, message, index, indices=()):
+    """Retrieve the documents of `index`, or of the ranked candidate `indices`, and generate the answer."""
+    with timed("retrieval"):
+        retrieval = stages.retrieve(RetrievalRequest(message=message, index=index, indices=list(indices)))
+    logger.info(f"Retrieved {len(retrieval.documents)} documents from index {index}")
+
+    with timed("response"):
+        return stages.respond(ResponseRequest(message=message, documents=retrieval.documents))
@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from aws_lambda_powertools import Logger
+from rag_common.metrics import add_metric
+from rag_common.vectors import normalize
+
+logger = Logger(child=True)
+
+# An index without a centroid, because it is empty or could not be read, is sampled again after this delay
+MISSING_CENTROID_RETRY_SECONDS = 300
+
+
+def index_name_for_topic(topic):
+    """Topics are stored as a quoted list in SSM, while index names are the lowercase folder names."""
+    return topic.strip().strip("'\"").lower()
+
+
+class TopicRouter:
+    """Route a question to a topic index by comparing its embedding with a centroid per index.
+
+    The centroid of an index is the normalized mean of a random sample of its chunk
+    embeddings. It is computed once per container and index version, so it is
+    refreshed after the index lambda publishes a new version of the index.
+    The question is compared with every centroid as embedded by the profile of that
+    index, so indices of different embedding models or dimensions are all candidates.
+
+    A question is routed when its best topic is at least `min_similarity` close and
+    beats the second best topic by at least `margin`. Otherwise the decision has no
+    index and the caller falls back to the LLM classification. The outcome of every call
+    is counted as a `router_<reason>` metric of the invocation, see rag_common.metrics.
+    """
+
+    def __init__(self, vector_store, margin=0.05, min_similarity=0.0, sample_size=1000):
+        self.vector_store = vector_store
+        self.margin = margin
+        self.min_similarity = min_similarity
+        self.sample_size = sample_size
+        self._centroids = {}
+        self._lock = threading.Lock()
+
+    def route(self, embeddings, topics, index_version):
+        """Return the routing decision for a question.
+
+        `embeddings` maps the index of every topic to the question embedded like the
+        chunks of that index, and `index_version` is called with an index name and
+        returns its current version. The decision is a dict with the chosen `index`
+        (None on fallback), the `reason`, every topic index in `candidates`, best first,
+        with its score, and the `margin` between the top two.
+        """
+        started = time.perf_counter()
+        index_names = list(dict.fromkeys(index_name_for_topic(topic) for topic in topics if topic.strip()))
+        centroids = self._get_centroids(index_names, index_version)
+
+        scores = {}
+        for name in index_names:
+            centroid = centroids.get(name)
+            query = normalize(embeddings[name]) if embeddings.get(name) is not None else None
+            # A question embedded with another model or dimension than the index cannot be compared
+            if centroid is not None and query is not None and centroid.shape == query.shape:
+                scores[name] = float(centroid @ query)
+        candidates = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        available = [name for name, _ in candidates]
+        top_score = candidates[0][1] if candidates else None
+        margin = candidates[0][1] - candidates[1][1] if len(candidates) > 1 else None
+
+        if not available or len(available) < len(index_names):
+            reason = "fallback_missing_centroid"
+        elif top_score < self.min_similarity:
+            reason = "fallback_low_similarity"
+        elif margin is not None and margin < self.margin:
+            reason = "fallback_low_margin"
+        else:
+            reason = "routed"
+
+        add_metric(f"router_{reason}", 1)
+        return {
+            "index": candidates[0][0] if reason == "routed" else None,
+            "reason": reason,
+            "candidates": candidates,
+            "margin": margin,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def record_fallback(self, decision, index):
+        """Record whether the LLM picked the router's best candidate, to tune the margin."""
+        if not decision["candidates"]:
+            return
+        agreed = decision["candidates"][0][0] == index_name_for_topic(index)
+        add_metric("router_fallback_agreed" if agreed else "router_fallback_disagreed", 1)
+
+    def _get_centroids(self, index_names, index_version):
+        versions = {name: index_version(name) for name in index_names}
+        now = time.monotonic()
+        with self._lock:
+            stale = [name for name in index_names if self._is_stale(name, versions[name], now)]
+        if stale:
+            with ThreadPoolExecutor(max_workers=min(len(stale), 8)) as executor:
+                computed = dict(zip(stale, executor.map(self._compute_centroid, stale)))
+            with self._lock:
+                for name, centroid in computed.items():
+                    self._centroids[name] = (versions[name], centroid, now)
+        with self._lock:
+            return {name: self._centroids[name][1] for name in index_names}
+
+    def _is_stale(self, index_name, version, now):
+        if index_name not in self._centroids:
+            return True
+        cached_version, centroid, computed_at = self._centroids[index_name]
+        if cached_version != version:
+            return True
+        return centroid is None and now - computed_at >= MISSING_CENTROID_RETRY_SECONDS
+
+    def _compute_centroid(self, index_name):
+        try:
+            vectors = self.vector_store.sample_vectors(index_name, self.sample_size)
+        except Exception as e:
+            logger.warning(f"Could not sample embeddings of index {index_name}: {e}")
+            return None
+
+        if not vectors:
+            logger.info(f"Index {index_name} has no embeddings to compute a centroid from")
+            return None
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        logger.info(f"Computed the centroid of index {index_name} from {len(vectors)} chunks")
+        return normalize(matrix.mean(axis=0))
@@ -0,0 +1 @@
+# Shared modules for the RAG lambda functions, deployed as a Lambda layer
@@ -0,0 +1,90 @@
+"""Embeddings and text completions with the bedrock-runtime client.
+
+The functions only need a few invoke_model calls, so they are made directly with
+boto3 rather than through an LLM framework. The request and response bodies are
+the ones of the Titan embedding models and of the Claude text completion API.
+Every call goes through the rate limiter of the container, within the budget of
+the client (see rag_common.rate_limiter).
+"""
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+from rag_common.rate_limiter import INTERACTIVE, get_rate_limiter
+
+
+def human_assistant_format(prompt):
+    """Wrap the prompt in the Human/Assistant turns expected by the Claude text completion API."""
+    if not prompt.startswith("\n\nHuman:"):
+        prompt = "\n\nHuman: " + prompt
+    if "\n\nAssistant:" not in prompt:
+        prompt += "\n\nAssistant:"
+    return prompt
+
+
+class BedrockEmbeddings:
+    """Titan embeddings of questions and documents, with the `embed_query` and `embed_documents` methods."""
+
+    def __init__(self, client, model_id, model_kwargs=None, budget=INTERACTIVE):
+        self.client = client
+        self.model_id = model_id
+        self.model_kwargs = dict(model_kwargs or {})
+        self.budget = budget
+
+    def embed_query(self, text):
+        # Line breaks are replaced like langchain did, so questions keep the vectors they had
+        return self._embed(text.replace(os.linesep, " "))
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def _embed(self, text):
+        def invoke():
+            response = self.client.invoke_model(
+                modelId=self.model_id,
+                body=json.dumps({**self.model_kwargs, "inputText": text}),
+                accept="application/json",
+                contentType="application/json",
+            )
+            return json.loads(response["body"].read())["embedding"]
+
+        return get_rate_limiter().call(self.model_id, invoke, self.budget)
+
+
+@dataclass
+class Completion:
+    text: str
+    # Token counts reported by Bedrock, None when the response does not carry them
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class BedrockCompletions:
+    """Claude text completions of a model with fixed `model_kwargs`, such as max_tokens_to_sample."""
+
+    def __init__(self, client, model_id, model_kwargs=None, budget=INTERACTIVE):
+        self.client = client
+        self.model_id = model_id
+        self.model_kwargs = dict(model_kwargs or {})
+        self.budget = budget
+
+    def complete(self, prompt) -> Completion:
+        def invoke():
+            return self.client.invoke_model(
+                modelId=self.model_id,
+                body=json.dumps({**self.model_kwargs, "prompt": human_assistant_format(prompt)}),
+                accept="application/json",
+                contentType="application/json",
+            )
+
+        response = get_rate_limiter().call(self.model_id, invoke, self.budget)
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        return Completion(
+            text=json.loads(response["body"].read())["completion"],
+            prompt_tokens=_int_or_none(headers.get("x-amzn-bedrock-input-token-count")),
+            completion_tokens=_int_or_none(headers.get("x-amzn-bedrock-output-token-count")),
+        )
+
+
+def _int_or_none(value):
+    return int(value) if value is not None else None
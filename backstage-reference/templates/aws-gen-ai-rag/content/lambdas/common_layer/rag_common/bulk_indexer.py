@@ -0,0 +1,119 @@
+import json
+import random
+import time
+from botocore.exceptions import HTTPClientError
+from aws_lambda_powertools import Logger
+from rag_common.opensearch import TransportError
+
+logger = Logger(child=True)
+
+# Statuses of the items of the _bulk API, and of whole requests, that are worth sending again
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def bulk_index(opensearch, index_name, documents, batch_size, batch_bytes, max_retries):
+    """Index documents through the OpenSearch _bulk API.
+
+    `documents` can be any iterable of document bodies, so chunks and vectors can be
+    streamed in without materializing the whole file. Requests are flushed whenever
+    `batch_size` documents or `batch_bytes` bytes are buffered. Only the items that
+    failed with a retryable status, and the requests that failed with a connection
+    error or a retryable status, are sent again. Other failed requests raise.
+
+    Returns a dict with the number of indexed and failed documents.
+    """
+    action = json.dumps({"index": {"_index": index_name}})
+    operations = (f"{action}\n{json.dumps(document)}\n" for document in documents)
+    result = _execute(opensearch, operations, batch_size, batch_bytes, max_retries)
+    return {"indexed": result["succeeded"], "failed": result["failed"]}
+
+
+def bulk_delete(opensearch, index_name, document_ids, batch_size, batch_bytes, max_retries):
+    """Delete documents by id through the OpenSearch _bulk API.
+
+    Returns a dict with the number of deleted and failed documents, and of the
+    documents that were already deleted (not_found), which are not counted as deleted.
+    """
+    operations = (
+        json.dumps({"delete": {"_index": index_name, "_id": document_id}}) + "\n"
+        for document_id in document_ids
+    )
+    result = _execute(opensearch, operations, batch_size, batch_bytes, max_retries)
+    return {"deleted": result["succeeded"], "failed": result["failed"], "not_found": result["not_found"]}
+
+
+def _execute(opensearch, operations, batch_size, batch_bytes, max_retries):
+    succeeded = 0
+    failed = 0
+    not_found = 0
+    for batch in _batches(operations, batch_size, batch_bytes):
+        batch_succeeded, batch_failed, batch_not_found = _send_with_retries(opensearch, batch, max_retries)
+        succeeded += batch_succeeded
+        failed += batch_failed
+        not_found += batch_not_found
+    return {"succeeded": succeeded, "failed": failed, "not_found": not_found}
+
+
+def _batches(operations, batch_size, batch_bytes):
+    batch = []
+    size = 0
+    for operation in operations:
+        operation_size = len(operation.encode("utf-8"))
+        if batch and (len(batch) >= batch_size or size + operation_size > batch_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(operation)
+        size += operation_size
+    if batch:
+        yield batch
+
+
+def _is_transient(error):
+    """Return True for the failures of a whole bulk request that are worth sending it again for."""
+    if isinstance(error, TransportError):
+        return error.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (HTTPClientError, ConnectionError, TimeoutError))
+
+
+def _send_with_retries(opensearch, batch, max_retries):
+    succeeded = 0
+    failed = 0
+    not_found = 0
+    pending = batch
+    attempt = 0
+    while pending:
+        retry = []
+        try:
+            response = opensearch.bulk(body="".join(pending))
+        except Exception as e:
+            # Requests rejected as a whole, such as with a 400 or 403 status, fail the same way again
+            if not _is_transient(e):
+                raise
+            logger.warning(f"Bulk request with {len(pending)} items failed: {e}")
+            retry = pending
+        else:
+            for operation, item in zip(pending, response["items"]):
+                result = next(iter(item.values()))
+                status = result.get("status", 500)
+                # A delete of a document that is already gone has the desired outcome, but deleted nothing
+                if result.get("result") == "not_found":
+                    not_found += 1
+                elif 200 <= status < 300:
+                    succeeded += 1
+                elif status in RETRYABLE_STATUSES:
+                    retry.append(operation)
+                else:
+                    logger.error(f"Bulk item rejected with status {status}: {result.get('error')}")
+                    failed += 1
+
+        if retry and attempt < max_retries:
+            attempt += 1
+            logger.info(f"Retrying {len(retry)} failed bulk items (attempt {attempt} of {max_retries})")
+            time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
+            pending = retry
+        else:
+            failed += len(retry)
+            pending = []
+
+    return succeeded, failed, not_found
@@ -0,0 +1,75 @@
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+_clients = {}
+# Reentrant, factories can create the clients they depend on through get_client
+_lock = threading.RLock()
+_session = None
+
+
+def get_client(key, factory):
+    """Return the client stored under `key`, calling `factory` only the first time.
+
+    Clients live as long as the warm container, so connections, TLS sessions and
+    client construction are reused by every invocation it serves.
+    """
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def get_session():
+    """Return the boto3 session shared by all clients of the container.
+
+    Its credentials are refreshed by botocore only when they are about to expire.
+    """
+    global _session
+    if _session is None:
+        _session = boto3.Session()
+    return _session
+
+
+def get_bedrock_runtime_client(max_pool_connections=10, region_name=None):
+    region_name = region_name or os.environ["REGION"]
+
+    def create():
+        return get_session().client(
+            "bedrock-runtime",
+            region_name=region_name,
+            endpoint_url=f"https://bedrock-runtime.{region_name}.amazonaws.com",
+            # Throttled calls are retried by the rate limiter, see rag_common.rate_limiter
+            config=Config(
+                tcp_keepalive=True,
+                max_pool_connections=max_pool_connections,
+                retries={"mode": "standard", "max_attempts": 1},
+            ),
+        )
+
+    return get_client(("bedrock-runtime", region_name, max_pool_connections), create)
+
+
+def get_opensearch_endpoint():
+    endpoint_url = os.environ["OPENSEARCH_ENDPOINT"]
+    return endpoint_url.strip('[]').replace('http://', '').replace('https://', '')
+
+
+def get_opensearch_client(timeout=30, pool_maxsize=10):
+    from rag_common.opensearch import OpenSearchClient
+
+    def create():
+        # The client reads the refreshable credentials of the session on every request
+        return OpenSearchClient(
+            get_opensearch_endpoint(),
+            os.environ["REGION"],
+            get_session().get_credentials(),
+            timeout=timeout,
+            pool_maxsize=pool_maxsize,
+        )
+
+    return get_client(("opensearch", timeout, pool_maxsize), create)
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+import boto3
+from aws_lambda_powertools import Logger
+from rag_common.metrics import timed
+
+logger = Logger(child=True)
+
+# Written by the set configuration lambda after every update
+VERSION_PARAMETER = "config_version"
+
+_MISSING = object()
+
+
+class AppConfig:
+    """Parameters of the app stored in SSM under /opa/gen-ai/{app_name}/.
+
+    All parameters are loaded with paginated get_parameters_by_path calls instead of
+    one get_parameter call per key. Values are cached, and once they are older than
+    `ttl_seconds` they are refreshed on a background thread while the cached values
+    keep being served. A refresh first compares the `config_version` parameter and
+    only reloads the whole path when it changed (or when it does not exist).
+
+    `version` is incremented whenever a reload changes any value, so callers can
+    rebuild objects that depend on the configuration.
+    """
+
+    def __init__(self, app_name, defaults=None, ttl_seconds=60, ssm_client=None):
+        self.path = f"/opa/gen-ai/{app_name}/"
+        self.defaults = dict(defaults or {})
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._ssm = ssm_client or boto3.client("ssm")
+        self._values = {}
+        self._checked_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, name, default=_MISSING):
+        self._refresh_if_stale()
+        if name in self._values:
+            return self._values[name]
+        if name in self.defaults:
+            return self.defaults[name]
+        if default is not _MISSING:
+            return default
+        raise KeyError(f"SSM parameter {self.path}{name} is not set")
+
+    def values(self):
+        """Return a copy of all loaded parameters, without defaults."""
+        self._refresh_if_stale()
+        return dict(self._values)
+
+    def get_int(self, name):
+        return int(self.get(name))
+
+    def get_float(self, name):
+        return float(self.get(name))
+
+    def _load(self):
+        values = {}
+        with timed("ssm_load"):
+            paginator = self._ssm.get_paginator("get_parameters_by_path")
+            for page in paginator.paginate(Path=self.path, Recursive=True):
+                for parameter in page["Parameters"]:
+                    values[parameter["Name"][len(self.path):]] = parameter["Value"]
+
+        with self._lock:
+            if values != self._values:
+                self._values = values
+                self.version += 1
+                logger.info(f"Loaded configuration version {self.version} from {self.path}")
+            self._checked_at = time.monotonic()
+
+    def _refresh_if_stale(self):
+        with self._lock:
+            if self._refreshing or time.monotonic() - self._checked_at < self.ttl_seconds:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            if VERSION_PARAMETER in self._values:
+                response = self._ssm.get_parameter(Name=f"{self.path}{VERSION_PARAMETER}")
+                if response["Parameter"]["Value"] == self._values[VERSION_PARAMETER]:
+                    with self._lock:
+                        self._checked_at = time.monotonic()
+                    return
+            self._load()
+        except Exception as e:
+            # Keep serving the cached values and try again after the next TTL
+            logger.warning(f"Configuration refresh failed: {e}")
+            with self._lock:
+                self._checked_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+_config = None
+
+
+def get_app_config(defaults=None):
+    """Return the configuration of the app, loaded once per container.
+
+    The app name comes from APP_NAME and the cache TTL from CONFIG_TTL_SECONDS.
+    """
+    global _config
+    if _config is None:
+        _config = AppConfig(
+            os.environ["APP_NAME"],
+            defaults=defaults,
+            ttl_seconds=int(os.environ.get("CONFIG_TTL_SECONDS", "60")),
+        )
+    return _config
@@ -0,0 +1,142 @@
+import hashlib
+import math
+import re
+from dataclasses import replace
+
+# Claude tokenizes English text at roughly 3.5 characters per token
+CHARS_PER_TOKEN = 3.5
+
+# Context window of the models used to generate answers, in tokens
+MODEL_CONTEXT_TOKENS = {
+    "anthropic.claude-instant-v1": 100000,
+    "anthropic.claude-v2": 100000,
+    "anthropic.claude-v2:1": 200000,
+}
+DEFAULT_CONTEXT_TOKENS = 100000
+
+# Kept free for the text the token estimate does not account for
+CONTEXT_RESERVE_TOKENS = 512
+
+# A truncated document shorter than this is not worth its tokens
+MIN_DOCUMENT_TOKENS = 32
+
+# Prefix of a document searched in another one to find where they overlap
+OVERLAP_PROBE_CHARS = 32
+
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s")
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def context_token_budget(model_id, max_tokens_to_sample, prompt_without_documents, max_context_tokens=0):
+    """Return the number of tokens the documents can use in the prompt.
+
+    The budget is what is left of the model context window once the answer
+    (`max_tokens_to_sample`), the prompt itself and a reserve are accounted for,
+    capped at `max_context_tokens` when it is set.
+    """
+    budget = (
+        MODEL_CONTEXT_TOKENS.get(model_id, DEFAULT_CONTEXT_TOKENS)
+        - max_tokens_to_sample
+        - estimate_tokens(prompt_without_documents)
+        - CONTEXT_RESERVE_TOKENS
+    )
+    if max_context_tokens > 0:
+        budget = min(budget, max_context_tokens)
+    return max(budget, 0)
+
+
+def pack_documents(documents, token_budget, max_overlap=0):
+    """Select the documents to put in the prompt within `token_budget` tokens.
+
+    Documents are taken by decreasing retrieval score. A document identical to or
+    contained in one already selected is dropped, and text it shares at either end
+    with a selected document (up to `max_overlap` characters, the overlap of the
+    text splitter) is removed. The last document that does not fit is truncated at
+    a sentence boundary.
+
+    Returns the packed documents and statistics about the packing.
+    """
+    ordered = sorted(
+        enumerate(documents),
+        key=lambda item: (item[1].score is None, -(item[1].score or 0), item[0]),
+    )
+
+    packed = []
+    seen = set()
+    stats = {"documents": len(documents), "duplicates": 0, "overlap_chars": 0, "truncated": 0, "dropped": 0}
+    remaining = token_budget
+
+    for _, document in ordered:
+        text = document.page_content.strip()
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        if not text or digest in seen or any(text in selected.page_content for selected in packed):
+            stats["duplicates"] += 1
+            continue
+        seen.add(digest)
+
+        text = _strip_overlaps(text, packed, max_overlap, stats)
+        if not text:
+            stats["duplicates"] += 1
+            continue
+
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            text = _truncate(text, int(remaining * CHARS_PER_TOKEN))
+            if estimate_tokens(text) < MIN_DOCUMENT_TOKENS:
+                stats["dropped"] += 1
+                continue
+            stats["truncated"] += 1
+            tokens = estimate_tokens(text)
+        packed.append(replace(document, page_content=text))
+        remaining -= tokens
+
+    stats["packed"] = len(packed)
+    stats["tokens"] = token_budget - remaining
+    stats["budget"] = token_budget
+    return packed, stats
+
+
+def _strip_overlaps(text, packed, max_overlap, stats):
+    """Remove the text shared with the ends of the packed documents, or return "" if nothing is left."""
+    for selected in packed:
+        head = _overlap(selected.page_content, text, max_overlap)
+        tail = _overlap(text, selected.page_content, max_overlap)
+        if head + tail >= len(text):
+            return ""
+        stats["overlap_chars"] += head + tail
+        text = text[head:len(text) - tail].strip()
+    return text
+
+
+def _overlap(first, second, max_overlap):
+    """Return the length of the longest suffix of `first` that is a prefix of `second`.
+
+    Overlaps shorter than OVERLAP_PROBE_CHARS are not detected.
+    """
+    if max_overlap <= 0:
+        return 0
+    probe = second[:OVERLAP_PROBE_CHARS]
+    start = max(len(first) - max_overlap, 0)
+    position = first.find(probe, start)
+    while position != -1:
+        length = len(first) - position
+        if second.startswith(first[position:]):
+            return length
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def _truncate(text, max_chars):
+    """Cut `text` to at most `max_chars`, at the end of a sentence when there is one."""
+    if len(text) <= max_chars:
+        return text
+    prefix = text[:max_chars + 1]
+    ends = [match.end() for match in SENTENCE_END.finditer(prefix)]
+    if ends:
+        return prefix[:ends[-1]].rstrip()
+    # No sentence ends in the budget, cut at the last word instead
+    words = prefix[:max_chars].rsplit(None, 1)
+    return words[0] if len(words) > 1 else prefix[:max_chars]
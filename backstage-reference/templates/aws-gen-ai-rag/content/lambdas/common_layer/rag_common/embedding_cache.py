@@ -0,0 +1,232 @@
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import boto3
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+DEFAULT_MODEL_ID = "amazon.titan-embed-text-v1"
+
+# Rounds of BatchGetItem for the keys DynamoDB leaves unprocessed, with a jittered exponential backoff
+BATCH_GET_MAX_ATTEMPTS = 5
+BATCH_GET_BASE_DELAY = 0.05
+BATCH_GET_MAX_DELAY = 1.0
+
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+
+def _unpack(data):
+    vector = array("f")
+    vector.frombytes(bytes(data))
+    return vector.tolist()
+
+
+class SQLiteBackend:
+    """Persistent tier stored in a local SQLite file, meant for tests and local runs."""
+
+    def __init__(self, path, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(cache_key TEXT PRIMARY KEY, vector BLOB NOT NULL, expires_at INTEGER)"
+        )
+        self._connection.commit()
+
+    def get_many(self, keys):
+        found = {}
+        now = int(time.time())
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._connection.execute(
+                    "SELECT cache_key, vector FROM embeddings WHERE cache_key IN "
+                    f"({','.join('?' * len(batch))}) AND (expires_at IS NULL OR expires_at > ?)",
+                    [*batch, now],
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, items):
+        expires_at = int(time.time()) + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (cache_key, vector, expires_at) VALUES (?, ?, ?)",
+                [(key, value, expires_at) for key, value in items.items()],
+            )
+            self._connection.commit()
+
+
+class DynamoDBBackend:
+    """Persistent tier stored in a DynamoDB table keyed by `cache_key`.
+
+    Expired items are removed by the table's TTL on the `expires_at` attribute.
+    """
+
+    def __init__(self, table_name, ttl_seconds=None):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self._dynamodb = boto3.resource("dynamodb")
+        self._table = self._dynamodb.Table(table_name)
+
+    def get_many(self, keys):
+        found = {}
+        now = int(time.time())
+        for i in range(0, len(keys), 100):
+            request = {
+                self.table_name: {
+                    "Keys": [{"cache_key": key} for key in keys[i : i + 100]],
+                    "ProjectionExpression": "cache_key, vector, expires_at",
+                }
+            }
+            attempt = 1
+            while True:
+                response = self._dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    # TTL deletion is lazy, so expired items can still be returned
+                    if "expires_at" in item and int(item["expires_at"]) <= now:
+                        continue
+                    found[item["cache_key"]] = item["vector"].value
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                if attempt >= BATCH_GET_MAX_ATTEMPTS:
+                    # The table is throttled, the keys left are embedded again like misses
+                    unprocessed = len(request[self.table_name]["Keys"])
+                    logger.warning(f"Embedding cache left {unprocessed} keys unprocessed after {attempt} attempts")
+                    break
+                time.sleep(min(BATCH_GET_BASE_DELAY * 2 ** attempt, BATCH_GET_MAX_DELAY) * random.uniform(0.5, 1.0))
+                attempt += 1
+        return found
+
+    def put_many(self, items):
+        expires_at = int(time.time()) + self.ttl_seconds if self.ttl_seconds else None
+        with self._table.batch_writer(overwrite_by_pkeys=["cache_key"]) as writer:
+            for key, value in items.items():
+                item = {"cache_key": key, "vector": value}
+                if expires_at:
+                    item["expires_at"] = expires_at
+                writer.put_item(Item=item)
+
+
+class EmbeddingCache:
+    """Two tier cache of embedding vectors keyed by model id and content hash.
+
+    The first tier is an in-memory LRU that lives as long as the warm container,
+    the second is an optional persistent backend shared by all containers.
+    Failures of the persistent tier are logged and treated as cache misses.
+    """
+
+    def __init__(self, model_id, backend=None, max_entries=2048):
+        self.model_id = model_id
+        self.backend = backend
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, text):
+        return f"{self.model_id}:{hashlib.sha256(text.encode()).hexdigest()}"
+
+    def get_or_embed(self, texts, embed_fn):
+        """Return embeddings for `texts` in order, calling `embed_fn` only for cache misses."""
+        keys = [self.key(text) for text in texts]
+        found = self._get_memory(keys)
+
+        missing_keys = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing_keys and self.backend:
+            try:
+                persisted = self.backend.get_many(missing_keys)
+            except Exception as e:
+                logger.warning(f"Embedding cache backend lookup failed: {e}")
+                persisted = {}
+            self._put_memory(persisted)
+            found.update(persisted)
+
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            computed = {key: _pack(vector) for key, vector in zip(missing, vectors)}
+            self._put_memory(computed)
+            found.update(computed)
+            if self.backend:
+                try:
+                    self.backend.put_many(computed)
+                except Exception as e:
+                    logger.warning(f"Embedding cache backend write failed: {e}")
+
+        return [_unpack(found[key]) for key in keys]
+
+    def _get_memory(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def _put_memory(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class CachedEmbeddings:
+    """Wraps an embeddings client exposing `embed_documents` and `embed_query` with a cache.
+
+    It exposes the same methods, so it can be used wherever the wrapped client is.
+    """
+
+    def __init__(self, embeddings, cache=None):
+        self.embeddings = embeddings
+        self.cache = cache or get_embedding_cache(getattr(embeddings, "model_id", DEFAULT_MODEL_ID))
+
+    def embed_documents(self, texts):
+        return self.cache.get_or_embed(texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self.cache.get_or_embed([text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_id):
+    """Return the cache for `model_id`, created once per warm container.
+
+    The persistent tier is chosen from the environment: EMBEDDING_CACHE_TABLE selects
+    the DynamoDB backend, EMBEDDING_CACHE_PATH a local SQLite file. Without either
+    only the in-memory tier is used.
+    """
+    if model_id not in _caches:
+        with _caches_lock:
+            if model_id not in _caches:
+                ttl_seconds = int(os.environ.get("EMBEDDING_CACHE_TTL_DAYS", "30")) * 24 * 3600
+                if os.environ.get("EMBEDDING_CACHE_TABLE"):
+                    backend = DynamoDBBackend(os.environ["EMBEDDING_CACHE_TABLE"], ttl_seconds)
+                elif os.environ.get("EMBEDDING_CACHE_PATH"):
+                    backend = SQLiteBackend(os.environ["EMBEDDING_CACHE_PATH"], ttl_seconds)
+                else:
+                    backend = None
+                max_entries = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+                _caches[model_id] = EmbeddingCache(model_id, backend, max_entries)
+    return _caches[model_id]
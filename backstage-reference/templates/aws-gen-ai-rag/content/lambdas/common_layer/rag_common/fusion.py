@@ -0,0 +1,49 @@
+from dataclasses import replace
+
+# Rank constant of reciprocal rank fusion, dampens the weight of the first ranks
+RRF_K = 60
+
+RRF = "rrf"
+SCORE = "score"
+
+
+def fuse(results, method=RRF, k=None):
+    """Merge the ranked documents retrieved from several indices into one ranking.
+
+    `results` maps every index to its documents, most relevant first. With `rrf`
+    a document scores the sum of 1 / (RRF_K + rank) over the indices that returned
+    it. With `score` the similarity scores are min-max normalized within the list of
+    every index, so its best document scores 1 and its worst 0, and a document keeps
+    its best normalized score. Indices can use different embedding models and space
+    types, whose scores have different scales, so raw scores are never compared
+    across indices. The fused score replaces the score of every document.
+
+    Returns the `k` best documents, or all of them when `k` is None.
+    """
+    fused = {}
+    if method == RRF:
+        for documents in results.values():
+            for rank, document in enumerate(documents, start=1):
+                key = _key(document)
+                score, first = fused.get(key, (0.0, document))
+                fused[key] = (score + 1.0 / (RRF_K + rank), first)
+    elif method == SCORE:
+        for documents in results.values():
+            scores = [document.score or 0.0 for document in documents]
+            lowest = min(scores, default=0.0)
+            spread = max(scores, default=0.0) - lowest
+            for document, score in zip(documents, scores):
+                key = _key(document)
+                # The documents of a list with a single score are all its best
+                score = (score - lowest) / spread if spread else 1.0
+                if key not in fused or score > fused[key][0]:
+                    fused[key] = (score, document)
+    else:
+        raise ValueError(f"Unknown fusion method {method}, expected {RRF} or {SCORE}")
+
+    ranked = sorted(fused.values(), key=lambda item: item[0], reverse=True)
+    return [replace(document, score=score) for score, document in ranked[:k]]
+
+
+def _key(document):
+    return document.page_content
@@ -0,0 +1,167 @@
+import json
+from dataclasses import asdict, dataclass, replace
+
+# Parameter naming the profile used to create new indices
+PROFILE_PARAMETER = "index_profile"
+# Custom profiles are JSON objects stored under this prefix of the app parameters
+PROFILES_PREFIX = "index_profiles/"
+
+# Space types supported by every engine
+ENGINE_SPACE_TYPES = {
+    "nmslib": ("l2", "innerproduct", "cosinesimil"),
+    "faiss": ("l2", "innerproduct"),
+    "lucene": ("l2", "innerproduct", "cosinesimil"),
+}
+# Engines that accept ef_search in the knn query, nmslib only reads the index setting
+QUERY_EF_SEARCH_ENGINES = ("faiss", "lucene")
+
+DEFAULT_EMBEDDING_MODEL = "amazon.titan-embed-text-v1"
+# Output dimensions supported by every embedding model
+MODEL_DIMENSIONS = {
+    "amazon.titan-embed-text-v1": (1536,),
+    "amazon.titan-embed-text-v2:0": (1024, 512, 256),
+}
+
+# Representation of the vectors in the index:
+# float stores 32-bit floats, fp16 lets faiss store them as 16-bit floats (scalar
+# quantization) and byte stores signed 8-bit integers quantized by the client.
+DATA_TYPES = ("float", "fp16", "byte")
+BYTE_MAX = 127
+
+
+@dataclass(frozen=True)
+class IndexProfile:
+    """HNSW settings of the vector field of an index.
+
+    Higher `m`, `ef_construction` and `ef_search` trade indexing and query latency
+    for recall. The embeddings of the index are computed by `embedding_model` with
+    `dimension` dimensions, and stored as `data_type`. The index lambda and the
+    retrieval stage both read the profile of an index, so documents and questions
+    are always embedded and encoded the same way.
+    """
+
+    name: str
+    engine: str = "nmslib"
+    space_type: str = "l2"
+    m: int = 16
+    ef_construction: int = 512
+    ef_search: int = 512
+    dimension: int = 1536
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL
+    data_type: str = "float"
+
+    def validate(self):
+        if self.engine not in ENGINE_SPACE_TYPES:
+            raise ValueError(f"Index profile {self.name} has engine {self.engine}, expected one of {list(ENGINE_SPACE_TYPES)}")
+        if self.space_type not in ENGINE_SPACE_TYPES[self.engine]:
+            raise ValueError(
+                f"Index profile {self.name} has space type {self.space_type}, "
+                f"{self.engine} supports {ENGINE_SPACE_TYPES[self.engine]}"
+            )
+        for field_name in ("m", "ef_construction", "ef_search", "dimension"):
+            if getattr(self, field_name) <= 0:
+                raise ValueError(f"Index profile {self.name} has a non positive {field_name}")
+        if self.dimension not in MODEL_DIMENSIONS.get(self.embedding_model, (self.dimension,)):
+            raise ValueError(
+                f"Index profile {self.name} has dimension {self.dimension}, "
+                f"{self.embedding_model} supports {MODEL_DIMENSIONS[self.embedding_model]}"
+            )
+        if self.data_type not in DATA_TYPES:
+            raise ValueError(f"Index profile {self.name} has data type {self.data_type}, expected one of {DATA_TYPES}")
+        if self.data_type == "fp16" and self.engine != "faiss":
+            raise ValueError(f"Index profile {self.name} stores fp16 vectors, which requires the faiss engine")
+        # Byte vectors are scaled one by one, which only preserves their angles
+        if self.data_type == "byte" and (self.engine, self.space_type) != ("lucene", "cosinesimil"):
+            raise ValueError(f"Index profile {self.name} stores byte vectors, which requires lucene and cosinesimil")
+        return self
+
+    @property
+    def embedding_cache_id(self):
+        """Identifier of the embeddings in the embedding cache, the model id for its default dimension."""
+        if self.dimension == MODEL_DIMENSIONS.get(self.embedding_model, (self.dimension,))[0]:
+            return self.embedding_model
+        return f"{self.embedding_model}:{self.dimension}"
+
+    def embedding_kwargs(self):
+        """Return the parameters of the embedding request besides the input text."""
+        if self.embedding_model == "amazon.titan-embed-text-v2:0":
+            return {"dimensions": self.dimension, "normalize": True}
+        return {}
+
+    def encode_vector(self, vector):
+        """Return `vector` as it is stored in and searched against the index."""
+        if self.data_type != "byte":
+            return vector
+        scale = max((abs(value) for value in vector), default=0.0)
+        if not scale:
+            return [0] * len(vector)
+        return [int(round(value / scale * BYTE_MAX)) for value in vector]
+
+    def vector_mapping(self):
+        mapping = {"type": "knn_vector", "dimension": int(self.dimension), "method": self.knn_method()}
+        if self.data_type == "byte":
+            mapping["data_type"] = "byte"
+        return mapping
+
+    def knn_method(self):
+        parameters = {"ef_construction": self.ef_construction, "m": self.m}
+        if self.data_type == "fp16":
+            parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+        return {
+            "name": "hnsw",
+            "space_type": self.space_type,
+            "engine": self.engine,
+            "parameters": parameters,
+        }
+
+    def index_settings(self):
+        return {"knn": True, "knn.algo_param.ef_search": self.ef_search}
+
+    def to_meta(self):
+        """Return the `_meta` of the mapping of an index, recording the profile that built it."""
+        return {PROFILE_PARAMETER: asdict(self)}
+
+    @classmethod
+    def from_meta(cls, meta):
+        profile = (meta or {}).get(PROFILE_PARAMETER)
+        return cls(**profile) if profile else None
+
+
+BUILTIN_PROFILES = {
+    # The settings every index was created with before profiles existed
+    "high_recall": IndexProfile("high_recall"),
+    "balanced": IndexProfile("balanced", engine="faiss", m=16, ef_construction=128, ef_search=100),
+    "low_latency": IndexProfile("low_latency", engine="faiss", m=8, ef_construction=64, ef_search=32),
+    # Half the memory of balanced
+    "compact_fp16": IndexProfile("compact_fp16", engine="faiss", m=16, ef_construction=128, ef_search=100, data_type="fp16"),
+    # A sixth of the dimensions and a quarter of the bytes per dimension of the Titan v1 profiles
+    "compact_byte": IndexProfile(
+        "compact_byte",
+        engine="lucene",
+        space_type="cosinesimil",
+        m=16,
+        ef_construction=128,
+        ef_search=100,
+        dimension=256,
+        embedding_model="amazon.titan-embed-text-v2:0",
+        data_type="byte",
+    ),
+}
+DEFAULT_PROFILE = "high_recall"
+
+
+def get_index_profile(config, name=None):
+    """Return the profile called `name`, or the one selected by the index_profile parameter.
+
+    Custom profiles are read from the `index_profiles/<name>` parameters as JSON and
+    override the built-in profiles of the same name. Fields a custom profile does not
+    set keep the values of the built-in profile of that name, or the defaults.
+    """
+    name = name or config.get(PROFILE_PARAMETER, DEFAULT_PROFILE)
+    profile = BUILTIN_PROFILES.get(name, IndexProfile(name))
+    custom = config.get(f"{PROFILES_PREFIX}{name}", None)
+    if custom is not None:
+        profile = replace(profile, **json.loads(custom))
+    elif name not in BUILTIN_PROFILES:
+        raise KeyError(f"Unknown index profile {name}, set it in the {PROFILES_PREFIX}{name} parameter")
+    return profile.validate()
@@ -0,0 +1,116 @@
+"""Versions of the content of the indices, which expire the data derived from them.
+
+The Index Lambda publishes a new version of every index whose chunks changed, and
+the other functions compare versions to drop cached answers and routing centroids
+of changed indices. Versions are counters incremented atomically in a DynamoDB
+table keyed by `index_name`, which takes the writes of bulk uploads to many
+concurrent Index Lambdas. Readers cache every version for `ttl_seconds`.
+"""
+import os
+import threading
+import time
+import boto3
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+
+class MemoryIndexVersions:
+    """Versions kept by the process, shared by the functions of the benchmarks."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, index_name):
+        with self._lock:
+            return self._versions.get(index_name)
+
+    def increment(self, index_name):
+        with self._lock:
+            self._versions[index_name] = self._versions.get(index_name, 0) + 1
+            return self._versions[index_name]
+
+
+class DynamoDBIndexVersions:
+    """Versions stored in a DynamoDB table keyed by `index_name`, in its `version` attribute."""
+
+    def __init__(self, table_name):
+        self._table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, index_name):
+        item = self._table.get_item(Key={"index_name": index_name}).get("Item")
+        return int(item["version"]) if item else None
+
+    def increment(self, index_name):
+        response = self._table.update_item(
+            Key={"index_name": index_name},
+            UpdateExpression="ADD #version :one",
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":one": 1},
+            ReturnValues="UPDATED_NEW",
+        )
+        return int(response["Attributes"]["version"])
+
+
+class IndexVersions:
+    """Read and publish the versions of the indices through a backend.
+
+    An index that never changed has the version None. Versions read from the
+    backend are cached for `ttl_seconds`, so a change is seen by the other
+    containers within that time. Publishing raises when the backend fails, so that
+    the change is published again when the invocation is retried.
+    """
+
+    def __init__(self, backend, ttl_seconds=60):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._cached = {}
+        self._lock = threading.Lock()
+
+    def get(self, index_name):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cached.get(index_name)
+        if cached and now - cached[1] < self.ttl_seconds:
+            return cached[0]
+        try:
+            version = self.backend.get(index_name)
+        except Exception as e:
+            if cached is None:
+                raise
+            # Keep serving the cached version and try again after the next TTL
+            logger.warning(f"Could not read the version of index {index_name}: {e}")
+            version = cached[0]
+        with self._lock:
+            self._cached[index_name] = (version, now)
+        return version
+
+    def publish(self, index_names):
+        """Record that the content of `index_names` changed."""
+        for index_name in sorted(index_names):
+            version = self.backend.increment(index_name)
+            with self._lock:
+                self._cached[index_name] = (version, time.monotonic())
+
+
+_index_versions = None
+_index_versions_lock = threading.Lock()
+
+
+def get_index_versions():
+    """Return the index versions of the app, created once per container.
+
+    INDEX_VERSION_TABLE selects the DynamoDB backend, without it versions are only
+    shared within the process. The cache TTL comes from CONFIG_TTL_SECONDS.
+    """
+    global _index_versions
+    if _index_versions is None:
+        with _index_versions_lock:
+            if _index_versions is None:
+                if os.environ.get("INDEX_VERSION_TABLE"):
+                    backend = DynamoDBIndexVersions(os.environ["INDEX_VERSION_TABLE"])
+                else:
+                    backend = MemoryIndexVersions()
+                _index_versions = IndexVersions(backend, int(os.environ.get("CONFIG_TTL_SECONDS", "60")))
+    return _index_versions
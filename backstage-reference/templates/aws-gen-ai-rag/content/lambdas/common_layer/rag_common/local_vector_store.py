@@ -0,0 +1,370 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+from aws_lambda_powertools import Logger
+from rag_common.index_profiles import IndexProfile
+from rag_common.vector_store import (
+    TEXT_FIELD,
+    VECTOR_FIELD,
+    IndexAlreadyExistsError,
+    IndexNotFoundError,
+    ScoredChunk,
+    VectorStore,
+    index_mappings,
+)
+
+logger = Logger(child=True)
+
+MAPPINGS_FILE = "mappings.json"
+VECTORS_FILE = "vectors.bin"
+CHUNKS_FILE = "chunks.jsonl"
+# Names the folder of the current generation of the data files
+GENERATION_FILE = "generation"
+GENERATION_PREFIX = "generation-"
+
+# Storage type of the vectors of every data type of the index profiles
+DTYPES = {"float": np.float32, "fp16": np.float16, "byte": np.int8}
+# Vectors are converted to float32 this many rows at a time, bounding the memory of a search
+SCORE_BLOCK_ROWS = 65536
+# Vectors stored as fp16 or byte are kept converted to float32 in memory up to this size, so
+# searches do not convert them again. Larger indices are converted block by block on every search.
+WORKING_COPY_BYTES = int(os.environ.get("VECTOR_STORE_WORKING_COPY_MB", "512")) * 1024 * 1024
+# Files are rewritten without the deleted chunks once they make up this share of the rows
+COMPACTION_RATIO = 0.5
+COMPACTION_MIN_ROWS = 1000
+
+
+class _LoadedIndex:
+    """Chunks of one index held by a container, read incrementally as the files grow.
+
+    The vectors are a read-only memory-mapped array, so only the pages touched by
+    searches are loaded. Chunks deleted since they were written are masked out. The
+    norms, and the float32 copy of compact vectors, are only computed by searches,
+    for the rows added since the previous one. Everything is read again from the new
+    generation after a compaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = _generation_path(path)
+        with open(os.path.join(path, MAPPINGS_FILE)) as mappings_file:
+            self.mappings = json.load(mappings_file)
+        self.profile = IndexProfile.from_meta(self.mappings.get("_meta"))
+        self.dtype = np.dtype(DTYPES[self.profile.data_type])
+        self.dimension = self.profile.dimension
+        self.ids = []
+        self.texts = []
+        self.urls = []
+        self.chunk_ids = []
+        self.metadata = []
+        self.rows = {}
+        self.live = np.zeros(0, dtype=bool)
+        self.matrix = np.zeros((0, self.dimension), dtype=self.dtype)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.working = np.zeros((0, self.dimension), dtype=np.float32)
+        self.offset = 0
+
+    @property
+    def live_count(self):
+        return int(self.live.sum())
+
+    def refresh(self):
+        """Read the chunks written since the last refresh, or everything after a compaction."""
+        if _generation_path(self.path) != self.generation:
+            self.__init__(self.path)
+        chunks_path = os.path.join(self.generation, CHUNKS_FILE)
+        try:
+            size = os.path.getsize(chunks_path)
+        except FileNotFoundError:
+            return self
+        if size == self.offset:
+            return self
+
+        added, deleted = [], []
+        with open(chunks_path, "rb") as chunks_file:
+            chunks_file.seek(self.offset)
+            for line in chunks_file:
+                # A line without its newline is still being written
+                if not line.endswith(b"\n"):
+                    break
+                self.offset += len(line)
+                entry = json.loads(line)
+                if "deleted" in entry:
+                    deleted.append(entry["deleted"])
+                else:
+                    added.append(entry)
+
+        for entry in added:
+            self.rows[entry["id"]] = len(self.ids)
+            self.ids.append(entry["id"])
+            self.texts.append(entry[TEXT_FIELD])
+            self.urls.append(entry.get("url"))
+            self.chunk_ids.append(entry.get("chunk_id"))
+            self.metadata.append(entry.get("metadata", {}))
+        self.live = np.concatenate([self.live, np.ones(len(added), dtype=bool)])
+        for chunk_id in deleted:
+            row = self.rows.get(chunk_id)
+            if row is not None:
+                self.live[row] = False
+
+        if added:
+            self.matrix = np.memmap(
+                os.path.join(self.generation, VECTORS_FILE), dtype=self.dtype, mode="r", shape=(len(self.ids), self.dimension)
+            )
+        return self
+
+    def _blocks(self, start):
+        for block_start in range(start, len(self.ids), SCORE_BLOCK_ROWS):
+            yield self.matrix[block_start:block_start + SCORE_BLOCK_ROWS].astype(np.float32)
+
+    def _prepare(self):
+        """Compute the norms, and the float32 copy when it fits, of the rows added since the last search."""
+        if len(self.norms) < len(self.ids):
+            new_norms = [np.linalg.norm(block, axis=1) for block in self._blocks(len(self.norms))]
+            self.norms = np.concatenate([self.norms, *new_norms])
+        if (
+            self.dtype != np.float32
+            and len(self.working) < len(self.ids)
+            and len(self.ids) * self.dimension * 4 <= WORKING_COPY_BYTES
+        ):
+            self.working = np.concatenate([self.working, *self._blocks(len(self.working))])
+
+    def scores(self, vector):
+        """Score every row against `vector` like the OpenSearch k-NN plugin, deleted rows score -inf."""
+        self._prepare()
+        query = np.asarray(vector, dtype=np.float32)
+        if self.dtype == np.float32:
+            products = self.matrix @ query
+        elif len(self.working) == len(self.ids):
+            products = self.working @ query
+        else:
+            products = np.concatenate([block @ query for block in self._blocks(0)])
+
+        space_type = self.profile.space_type
+        if space_type == "cosinesimil":
+            cosine = products / np.maximum(self.norms * np.linalg.norm(query), 1e-12)
+            scores = (1 + cosine) / 2
+        elif space_type == "innerproduct":
+            scores = np.where(products >= 0, products + 1, 1 / (1 - products))
+        else:
+            distances = np.maximum(self.norms ** 2 - 2 * products + query @ query, 0)
+            scores = 1 / (1 + distances)
+        return np.where(self.live, scores, -np.inf)
+
+
+class LocalVectorStore(VectorStore):
+    """Vector store keeping every index in a folder of `root_path`.
+
+    An index folder holds:
+
+    - mappings.json: the mappings of the index, with its profile in `_meta`
+    - generation: the name of the folder holding the current data files
+    - generation-<id>/vectors.bin: the vectors, one row per chunk in the data type
+      of the profile
+    - generation-<id>/chunks.jsonl: one line per chunk with its id and fields, in the
+      order of the vectors, and one `{"deleted": id}` line per deleted chunk
+
+    Both data files are only appended to. Once deleted chunks make up most of the
+    rows, the live chunks are written to a new generation folder and the generation
+    file is replaced with one rename, so readers always see matching data files. The
+    previous generation is removed by the next compaction rather than right away, as
+    readers on other hosts may still have its files memory-mapped.
+
+    Searches score every chunk with vectorized NumPy products over the memory-mapped
+    vectors, so the results are exact and no ef_search applies. Indices are loaded on
+    their first search and cached for the lifetime of the container, later searches
+    only read what was appended since.
+
+    Writes are serialized per index within a process. The store expects a single
+    writing process per folder, and to be shared with the readers through a common
+    file system such as EFS.
+    """
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+        self._indices = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def index_exists(self, index_name):
+        return os.path.exists(self._file(index_name, MAPPINGS_FILE))
+
+    def get_mappings(self, index_name):
+        with self._read(index_name) as index:
+            return index.mappings
+
+    def create_index(self, index_name, profile):
+        path = os.path.join(self.root_path, index_name)
+        os.makedirs(path, exist_ok=True)
+        with self._index_lock(index_name):
+            if self.index_exists(index_name):
+                raise IndexAlreadyExistsError(index_name)
+            generation = _new_generation(path)
+            for file_name in (VECTORS_FILE, CHUNKS_FILE):
+                open(os.path.join(path, generation, file_name), "wb").close()
+            _write_atomically(os.path.join(path, GENERATION_FILE), generation.encode())
+            _write_atomically(os.path.join(path, MAPPINGS_FILE), json.dumps(index_mappings(profile)).encode())
+        logger.info(f"Created local index {index_name} with profile {profile.name} in {path}")
+        return {"acknowledged": True, "index": index_name}
+
+    def delete_index(self, index_name):
+        if not self.index_exists(index_name):
+            raise IndexNotFoundError(index_name)
+        with self._index_lock(index_name):
+            shutil.rmtree(os.path.join(self.root_path, index_name))
+            self._indices.pop(index_name, None)
+        return {"acknowledged": True}
+
+    def iter_document_chunks(self, index_name, url, page_size=1000):
+        with self._read(index_name) as index:
+            chunks = [
+                (index.ids[row], index.chunk_ids[row])
+                for row in np.flatnonzero(index.live)
+                if index.urls[row] == url
+            ]
+        for start in range(0, len(chunks), page_size):
+            yield chunks[start:start + page_size]
+
+    def index_chunks(self, index_name, chunks, batch_size, batch_bytes, max_retries):
+        """Append the chunks `batch_size` at a time, vectors first so a chunk line always has its vector."""
+        indexed = 0
+        with self._read(index_name) as index:
+            row_bytes = index.dimension * index.dtype.itemsize
+            # Drop vectors left without a chunk line by an interrupted write
+            with open(os.path.join(index.generation, VECTORS_FILE), "ab") as vectors_file:
+                vectors_file.truncate(len(index.ids) * row_bytes)
+
+            batch = []
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    indexed += self._append(index_name, index, batch)
+                    batch = []
+            if batch:
+                indexed += self._append(index_name, index, batch)
+        return {"indexed": indexed, "failed": 0}
+
+    def delete_chunks(self, index_name, chunk_ids, batch_size, batch_bytes, max_retries):
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return {"deleted": 0, "failed": 0, "not_found": 0}
+        with self._read(index_name) as index:
+            # Like the _bulk API, deleting a chunk that is already gone succeeds but is not counted as deleted
+            deleted = sum(1 for chunk_id in set(chunk_ids) if chunk_id in index.rows and index.live[index.rows[chunk_id]])
+            with open(os.path.join(index.generation, CHUNKS_FILE), "ab") as chunks_file:
+                chunks_file.write(b"".join(json.dumps({"deleted": chunk_id}).encode() + b"\n" for chunk_id in chunk_ids))
+            index.refresh()
+            deleted_rows = len(index.ids) - index.live_count
+            if deleted_rows >= COMPACTION_MIN_ROWS and deleted_rows >= COMPACTION_RATIO * len(index.ids):
+                self._compact(index_name, index)
+        return {"deleted": deleted, "failed": 0, "not_found": len(chunk_ids) - deleted}
+
+    def search(self, index_name, profile, vector, k, ef_search=None):
+        with self._read(index_name) as index:
+            k = min(k, index.live_count)
+            if k <= 0:
+                return []
+            scores = index.scores(vector)
+            best = np.argpartition(scores, len(scores) - k)[-k:]
+            best = best[np.argsort(-scores[best])]
+            return [
+                ScoredChunk(text=index.texts[row], url=index.urls[row], score=float(scores[row]), metadata=index.metadata[row])
+                for row in best
+            ]
+
+    def sample_vectors(self, index_name, size):
+        with self._read(index_name) as index:
+            rows = np.flatnonzero(index.live)
+            if len(rows) > size:
+                rows = np.sort(np.random.default_rng().choice(rows, size=size, replace=False))
+            return [index.matrix[row].astype(np.float32) for row in rows]
+
+    def _append(self, index_name, index, chunks):
+        vectors = np.asarray([chunk[VECTOR_FIELD] for chunk in chunks], dtype=index.dtype)
+        if vectors.shape[1:] != (index.dimension,):
+            raise ValueError(f"Index {index_name} stores vectors of dimension {index.dimension}, got {vectors.shape[1:]}")
+        lines = []
+        for chunk in chunks:
+            entry = {key: value for key, value in chunk.items() if key != VECTOR_FIELD}
+            lines.append(json.dumps({"id": uuid.uuid4().hex, **entry}).encode() + b"\n")
+
+        with open(os.path.join(index.generation, VECTORS_FILE), "ab") as vectors_file:
+            vectors_file.write(vectors.tobytes())
+            vectors_file.flush()
+            os.fsync(vectors_file.fileno())
+        with open(os.path.join(index.generation, CHUNKS_FILE), "ab") as chunks_file:
+            chunks_file.write(b"".join(lines))
+        index.refresh()
+        return len(chunks)
+
+    def _compact(self, index_name, index):
+        """Write the live chunks of the index to a new generation and switch to it."""
+        rows = np.flatnonzero(index.live)
+        path = os.path.join(self.root_path, index_name)
+        previous = index.generation
+        generation = _new_generation(path)
+        _write_atomically(os.path.join(path, generation, VECTORS_FILE), np.ascontiguousarray(index.matrix[rows]).tobytes())
+        lines = b"".join(
+            json.dumps({
+                "id": index.ids[row],
+                TEXT_FIELD: index.texts[row],
+                "url": index.urls[row],
+                "chunk_id": index.chunk_ids[row],
+                **({"metadata": index.metadata[row]} if index.metadata[row] else {}),
+            }).encode() + b"\n"
+            for row in rows
+        )
+        _write_atomically(os.path.join(path, generation, CHUNKS_FILE), lines)
+        # Readers reload from scratch when they see the new generation
+        _write_atomically(os.path.join(path, GENERATION_FILE), generation.encode())
+        logger.info(f"Compacted local index {index_name} from {len(index.ids)} to {len(rows)} chunks")
+        index.refresh()
+
+        # Keep the previous generation for the searches that are still reading it
+        for name in os.listdir(path):
+            if name.startswith(GENERATION_PREFIX) and name not in (generation, os.path.basename(previous)):
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    @contextmanager
+    def _read(self, index_name):
+        """Hold the lock of `index_name` and yield its loaded chunks, up to date with the files."""
+        with self._index_lock(index_name):
+            if not self.index_exists(index_name):
+                self._indices.pop(index_name, None)
+                raise IndexNotFoundError(index_name)
+            index = self._indices.get(index_name)
+            if index is None:
+                index = self._indices[index_name] = _LoadedIndex(os.path.join(self.root_path, index_name))
+            yield index.refresh()
+
+    def _index_lock(self, index_name):
+        with self._lock:
+            return self._locks.setdefault(index_name, threading.RLock())
+
+    def _file(self, index_name, file_name):
+        return os.path.join(self.root_path, index_name, file_name)
+
+
+def _generation_path(path):
+    """Return the folder of the current data files of the index in `path`."""
+    with open(os.path.join(path, GENERATION_FILE)) as generation_file:
+        return os.path.join(path, generation_file.read().strip())
+
+
+def _new_generation(path):
+    generation = f"{GENERATION_PREFIX}{uuid.uuid4().hex}"
+    os.makedirs(os.path.join(path, generation))
+    return generation
+
+
+def _write_atomically(path, content):
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary_path, "wb") as temporary_file:
+        temporary_file.write(content)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
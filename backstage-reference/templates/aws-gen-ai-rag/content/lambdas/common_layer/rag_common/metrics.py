@@ -0,0 +1,266 @@
+"""Per-stage latency, token and chunk metrics of the lambda functions.
+
+Stages of an invocation (SSM load, query embedding, kNN search, LLM calls, lambda
+invoke hops, ...) are timed with `timed` and counters such as tokens and chunks
+are recorded with `add_metric`. When the handler wrapped with `record_metrics`
+returns, they are published with the Metrics utility of Powertools as CloudWatch
+embedded metric format (EMF) log lines: CloudWatch turns every line into metrics
+of the METRICS_NAMESPACE namespace, with the app and the function as dimensions,
+and keeps the distribution of every metric so percentiles can be graphed per stage.
+
+    @record_metrics
+    def lambda_handler(event, context):
+        with timed("knn_search"):
+            ...
+        add_metric("retrieved_chunks", len(documents))
+
+The same lines are parsed back by MetricsCollector, which builds a histogram per
+metric, see benchmarks/collect_metrics.py. Metrics are recorded process wide
+rather than per thread, so stages run on worker threads count for the invocation
+that started them (a container serves one invocation at a time), and stages run
+at import, such as the first SSM load, count for the first invocation. They are
+only handed to Powertools when flushed, as its metric set is not thread-safe.
+"""
+import bisect
+import functools
+import io
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from aws_lambda_powertools import Metrics
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+
+DEFAULT_NAMESPACE = "OPA/GenAI"
+
+# Upper bounds of the histogram buckets, valid for milliseconds and counts alike
+HISTOGRAM_BOUNDS = tuple(base * 10 ** exponent for exponent in range(-1, 6) for base in (1, 2, 5))
+
+
+class MetricsRecorder:
+    """Values recorded for every metric since the last flush, with their unit."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value, unit=COUNT):
+        with self._lock:
+            self._metrics.setdefault(name, (unit, []))[1].append(value)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, round((time.perf_counter() - started) * 1000, 2), MILLISECONDS)
+
+    def durations(self):
+        """Return the total duration of every stage recorded since the last flush, in milliseconds."""
+        with self._lock:
+            return {
+                name: round(sum(values), 2) for name, (unit, values) in self._metrics.items() if unit == MILLISECONDS
+            }
+
+    def server_timing(self):
+        """Format the stage durations as a Server-Timing header value."""
+        return ", ".join(f"{name};dur={duration}" for name, duration in self.durations().items())
+
+    def drain(self):
+        """Return the recorded metrics and start over."""
+        with self._lock:
+            metrics, self._metrics = self._metrics, {}
+        return metrics
+
+
+class _LineWriter(io.TextIOBase):
+    """Text stream passing every complete line written to it to `sink`."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self._pending = ""
+
+    def write(self, text):
+        *lines, self._pending = (self._pending + text).split("\n")
+        for line in lines:
+            self.sink(line)
+        return len(text)
+
+
+_recorder = MetricsRecorder()
+_sink = None
+_cold_start = True
+_flush_callbacks = []
+
+
+def get_recorder():
+    return _recorder
+
+
+def set_sink(sink):
+    """Send the EMF lines to `sink`, a function taking one line, and return the previous sink.
+
+    Without a sink the lines are written to stdout, which Lambda sends to CloudWatch Logs.
+    """
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+
+@contextmanager
+def timed(stage):
+    """Record the duration of the block as the `stage` metric of the current invocation."""
+    with _recorder.stage(stage):
+        yield
+
+
+def add_metric(name, value, unit=COUNT):
+    _recorder.add(name, value, unit)
+
+
+def on_flush(callback):
+    """Call `callback` before every flush, so it adds the metrics it aggregates over the invocation."""
+    _flush_callbacks.append(callback)
+
+
+def flush(request_id=None):
+    """Publish the metrics recorded since the last flush as EMF lines."""
+    global _cold_start
+    for callback in _flush_callbacks:
+        try:
+            callback()
+        except Exception as e:
+            sys.stderr.write(f"Could not collect metrics: {e}\n")
+    metrics = _recorder.drain()
+    if not metrics:
+        return
+
+    publisher = Metrics(namespace=os.environ.get("METRICS_NAMESPACE", DEFAULT_NAMESPACE))
+    publisher.set_default_dimensions(
+        AppName=os.environ.get("APP_NAME", "unknown"),
+        FunctionName=os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local"),
+    )
+    publisher.add_metadata(key="ColdStart", value=_cold_start)
+    _cold_start = False
+    if request_id:
+        publisher.add_metadata(key="RequestId", value=request_id)
+    with redirect_stdout(_LineWriter(_sink)) if _sink else nullcontext():
+        # Powertools writes a line whenever a metric reaches the values one line can hold
+        for name, (unit, values) in sorted(metrics.items()):
+            for value in values:
+                publisher.add_metric(name=name, unit=unit, value=value)
+        publisher.flush_metrics()
+
+
+def record_metrics(handler):
+    """Record the duration of `handler` as the `invocation` stage and flush the metrics when it returns."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context, *args, **kwargs):
+        try:
+            with timed("invocation"):
+                return handler(event, context, *args, **kwargs)
+        finally:
+            try:
+                flush(getattr(context, "aws_request_id", None))
+            except Exception as e:
+                # Metrics never fail an invocation
+                sys.stderr.write(f"Could not write metrics: {e}\n")
+
+    return wrapper
+
+
+class Histogram:
+    """Distribution of the values of a metric in HISTOGRAM_BOUNDS buckets, with exact count, sum, min and max."""
+
+    def __init__(self, unit=COUNT, bounds=HISTOGRAM_BOUNDS):
+        self.unit = unit
+        self.bounds = bounds
+        # The last bucket holds the values above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile):
+        """Return the upper bound of the bucket holding the percentile, capped by the maximum."""
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for position, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                bound = self.bounds[position] if position < len(self.bounds) else self.max
+                return round(min(bound, self.max), 2)
+        return round(self.max, 2)
+
+    def summary(self):
+        suffix = "_ms" if self.unit == MILLISECONDS else ""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            f"p50{suffix}": self.percentile(50),
+            f"p90{suffix}": self.percentile(90),
+            f"p99{suffix}": self.percentile(99),
+            f"max{suffix}": round(self.max, 2),
+            f"mean{suffix}": round(self.sum / self.count, 2),
+            "buckets": {
+                (f"le_{bound}" if position < len(self.bounds) else "inf"): bucket_count
+                for position, (bound, bucket_count) in enumerate(zip((*self.bounds, None), self.counts))
+                if bucket_count
+            },
+        }
+
+
+class MetricsCollector:
+    """Histograms of the metrics of EMF log lines, per function and metric."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.lines = 0
+
+    def add_line(self, line):
+        """Parse one log line, ignoring the lines that are not EMF documents."""
+        start = line.find("{")
+        if start < 0:
+            return
+        try:
+            document = json.loads(line[start:])
+        except ValueError:
+            return
+        if not isinstance(document, dict) or "_aws" not in document:
+            return
+        self.lines += 1
+        function_name = document.get("FunctionName", "unknown")
+        for directive in document["_aws"].get("CloudWatchMetrics", []):
+            for metric in directive.get("Metrics", []):
+                values = document.get(metric["Name"])
+                if values is None:
+                    continue
+                histogram = self.histograms.setdefault(
+                    (function_name, metric["Name"]), Histogram(metric.get("Unit", COUNT))
+                )
+                for value in values if isinstance(values, list) else [values]:
+                    histogram.observe(value)
+
+    def summary(self):
+        """Return the summary of every histogram, grouped by function."""
+        functions = {}
+        for (function_name, name), histogram in sorted(self.histograms.items()):
+            functions.setdefault(function_name, {})[name] = histogram.summary()
+        return functions
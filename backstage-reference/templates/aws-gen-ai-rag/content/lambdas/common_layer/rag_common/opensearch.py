@@ -0,0 +1,145 @@
+"""Minimal OpenSearch client for the REST calls of the vector store.
+
+Requests are signed with SigV4 by botocore and sent through the urllib3 session
+botocore uses for every AWS client, so the client adds no import to the ones
+boto3 already makes. It implements the subset of the opensearch-py client API the
+functions call (`search`, `bulk` and the `indices` namespace) and raises the same
+kinds of errors, with the status code, the OpenSearch error type and the body.
+"""
+import hashlib
+import json
+import random
+import time
+from urllib.parse import quote, urlencode
+
+# Connection errors and these statuses are retried, like the opensearch-py client does
+RETRY_ON_STATUS = frozenset({502, 503, 504})
+
+# Seconds before the first retry, doubled for every retry up to RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 2.0
+
+
+class TransportError(Exception):
+    def __init__(self, status_code, error, info=None):
+        super().__init__(status_code, error, info)
+        self.status_code = status_code
+        # Type of the OpenSearch error, such as resource_already_exists_exception
+        self.error = error
+        self.info = info
+
+    def __str__(self):
+        return f"TransportError({self.status_code}, '{self.error}')"
+
+
+class RequestError(TransportError):
+    pass
+
+
+class NotFoundError(TransportError):
+    pass
+
+
+class ConflictError(TransportError):
+    pass
+
+
+class AuthorizationError(TransportError):
+    pass
+
+
+ERRORS = {400: RequestError, 403: AuthorizationError, 404: NotFoundError, 409: ConflictError}
+
+
+class _Indices:
+    def __init__(self, client):
+        self._client = client
+
+    def exists(self, index):
+        status, _ = self._client.perform_request("HEAD", f"/{quote(index)}", allowed_statuses=(404,))
+        return status == 200
+
+    def create(self, index, body=None):
+        return self._client.perform_request("PUT", f"/{quote(index)}", body)[1]
+
+    def delete(self, index):
+        return self._client.perform_request("DELETE", f"/{quote(index)}")[1]
+
+    def get_mapping(self, index):
+        return self._client.perform_request("GET", f"/{quote(index)}/_mapping")[1]
+
+
+class OpenSearchClient:
+    """Client of an OpenSearch domain or serverless collection (`service` aoss) over HTTPS.
+
+    `credentials` are botocore credentials, refreshed by botocore when they expire.
+    """
+
+    def __init__(self, host, region_name, credentials, service="aoss", timeout=30, pool_maxsize=10, max_retries=3):
+        from botocore.httpsession import URLLib3Session
+
+        self.base_url = f"https://{host}"
+        self.region_name = region_name
+        self.credentials = credentials
+        self.service = service
+        self.max_retries = max_retries
+        self.indices = _Indices(self)
+        self._http = URLLib3Session(timeout=timeout, max_pool_connections=pool_maxsize)
+
+    def search(self, index, body):
+        return self.perform_request("POST", f"/{quote(index)}/_search", body)[1]
+
+    def bulk(self, body):
+        return self.perform_request("POST", "/_bulk", body)[1]
+
+    def perform_request(self, method, path, body=None, params=None, allowed_statuses=()):
+        """Send a signed request and return its status and decoded body.
+
+        Connection errors and RETRY_ON_STATUS responses are retried up to `max_retries`
+        times, after a jittered exponential backoff. Errors raise a TransportError
+        subclass, unless their status is in `allowed_statuses`.
+        """
+        from botocore.exceptions import HTTPClientError
+
+        url = self.base_url + path + (f"?{urlencode(params)}" if params else "")
+        if body is not None and not isinstance(body, (str, bytes)):
+            body = json.dumps(body)
+        data = body.encode("utf-8") if isinstance(body, str) else body
+
+        attempt = 0
+        while True:
+            try:
+                response = self._http.send(self._signed_request(method, url, data))
+            except HTTPClientError:
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_ON_STATUS or attempt >= self.max_retries:
+                    break
+            attempt += 1
+            # Jittered, so that the retries of concurrent requests spread out
+            time.sleep(min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY) * random.uniform(0.5, 1.0))
+
+        content = response.content
+        try:
+            decoded = json.loads(content) if content else None
+        except ValueError:
+            decoded = content.decode("utf-8", "replace")
+        if response.status_code >= 400 and response.status_code not in allowed_statuses:
+            error = decoded.get("error", decoded) if isinstance(decoded, dict) else decoded
+            error_type = error.get("type", str(error)) if isinstance(error, dict) else str(error)
+            raise ERRORS.get(response.status_code, TransportError)(response.status_code, error_type, decoded)
+        return response.status_code, decoded
+
+    def _signed_request(self, method, url, data):
+        from botocore.auth import SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        headers = {
+            "Content-Type": "application/json",
+            # Serverless collections require the hash of the payload as a signed header
+            "x-amz-content-sha256": hashlib.sha256(data or b"").hexdigest(),
+        }
+        request = AWSRequest(method=method, url=url, data=data, headers=headers)
+        SigV4Auth(self.credentials.get_frozen_credentials(), self.service, self.region_name).add_auth(request)
+        return request.prepare()
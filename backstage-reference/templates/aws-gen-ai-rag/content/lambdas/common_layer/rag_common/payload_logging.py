@@ -0,0 +1,104 @@
+"""Bounded logging of the payloads of the lambda functions.
+
+Events, questions, chunks, prompts and answers grow with the documents, so they
+are not logged as they are. By default `log_payload` only logs a digest of the
+payload (its SHA-256 prefix and length), which is enough to tell whether two
+invocations saw the same payload. The bodies are logged for:
+
+- a share of the invocations, drawn when each invocation starts, set by the
+  `log_payload_sample_rate` parameter (0 by default), truncated to
+  `log_payload_max_chars` characters
+- the invocation whose correlation id (the API Gateway request id) or Lambda
+  request id is the `log_debug_correlation_id` parameter, without truncation
+
+Handlers are wrapped with `payload_logging`, which draws the sample and logs the
+event. Like rag_common.metrics, the mode applies to the whole process, as a
+container serves one invocation at a time.
+"""
+import functools
+import hashlib
+import json
+import random
+from aws_lambda_powertools import Logger
+from rag_common.config import get_app_config
+
+logger = Logger(child=True)
+
+# Optional parameters read by payload_logging
+param_defaults = {
+    'log_payload_sample_rate': '0',
+    'log_payload_max_chars': '2000',
+    'log_debug_correlation_id': '',
+}
+
+DIGEST = "digest"
+SAMPLED = "sampled"
+DEBUG = "debug"
+
+_mode = DIGEST
+_max_chars = int(param_defaults['log_payload_max_chars'])
+
+
+def _serialize(payload):
+    if isinstance(payload, str):
+        return payload
+    return json.dumps(payload, default=str, separators=(",", ":"))
+
+
+def payload_digest(payload):
+    """Return the SHA-256 prefix and the length of the serialized payload."""
+    serialized = _serialize(payload)
+    return {
+        "sha256": hashlib.sha256(serialized.encode("utf-8", "replace")).hexdigest()[:16],
+        "chars": len(serialized),
+    }
+
+
+def log_payload(label, payload):
+    """Log `payload` under `label`, as a digest unless the invocation logs bodies."""
+    serialized = _serialize(payload)
+    entry = {"payload": label, **payload_digest(serialized)}
+    if _mode == SAMPLED and len(serialized) > _max_chars:
+        entry.update(body=serialized[:_max_chars], truncated=True)
+    elif _mode != DIGEST:
+        entry["body"] = serialized
+    logger.info(entry)
+
+
+def _correlation_ids(event, context):
+    ids = {getattr(context, "aws_request_id", None)}
+    if isinstance(event, dict):
+        ids.add((event.get("requestContext") or {}).get("requestId"))
+    ids.discard(None)
+    return ids
+
+
+def start_invocation(event, context):
+    """Choose how the payloads of this invocation are logged."""
+    global _mode, _max_chars
+    _mode = DIGEST
+    try:
+        config = get_app_config()
+        debug_id = config.get('log_debug_correlation_id', param_defaults['log_debug_correlation_id'])
+        sample_rate = float(config.get('log_payload_sample_rate', param_defaults['log_payload_sample_rate']))
+        _max_chars = int(config.get('log_payload_max_chars', param_defaults['log_payload_max_chars']))
+    except Exception as e:
+        # Keep logging digests when the parameters cannot be read
+        logger.warning(f"Could not read the payload logging parameters: {e}")
+        return
+    if debug_id and debug_id in _correlation_ids(event, context):
+        _mode = DEBUG
+    elif sample_rate > 0 and random.random() < sample_rate:
+        _mode = SAMPLED
+
+
+def payload_logging(handler):
+    """Choose the payload logging mode of every invocation of `handler` and log its event."""
+
+    @functools.wraps(handler)
+    def wrapper(event, context, *args, **kwargs):
+        start_invocation(event, context)
+        log_payload("event", event)
+        return handler(event, context, *args, **kwargs)
+
+    return wrapper
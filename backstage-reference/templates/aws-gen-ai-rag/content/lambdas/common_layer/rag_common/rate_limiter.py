@@ -0,0 +1,520 @@
+"""Rate limiting, retries and circuit breaking of the Bedrock calls.
+
+Every Bedrock call of a container goes through its RateLimiter (`get_rate_limiter`),
+which keeps for every model id:
+
+- a token bucket per budget: INTERACTIVE for the calls made while a user waits for
+  an answer, INGESTION for the embeddings of the Index Lambda. The rate of a bucket
+  adapts with AIMD: it is multiplied by the `decrease_factor` of the budget when
+  Bedrock throttles and grows back by `increase_per_second` requests per second for
+  every second of successful calls, up to the `max_rate` of the budget (no limit
+  when 0). Ingestion backs off harder and recovers slower than questions, so when
+  both share the quota of a model, bulk indexing gives way to live traffic.
+- jittered exponential backoff retries of the throttled calls, fewer and shorter
+  for questions than for ingestion.
+- a circuit breaker per budget that opens after `circuit_failures` consecutive
+  failed calls and rejects the calls without sending them for
+  `circuit_reset_seconds`, then lets one trial call through. Failures of the
+  ingestion never reject questions.
+
+Calls that are rejected, or still throttled after their retries, raise
+BedrockUnavailableError, returned by the API handlers as a 429 with Retry-After.
+The counters of every model and budget are returned by `stats`, and their totals
+over an invocation are added to its metrics (see rag_common.metrics).
+
+The buckets and breakers coordinate the threads of one container, and the max_rate
+of a budget is per container: the quota of a model is divided by the concurrency
+of the functions calling it. Questions and ingestion run in different functions,
+so the throttles of questions reach the ingestion of every container through a
+ThrottleSignal (see below), stored in the table named by BEDROCK_THROTTLE_TABLE.
+A throttled question slows the ingestion bucket of its model in all of them.
+"""
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_lambda_powertools import Logger
+from rag_common.config import get_app_config
+from rag_common.metrics import MILLISECONDS, add_metric, on_flush
+
+logger = Logger(child=True)
+
+INTERACTIVE = "interactive"
+INGESTION = "ingestion"
+
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException"}
+# Errors of the service rather than of the request, counted as failures by the circuit breaker
+SERVER_ERRORS = {"InternalServerException", "ModelTimeoutException", "ModelNotReadyException"}
+
+# Rates never go below this many requests per second
+MIN_RATE = 0.2
+
+
+@dataclass(frozen=True)
+class BudgetPolicy:
+    # Requests per second per container and model, 0 for no limit besides the AIMD rate
+    max_rate: float = 0.0
+    decrease_factor: float = 0.7
+    increase_per_second: float = 1.0
+    max_retries: int = 3
+    base_delay: float = 0.1
+    max_delay: float = 2.0
+    # Longest wait for the bucket before the call is rejected
+    max_wait: float = 5.0
+
+
+DEFAULT_POLICIES = {
+    INTERACTIVE: BudgetPolicy(),
+    INGESTION: BudgetPolicy(
+        decrease_factor=0.5, increase_per_second=0.5, max_retries=8, base_delay=0.25, max_delay=20.0, max_wait=120.0
+    ),
+}
+
+
+class BedrockUnavailableError(Exception):
+    """A Bedrock call was rejected by the limiter or throttled until its retries ran out."""
+
+    def __init__(self, model_id, reason, retry_after=1.0):
+        super().__init__(f"Bedrock model {model_id} unavailable: {reason}")
+        self.model_id = model_id
+        self.reason = reason
+        # Seconds after which the call is worth retrying
+        self.retry_after = retry_after
+
+
+def too_many_requests(error):
+    """Return the API response of a BedrockUnavailableError, asking the client to retry later."""
+    retry_after = max(1, math.ceil(error.retry_after))
+    return {
+        "statusCode": 429,
+        "body": json.dumps({"message": "Too Many Requests", "model_id": error.model_id, "retry_after": retry_after}),
+        "headers": {"Content-Type": "application/json", "Retry-After": str(retry_after)},
+    }
+
+
+def raise_for_too_many_requests(payload):
+    """Raise the BedrockUnavailableError of a too_many_requests payload returned by another function."""
+    if payload.get("statusCode") == 429:
+        body = json.loads(payload["body"])
+        raise BedrockUnavailableError(body.get("model_id"), "throttled in another function", body.get("retry_after", 1))
+
+
+class AdaptiveTokenBucket:
+    """Admit requests at an AIMD rate, with bursts of up to one second of requests.
+
+    The rate is `max_rate`, or None without limit, until Bedrock first throttles. A
+    throttle lowers the rate to `decrease_factor` times the rate of the requests that
+    succeeded over the last second, at most once per second: the throttles of the
+    requests sent before a decrease do not count again.
+    """
+
+    def __init__(self, max_rate=0.0, decrease_factor=0.5, increase_per_second=1.0):
+        self.max_rate = max_rate or None
+        self.decrease_factor = decrease_factor
+        self.increase_per_second = increase_per_second
+        self.rate = self.max_rate
+        self._tokens = self.rate or 0.0
+        self._updated = time.monotonic()
+        self._decreased_at = float("-inf")
+        # Completion times of the requests that succeeded over the last second
+        self._succeeded = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Take a token, sleeping until it is available, and return the admission time and the wait.
+
+        Returns None without taking a token when it would take longer than `max_wait`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.rate is not None:
+                self._refill(now)
+                wait = max(0.0, (1 - self._tokens) / self.rate)
+                if wait > max_wait:
+                    return None
+                # Tokens go negative so that waiting callers are admitted in turn
+                self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return now + wait, wait
+
+    def on_success(self):
+        with self._lock:
+            now = time.monotonic()
+            self._succeeded.append(now)
+            while self._succeeded[0] < now - 1:
+                self._succeeded.popleft()
+            if self.rate is None:
+                return
+            self._refill(now)
+            # Every success adds its share of increase_per_second at the current rate
+            self.rate += self.increase_per_second / self.rate
+            if self.max_rate:
+                self.rate = min(self.rate, self.max_rate)
+
+    def on_throttle(self, admitted_at):
+        """Lower the rate, unless it was lowered less than a second ago or after `admitted_at`."""
+        with self._lock:
+            now = time.monotonic()
+            if admitted_at < self._decreased_at or now - self._decreased_at < 1:
+                return
+            self._refill(now)
+            succeeded = sum(1 for completed in self._succeeded if completed >= now - 1)
+            current = min(self.rate or float("inf"), max(succeeded, MIN_RATE))
+            self.rate = max(MIN_RATE, current * self.decrease_factor)
+            # Requests already waiting keep their turn, new ones are paced at the new rate
+            self._tokens = 0.0
+            self._decreased_at = now
+            logger.warning(f"Bedrock throttled, rate lowered to {self.rate:.2f} requests per second")
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class CircuitBreaker:
+    """Reject calls for `reset_seconds` after `failure_threshold` consecutive failures.
+
+    Once they elapsed a single trial call is let through (half open), which closes the
+    circuit when it succeeds and opens it again when it fails.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self._trial or time.monotonic() - self.opened_at >= self.reset_seconds else "open"
+
+    def allow(self):
+        """Return 0 when the call can be made, or the seconds until the circuit lets a call through."""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._trial:
+                return 1.0
+            self._trial = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Bedrock circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                logger.warning(f"Bedrock circuit opened for {self.reset_seconds}s after {self.failures} failures")
+            self._trial = False
+
+    def record_neutral(self):
+        """End the trial call of a request error, which tells nothing about the service."""
+        with self._lock:
+            self._trial = False
+
+
+class MemoryThrottleSignals:
+    """Throttle signals shared by the limiters of one process, such as the benchmarks."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_id):
+        with self._lock:
+            return self._items.get(model_id)
+
+    def put(self, model_id, throttled_at_ms):
+        with self._lock:
+            self._items[model_id] = throttled_at_ms
+
+
+class DynamoDBThrottleSignals:
+    """Throttle signals stored in a DynamoDB table keyed by `model_id`.
+
+    Signals of models that are no longer throttled are removed by the table's TTL on
+    the `expires_at` attribute.
+    """
+
+    def __init__(self, table_name, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+        self._table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, model_id):
+        item = self._table.get_item(Key={"model_id": model_id}).get("Item")
+        return int(item["throttled_at_ms"]) if item else None
+
+    def put(self, model_id, throttled_at_ms):
+        self._table.put_item(Item={
+            "model_id": model_id,
+            "throttled_at_ms": throttled_at_ms,
+            "expires_at": throttled_at_ms // 1000 + self.ttl_seconds,
+        })
+
+
+class ThrottleSignal:
+    """Share the throttles of the questions with the ingestion of every container.
+
+    Interactive calls publish the time they were throttled, at most once per
+    `interval` and model, and ingestion polls it as often. A throttle more recent
+    than the last one seen by the container lowers its ingestion rate for the model,
+    like a throttle of its own calls. Failures of the backend are logged, ingestion
+    then only adapts to its own throttles.
+    """
+
+    def __init__(self, backend, interval=1.0):
+        self.backend = backend
+        self.interval = interval
+        self._published = {}
+        self._polled = {}
+        # Throttles older than the container are not seen by it
+        self._seen = {}
+        self._started_ms = int(time.time() * 1000)
+        self._lock = threading.Lock()
+
+    def publish(self, model_id):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._published.get(model_id, float("-inf")) < self.interval:
+                return
+            self._published[model_id] = now
+        try:
+            self.backend.put(model_id, int(time.time() * 1000))
+        except Exception as e:
+            logger.warning(f"Could not publish the throttling of {model_id}: {e}")
+
+    def throttled(self, model_id):
+        """Return True when questions were throttled by `model_id` since the previous poll."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._polled.get(model_id, float("-inf")) < self.interval:
+                return False
+            self._polled[model_id] = now
+        try:
+            throttled_at_ms = self.backend.get(model_id)
+        except Exception as e:
+            logger.warning(f"Could not read the throttling of {model_id}: {e}")
+            return False
+        if throttled_at_ms is None:
+            return False
+        with self._lock:
+            seen = self._seen.get(model_id, self._started_ms)
+            self._seen[model_id] = max(seen, throttled_at_ms)
+        return throttled_at_ms > seen
+
+
+COUNTERS = ("requests", "throttles", "retries", "rejections", "failures", "wait_ms")
+
+
+class _ModelLimiter:
+    def __init__(self, policies, circuit_failures, circuit_reset_seconds):
+        self.breakers = {budget: CircuitBreaker(circuit_failures, circuit_reset_seconds) for budget in policies}
+        self.buckets = {
+            budget: AdaptiveTokenBucket(policy.max_rate, policy.decrease_factor, policy.increase_per_second)
+            for budget, policy in policies.items()
+        }
+        self.counters = {budget: dict.fromkeys(COUNTERS, 0) for budget in policies}
+
+
+class RateLimiter:
+    """Limiters of the Bedrock models called by the container, see the module docstring."""
+
+    def __init__(self, policies=None, circuit_failures=5, circuit_reset_seconds=30.0, signal=None):
+        self.policies = dict(policies or DEFAULT_POLICIES)
+        self.signal = signal or ThrottleSignal(MemoryThrottleSignals())
+        self.circuit_failures = circuit_failures
+        self.circuit_reset_seconds = circuit_reset_seconds
+        self.config_version = None
+        self._models = {}
+        self._collected = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        """Apply the bedrock_* parameters of the app configuration when it changed."""
+        if config.version == self.config_version:
+            return
+        policies = {
+            INTERACTIVE: _with_max_rate(DEFAULT_POLICIES[INTERACTIVE], config.get('bedrock_interactive_max_rps', '0')),
+            INGESTION: _with_max_rate(DEFAULT_POLICIES[INGESTION], config.get('bedrock_ingestion_max_rps', '5')),
+        }
+        with self._lock:
+            self.policies = policies
+            self.circuit_failures = int(config.get('bedrock_circuit_failures', '5'))
+            self.circuit_reset_seconds = float(config.get('bedrock_circuit_reset_seconds', '30'))
+            for model in self._models.values():
+                for breaker in model.breakers.values():
+                    breaker.failure_threshold = self.circuit_failures
+                    breaker.reset_seconds = self.circuit_reset_seconds
+                for budget, policy in policies.items():
+                    bucket = model.buckets[budget]
+                    bucket.max_rate = policy.max_rate or None
+                    if bucket.max_rate and (bucket.rate is None or bucket.rate > bucket.max_rate):
+                        bucket.rate = bucket.max_rate
+            self.config_version = config.version
+
+    def call(self, model_id, function, budget=INTERACTIVE):
+        """Return the result of `function`, a call to the Bedrock model `model_id`, within `budget`."""
+        policy = self.policies[budget]
+        model = self._model(model_id)
+        bucket = model.buckets[budget]
+        breaker = model.breakers[budget]
+
+        retry_after = breaker.allow()
+        if retry_after:
+            self._count(model, budget, rejections=1)
+            raise BedrockUnavailableError(model_id, "circuit open", retry_after)
+
+        attempt = 0
+        while True:
+            if budget == INGESTION and self.signal.throttled(model_id):
+                # Questions come first, ingestion makes room for them
+                bucket.on_throttle(time.monotonic())
+            admission = bucket.acquire(policy.max_wait)
+            if admission is None:
+                breaker.record_neutral()
+                self._count(model, budget, rejections=1)
+                raise BedrockUnavailableError(model_id, f"{budget} budget exhausted", 1 / (bucket.rate or 1))
+            admitted_at, waited = admission
+            self._count(model, budget, requests=1, wait_ms=waited * 1000)
+            try:
+                result = function()
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code not in THROTTLING_ERRORS:
+                    if code in SERVER_ERRORS:
+                        breaker.record_failure()
+                        self._count(model, budget, failures=1)
+                    else:
+                        breaker.record_neutral()
+                    raise
+                self._count(model, budget, throttles=1)
+                bucket.on_throttle(admitted_at)
+                if budget == INTERACTIVE:
+                    self.signal.publish(model_id)
+                if attempt >= policy.max_retries:
+                    breaker.record_failure()
+                    self._count(model, budget, failures=1)
+                    raise BedrockUnavailableError(model_id, f"throttled after {attempt} retries", policy.max_delay) from e
+                attempt += 1
+                self._count(model, budget, retries=1)
+                # Full jitter, so the retries of concurrent callers spread out
+                time.sleep(random.uniform(0, min(policy.base_delay * 2 ** attempt, policy.max_delay)))
+                continue
+            except BotoCoreError:
+                # Connection errors and timeouts
+                breaker.record_failure()
+                self._count(model, budget, failures=1)
+                raise
+            except Exception:
+                breaker.record_neutral()
+                raise
+            breaker.record_success()
+            bucket.on_success()
+            return result
+
+    def stats(self):
+        """Return the counters, current rate and circuit state of every model and budget since the container started."""
+        with self._lock:
+            return {
+                model_id: {
+                    budget: {
+                        **counters,
+                        "wait_ms": round(counters["wait_ms"], 2),
+                        "rate": _round(model.buckets[budget].rate),
+                        "circuit": model.breakers[budget].state,
+                    }
+                    for budget, counters in model.counters.items()
+                }
+                for model_id, model in self._models.items()
+            }
+
+    def collect_metrics(self):
+        """Add the totals of the counters since the previous collection to the metrics of the invocation."""
+        with self._lock:
+            totals = dict.fromkeys(COUNTERS, 0)
+            for model in self._models.values():
+                for counters in model.counters.values():
+                    for name, value in counters.items():
+                        totals[name] += value
+            delta = {name: value - self._collected.get(name, 0) for name, value in totals.items()}
+            self._collected = totals
+        if not delta["requests"] and not delta["rejections"]:
+            return
+        for name in COUNTERS[:-1]:
+            add_metric(f"bedrock_{name}", delta[name])
+        add_metric("bedrock_wait", round(delta["wait_ms"], 2), MILLISECONDS)
+        if delta["throttles"] or delta["rejections"]:
+            logger.info({"bedrock_rate_limiter": self.stats()})
+
+    def _model(self, model_id):
+        model = self._models.get(model_id)
+        if model is None:
+            with self._lock:
+                model = self._models.get(model_id)
+                if model is None:
+                    model = self._models[model_id] = _ModelLimiter(
+                        self.policies, self.circuit_failures, self.circuit_reset_seconds
+                    )
+        return model
+
+    def _count(self, model, budget, **increments):
+        with self._lock:
+            counters = model.counters[budget]
+            for name, value in increments.items():
+                counters[name] += value
+
+
+def _with_max_rate(policy, max_rate):
+    return replace(policy, max_rate=float(max_rate))
+
+
+def _round(rate):
+    return round(rate, 2) if rate is not None else None
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the limiter of the container, configured from the app parameters when APP_NAME is set.
+
+    The throttles of questions are shared through the DynamoDB table named by
+    BEDROCK_THROTTLE_TABLE, or only within the process without it.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                signal = None
+                if os.environ.get("BEDROCK_THROTTLE_TABLE"):
+                    signal = ThrottleSignal(DynamoDBThrottleSignals(os.environ["BEDROCK_THROTTLE_TABLE"]))
+                limiter = RateLimiter(signal=signal)
+                on_flush(limiter.collect_metrics)
+                _rate_limiter = limiter
+    if os.environ.get("APP_NAME"):
+        _rate_limiter.configure(get_app_config())
+    return _rate_limiter
@@ -0,0 +1,410 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+from aws_lambda_powertools import Logger
+from rag_common.bedrock import BedrockCompletions, BedrockEmbeddings, human_assistant_format
+from rag_common.config import get_app_config
+from rag_common.clients import get_client, get_bedrock_runtime_client
+from rag_common.embedding_cache import CachedEmbeddings, get_embedding_cache
+from rag_common.context_packer import context_token_budget, estimate_tokens, pack_documents
+from rag_common.fusion import fuse
+from rag_common.index_profiles import DEFAULT_PROFILE, IndexProfile, get_index_profile
+from rag_common.index_versions import get_index_versions
+from rag_common.metrics import MILLISECONDS, add_metric, timed
+from rag_common.payload_logging import log_payload
+from rag_common.rate_limiter import BedrockUnavailableError, get_rate_limiter
+from rag_common.vector_store import get_vector_store
+
+logger = Logger(child=True)
+
+RESPONSE_MODEL_ID = "anthropic.claude-instant-v1"
+
+
+@dataclass
+class Document:
+    page_content: str
+    metadata: dict = field(default_factory=dict)
+    # Relevance of the document to the question, higher is more relevant
+    score: Optional[float] = None
+
+
+@dataclass
+class RetrievalRequest:
+    message: str
+    index: str
+    # Ranked candidate indices to search together, the first one is `index`
+    indices: List[str] = field(default_factory=list)
+    # Overrides the ef_search of the index profiles for this query
+    ef_search: Optional[int] = None
+
+    def candidate_indices(self):
+        return list(dict.fromkeys([self.index, *self.indices]))
+
+
+@dataclass
+class RetrievalResult:
+    documents: List[Document]
+
+    def to_payload(self):
+        return {"response": [asdict(document) for document in self.documents]}
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls([Document(**document) for document in payload["response"]])
+
+
+@dataclass
+class ResponseRequest:
+    message: str
+    documents: List[Document]
+
+    def to_payload(self):
+        return {"message": self.message, **RetrievalResult(self.documents).to_payload()}
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload["message"], RetrievalResult.from_payload(payload).documents)
+
+
+@dataclass
+class ResponseResult:
+    answer: str
+    context: str
+    error: Optional[str] = None
+    error_explication: Optional[str] = None
+
+    def to_payload(self):
+        """Return the payload of the response lambda.
+
+        Answers to prompts that do not follow the expected template are returned
+        with the error and context, without a status code, as the lambda always did.
+        """
+        if self.error:
+            return {
+                "result": self.answer,
+                "context": self.context,
+                "error_explication": self.error_explication,
+                "error": self.error,
+            }
+        return {
+            "statusCode": 200,
+            "body": json.dumps(self.answer),
+            "isBase64Encoded": False,
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        if "body" in payload:
+            return cls(json.loads(payload["body"]), "")
+        if "error" in payload and "result" in payload:
+            return cls(payload["result"], payload["context"], payload["error"], payload["error_explication"])
+        raise ValueError(f"Unexpected response payload: {payload}")
+
+
+def get_embeddings(profile=None):
+    """Return the embeddings of questions for the indices built with `profile`.
+
+    Without a profile the default Titan embeddings are returned. Repeated questions
+    are embedded from the cache.
+    """
+    profile = profile or IndexProfile(DEFAULT_PROFILE)
+    return get_client(
+        ("embeddings", profile.embedding_cache_id),
+        lambda: CachedEmbeddings(
+            BedrockEmbeddings(
+                client=get_bedrock_runtime_client(),
+                model_id=profile.embedding_model,
+                model_kwargs=profile.embedding_kwargs(),
+            ),
+            cache=get_embedding_cache(profile.embedding_cache_id),
+        ),
+    )
+
+
+# Profile of every index with the index version it was read at, {index_name: (version, profile)}
+_index_profiles = {}
+_index_profiles_lock = threading.Lock()
+
+
+def get_index_profile_of(index_name):
+    """Return the profile recorded in the mapping of `index_name`, read once per index version.
+
+    When the version of the index cannot be read the profile read before is kept.
+    """
+    with _index_profiles_lock:
+        cached = _index_profiles.get(index_name)
+    try:
+        version = get_index_versions().get(index_name)
+    except Exception as e:
+        logger.warning(f"Could not read the version of index {index_name}: {e}")
+        if cached:
+            return cached[1]
+        version = None
+    if cached and cached[0] == version:
+        return cached[1]
+
+    meta = get_vector_store().get_mappings(index_name).get("_meta")
+    # Indices created before profiles existed were all built with the default profile
+    profile = IndexProfile.from_meta(meta) or get_index_profile(get_app_config(), DEFAULT_PROFILE)
+    with _index_profiles_lock:
+        _index_profiles[index_name] = (version, profile)
+    return profile
+
+
+def _search_index(index_name, message, k, ef_search=None):
+    # Questions are embedded and encoded like the documents of the index
+    profile = get_index_profile_of(index_name)
+    with timed("query_embedding"):
+        vector = profile.encode_vector(get_embeddings(profile).embed_query(message))
+    with timed("knn_search"):
+        chunks = get_vector_store().search(index_name, profile, vector, k, ef_search)
+    return [
+        Document(
+            page_content=chunk.text,
+            metadata={**chunk.metadata, "url": chunk.url, "index": index_name},
+            score=chunk.score,
+        )
+        for chunk in chunks
+    ]
+
+
+def retrieve_documents(request: RetrievalRequest) -> RetrievalResult:
+    """Retrieval stage: return the chunks closest to the question.
+
+    A single index is searched for the `relevant_documents_count` closest chunks.
+    When the request carries several candidate indices, the first `fanout_indices`
+    of them are searched concurrently for `fanout_k` chunks each, and the results are
+    merged with `fusion_method` (see rag_common.fusion). An index that cannot be
+    searched is skipped as long as another one returns results.
+
+    `ef_search` of the request, or of the ef_search parameter, overrides the one of
+    the index profiles for engines that accept it in the query.
+    """
+    config = get_app_config()
+    relevant_documents_count = config.get_int('relevant_documents_count')
+    ef_search = request.ef_search or int(config.get('ef_search', '0'))
+    indices = request.candidate_indices()[:max(int(config.get('fanout_indices', '1')), 1)]
+
+    if len(indices) == 1:
+        documents = _search_index(request.index, request.message, relevant_documents_count, ef_search)
+        add_metric("retrieved_chunks", len(documents))
+        return RetrievalResult(documents)
+
+    # Embed the question once per embedding model, every index search then reads it from the embedding cache
+    profiles = set()
+    for index_name in indices:
+        try:
+            profiles.add(get_index_profile_of(index_name))
+        except Exception as e:
+            logger.warning(f"Could not read the index profile of {index_name}: {e}")
+    for profile in profiles:
+        with timed("query_embedding"):
+            get_embeddings(profile).embed_query(request.message)
+
+    fanout_k = int(config.get('fanout_k', '0')) or relevant_documents_count
+    results, errors = {}, {}
+
+    def search(index_name):
+        try:
+            results[index_name] = _search_index(index_name, request.message, fanout_k, ef_search)
+        except Exception as e:
+            errors[index_name] = e
+
+    with ThreadPoolExecutor(max_workers=len(indices)) as executor:
+        list(executor.map(search, indices))
+
+    if errors:
+        logger.warning(f"Could not search indices {sorted(errors)}: {errors}")
+        if not results:
+            raise next(iter(errors.values()))
+
+    documents = fuse(
+        {index_name: results[index_name] for index_name in indices if index_name in results},
+        method=config.get('fusion_method', 'rrf'),
+        k=relevant_documents_count,
+    )
+    logger.info(f"Fused {sum(len(docs) for docs in results.values())} chunks from indices {indices}")
+    add_metric("searched_indices", len(results))
+    add_metric("retrieved_chunks", len(documents))
+    return RetrievalResult(documents)
+
+
+def get_response_llm(max_tokens_to_sample, temperature):
+    """Return the LLM of the response stage, created once per container and set of parameters."""
+    model_kwargs = {"max_tokens_to_sample": max_tokens_to_sample, "temperature": temperature}
+    return get_client(
+        ("llm", RESPONSE_MODEL_ID, json.dumps(model_kwargs, sort_keys=True)),
+        lambda: BedrockCompletions(get_bedrock_runtime_client(), RESPONSE_MODEL_ID, model_kwargs),
+    )
+
+
+def _build_response_prompt(request):
+    """Return the prompt template, the combined documents and the formatted prompt.
+
+    The documents are packed into the part of the model context window left by the
+    prompt and the answer, see rag_common.context_packer.
+    """
+    config = get_app_config()
+    prompt = config.get('response_prompt')
+
+    token_budget = context_token_budget(
+        RESPONSE_MODEL_ID,
+        config.get_int('max_tokens_to_sample'),
+        prompt.format(question=request.message, documents=""),
+        max_context_tokens=int(config.get('context_max_tokens', '0')),
+    )
+    documents, stats = pack_documents(
+        request.documents,
+        token_budget,
+        max_overlap=int(config.get('chunk_overlap', '0')),
+    )
+    logger.info({"context_packing": stats})
+    add_metric("context_chunks", stats["packed"])
+    add_metric("context_tokens", stats["tokens"])
+
+    # Combine chunks of documents into a single string
+    full_chunks = "".join(
+        "\n<document>\n{}\n</document>".format(document.page_content) for document in documents
+    )
+
+    # Format the prompt with the question and the combined documents
+    formatted_prompt = prompt.format(question=request.message, documents=full_chunks)
+    log_payload("prompt", formatted_prompt)
+    return prompt, full_chunks, formatted_prompt
+
+
+def _response_result(prompt, answer, full_chunks):
+    # Check if the prompt is still the initial template
+    if '{documents}' not in prompt and '{question}' not in prompt:
+        return ResponseResult(
+            answer,
+            full_chunks,
+            error="prompt does not contain context",
+            error_explication="It seems like the responses do not have proper context on them. That means the model will use their training knwoledge which and may not be accurate",
+        )
+
+    # Check if the prompt does not include "<document>"
+    if "<document>" not in prompt and "<documents>" not in prompt:
+        return ResponseResult(
+            answer,
+            full_chunks,
+            error="prompt not optimal",
+            error_explication="It looks like the prompt can be improved using best practices of Claude LLM, see how to add context to prompts -> https://docs.anthropic.com/claude/docs/constructing-a-prompt#mark-different-parts-of-the-prompt",
+        )
+
+    return ResponseResult(answer, full_chunks)
+
+
+class ResponseStream:
+    """Iterate over the answer of the response stage as Bedrock generates it.
+
+    Tokens are read from the Bedrock response stream and yielded as they arrive.
+    Once the stream is exhausted `result` holds the complete ResponseResult, and
+    `time_to_first_token_ms` and `total_ms` the latency of the generation. The token
+    counts are read from the invocation metrics Bedrock adds to the last event, and
+    estimated from the text when they are missing.
+    """
+
+    def __init__(self, request: ResponseRequest):
+        config = get_app_config()
+        with timed("prompt_assembly"):
+            self.prompt, self.full_chunks, self.formatted_prompt = _build_response_prompt(request)
+        self.body = {
+            "prompt": human_assistant_format(self.formatted_prompt),
+            "max_tokens_to_sample": config.get_int('max_tokens_to_sample'),
+            "temperature": config.get_int('temperature'),
+        }
+        self.time_to_first_token_ms = None
+        self.total_ms = None
+        self.result = None
+
+    def __iter__(self):
+        started = time.perf_counter()
+        response = get_rate_limiter().call(
+            RESPONSE_MODEL_ID,
+            lambda: get_bedrock_runtime_client().invoke_model_with_response_stream(
+                modelId=RESPONSE_MODEL_ID,
+                body=json.dumps(self.body),
+                contentType="application/json",
+                accept="application/json",
+            ),
+        )
+
+        tokens = []
+        invocation_metrics = {}
+        for event in response["body"]:
+            if "chunk" not in event:
+                # Errors raised by the model during generation are sent as stream events
+                raise RuntimeError(f"Bedrock response stream failed: {event}")
+            chunk = json.loads(event["chunk"]["bytes"])
+            invocation_metrics = chunk.get("amazon-bedrock-invocationMetrics", invocation_metrics)
+            token = chunk.get("completion", "")
+            if not token:
+                continue
+            if self.time_to_first_token_ms is None:
+                self.time_to_first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+            tokens.append(token)
+            yield token
+
+        self.total_ms = round((time.perf_counter() - started) * 1000, 2)
+        answer = "".join(tokens)
+        self.result = _response_result(self.prompt, answer, self.full_chunks)
+        add_metric("generation", self.total_ms, MILLISECONDS)
+        if self.time_to_first_token_ms is not None:
+            add_metric("time_to_first_token", self.time_to_first_token_ms, MILLISECONDS)
+        add_metric("prompt_tokens", invocation_metrics.get("inputTokenCount") or estimate_tokens(self.body["prompt"]))
+        add_metric("completion_tokens", invocation_metrics.get("outputTokenCount") or estimate_tokens(answer))
+        logger.info({
+            "response_stream": {
+                "time_to_first_token_ms": self.time_to_first_token_ms,
+                "total_ms": self.total_ms,
+                "tokens": len(tokens),
+            }
+        })
+
+
+def stream_response(request: ResponseRequest) -> ResponseStream:
+    """Streaming response stage: return an iterator over the tokens of the answer."""
+    return ResponseStream(request)
+
+
+def generate_response(request: ResponseRequest) -> ResponseResult:
+    """Response stage: answer the question with the retrieved documents as context.
+
+    With response_streaming enabled the answer is read from the Bedrock response
+    stream, which reports the time to first token. The blocking completion call is
+    used when it is disabled or when the stream fails before its first token, unless
+    it failed because Bedrock is throttling.
+    """
+    config = get_app_config()
+    stream = None
+    if config.get('response_streaming', 'true').lower() == 'true':
+        stream = stream_response(request)
+        try:
+            for _ in stream:
+                pass
+            return stream.result
+        except BedrockUnavailableError:
+            raise
+        except Exception as e:
+            if stream.time_to_first_token_ms is not None:
+                raise
+            logger.warning(f"Response streaming failed, falling back to a blocking call: {e}")
+
+    temperature = config.get_int('temperature')
+    max_tokens_to_sample = config.get_int('max_tokens_to_sample')
+    llm = get_response_llm(max_tokens_to_sample, temperature)
+    if stream:
+        # The prompt of the failed stream is reused, so the documents are only packed once
+        prompt, full_chunks, formatted_prompt = stream.prompt, stream.full_chunks, stream.formatted_prompt
+    else:
+        with timed("prompt_assembly"):
+            prompt, full_chunks, formatted_prompt = _build_response_prompt(request)
+    with timed("generation"):
+        completion = llm.complete(formatted_prompt)
+    add_metric("prompt_tokens", completion.prompt_tokens or estimate_tokens(formatted_prompt))
+    add_metric("completion_tokens", completion.completion_tokens or estimate_tokens(completion.text))
+    return _response_result(prompt, completion.text, full_chunks)
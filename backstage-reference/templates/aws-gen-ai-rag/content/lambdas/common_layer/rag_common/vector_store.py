@@ -0,0 +1,235 @@
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Optional
+from aws_lambda_powertools import Logger
+from rag_common.clients import get_client, get_opensearch_client
+from rag_common.bulk_indexer import bulk_delete, bulk_index
+from rag_common.index_profiles import QUERY_EF_SEARCH_ENGINES
+from rag_common.opensearch import NotFoundError, RequestError
+
+logger = Logger(child=True)
+
+# Fields of the chunks of every index
+VECTOR_FIELD = "vector_field"
+TEXT_FIELD = "text"
+METADATA_FIELD = "metadata"
+
+# Backends selected by the VECTOR_STORE environment variable
+OPENSEARCH = "opensearch"
+LOCAL = "local"
+
+
+class IndexNotFoundError(Exception):
+    pass
+
+
+class IndexAlreadyExistsError(Exception):
+    pass
+
+
+@dataclass
+class ScoredChunk:
+    text: str
+    url: Optional[str]
+    # Relevance of the chunk to the query vector, higher is more relevant
+    score: float
+    metadata: dict = field(default_factory=dict)
+
+
+def index_mappings(profile):
+    """Return the mappings of an index built with `profile`, recording the profile in `_meta`."""
+    return {
+        "_meta": profile.to_meta(),
+        "properties": {
+            VECTOR_FIELD: profile.vector_mapping(),
+            TEXT_FIELD: {"type": "text", "index": False},
+            "url": {"type": "text", "index": True},
+            "chunk_id": {"type": "keyword"},
+        },
+    }
+
+
+class VectorStore(ABC):
+    """Storage of the chunks of every index with their embeddings.
+
+    The index lambda writes chunks as dicts with the VECTOR_FIELD, TEXT_FIELD, `url`
+    and `chunk_id` fields, the retrieval stage searches them by vector and the topic
+    router samples their vectors. Every chunk gets an id from the store, used to
+    delete it. Mappings follow the OpenSearch format in every backend.
+    """
+
+    @abstractmethod
+    def index_exists(self, index_name):
+        """Return True when `index_name` exists."""
+
+    @abstractmethod
+    def get_mappings(self, index_name):
+        """Return the mappings of `index_name`, or raise IndexNotFoundError."""
+
+    @abstractmethod
+    def create_index(self, index_name, profile):
+        """Create `index_name` for vectors of `profile`, or raise IndexAlreadyExistsError."""
+
+    @abstractmethod
+    def delete_index(self, index_name):
+        """Delete `index_name` with its chunks, or raise IndexNotFoundError."""
+
+    @abstractmethod
+    def iter_document_chunks(self, index_name, url, page_size=1000):
+        """Yield the (id, chunk id) of every chunk stored for exactly `url`, in lists of up to `page_size`."""
+
+    @abstractmethod
+    def index_chunks(self, index_name, chunks, batch_size, batch_bytes, max_retries):
+        """Store the `chunks` iterable and return the number of indexed and failed chunks."""
+
+    @abstractmethod
+    def delete_chunks(self, index_name, chunk_ids, batch_size, batch_bytes, max_retries):
+        """Delete chunks by id and return the number of deleted, failed and already deleted (not_found) chunks."""
+
+    @abstractmethod
+    def search(self, index_name, profile, vector, k, ef_search=None):
+        """Return the `k` chunks of `index_name` closest to `vector`, best first, as ScoredChunk."""
+
+    @abstractmethod
+    def sample_vectors(self, index_name, size):
+        """Return the vectors of up to `size` random chunks of `index_name`."""
+
+
+class OpenSearchVectorStore(VectorStore):
+    """Indices of the OpenSearch Serverless collection of the app, written with the _bulk API."""
+
+    def __init__(self, opensearch):
+        self.opensearch = opensearch
+
+    def index_exists(self, index_name):
+        return self.opensearch.indices.exists(index=index_name)
+
+    def get_mappings(self, index_name):
+        try:
+            return self.opensearch.indices.get_mapping(index=index_name)[index_name]["mappings"]
+        except NotFoundError as e:
+            raise IndexNotFoundError(index_name) from e
+
+    def create_index(self, index_name, profile):
+        index_body = {
+            "settings": {"index": profile.index_settings()},
+            "mappings": index_mappings(profile),
+        }
+        logger.info(f"Creating index {index_name} with profile {profile.name} and body:")
+        logger.info(index_body)
+        try:
+            response = self.opensearch.indices.create(index_name, body=index_body)
+        except RequestError as e:
+            if e.error == "resource_already_exists_exception":
+                raise IndexAlreadyExistsError(index_name) from e
+            raise
+        logger.info(response)
+        return response
+
+    def delete_index(self, index_name):
+        try:
+            return self.opensearch.indices.delete(index=index_name)
+        except NotFoundError as e:
+            raise IndexNotFoundError(index_name) from e
+
+    def iter_document_chunks(self, index_name, url, page_size=1000):
+        """Pages are sorted on the chunk id and the document id and requested with search_after,
+        so documents with more chunks than the result window are listed in full, and chunks
+        deleted between two pages do not shift the next ones. `url` is an analyzed text field,
+        so the phrase query can also match longer keys that contain this url and the hits are
+        filtered on the exact value.
+        """
+        search_after = None
+        while True:
+            body = {
+                "query": {"match_phrase": {"url": url}},
+                "_source": ["chunk_id", "url"],
+                "size": page_size,
+                # Chunks indexed before chunk ids were introduced have none, and older indices no mapping for it
+                "sort": [
+                    {"chunk_id": {"order": "asc", "missing": "_first", "unmapped_type": "keyword"}},
+                    {"_id": "asc"},
+                ],
+            }
+            if search_after is not None:
+                body["search_after"] = search_after
+            try:
+                search_response = self.opensearch.search(index=index_name, body=body)
+            except NotFoundError as e:
+                raise IndexNotFoundError(index_name) from e
+            page = search_response["hits"]["hits"]
+            chunks = [(hit["_id"], hit["_source"].get("chunk_id")) for hit in page if hit["_source"].get("url") == url]
+            if chunks:
+                yield chunks
+            if len(page) < page_size:
+                return
+            search_after = page[-1]["sort"]
+
+    def index_chunks(self, index_name, chunks, batch_size, batch_bytes, max_retries):
+        return bulk_index(self.opensearch, index_name, chunks, batch_size, batch_bytes, max_retries)
+
+    def delete_chunks(self, index_name, chunk_ids, batch_size, batch_bytes, max_retries):
+        return bulk_delete(self.opensearch, index_name, chunk_ids, batch_size, batch_bytes, max_retries)
+
+    def search(self, index_name, profile, vector, k, ef_search=None):
+        knn = {"vector": vector, "k": k}
+        if ef_search:
+            if profile.engine in QUERY_EF_SEARCH_ENGINES:
+                knn["method_parameters"] = {"ef_search": ef_search}
+            else:
+                logger.info(
+                    f"Index {index_name} uses the {profile.engine} engine of profile {profile.name}, "
+                    f"which reads ef_search from the index settings ({profile.ef_search})"
+                )
+
+        response = self.opensearch.search(
+            index=index_name,
+            body={
+                "size": k,
+                "query": {"knn": {VECTOR_FIELD: knn}},
+                "_source": {"excludes": [VECTOR_FIELD]},
+            },
+        )
+        return [
+            ScoredChunk(
+                text=hit["_source"][TEXT_FIELD],
+                url=hit["_source"].get("url"),
+                score=hit["_score"],
+                metadata=hit["_source"].get(METADATA_FIELD, {}),
+            )
+            for hit in response["hits"]["hits"]
+        ]
+
+    def sample_vectors(self, index_name, size):
+        response = self.opensearch.search(
+            index=index_name,
+            body={
+                "size": size,
+                "_source": [VECTOR_FIELD],
+                "query": {"function_score": {"query": {"match_all": {}}, "random_score": {}}},
+            },
+        )
+        return [hit["_source"][VECTOR_FIELD] for hit in response["hits"]["hits"] if VECTOR_FIELD in hit["_source"]]
+
+
+def get_vector_store(timeout=30, pool_maxsize=10):
+    """Return the vector store of the app, created once per container.
+
+    The backend is chosen by the VECTOR_STORE environment variable: `opensearch`
+    (the default) uses the collection at OPENSEARCH_ENDPOINT, with `timeout` and
+    `pool_maxsize` for its client. `local` keeps the indices in files under
+    VECTOR_STORE_PATH, see rag_common.local_vector_store.
+    """
+    backend = os.environ.get("VECTOR_STORE", OPENSEARCH)
+    if backend == LOCAL:
+        from rag_common.local_vector_store import LocalVectorStore
+
+        root_path = os.environ["VECTOR_STORE_PATH"]
+        return get_client(("vector_store", LOCAL, root_path), lambda: LocalVectorStore(root_path))
+    if backend == OPENSEARCH:
+        return get_client(
+            ("vector_store", OPENSEARCH, timeout, pool_maxsize),
+            lambda: OpenSearchVectorStore(get_opensearch_client(timeout=timeout, pool_maxsize=pool_maxsize)),
+        )
+    raise ValueError(f"Unknown vector store {backend}, expected {OPENSEARCH} or {LOCAL}")
@@ -0,0 +1,8 @@
+import numpy as np
+
+
+def normalize(embedding):
+    """Return `embedding` as a float32 vector of unit length, zero vectors are returned as they are."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,188 @@
+"""Checkpoints of the documents being indexed, to resume them in a later invocation.
+
+A checkpoint is written once the chunks of a byte range are embedded and indexed.
+It holds the position in the object up to which the chunks are committed, the state
+of the text splitter at that position and the ids of the chunks seen so far, keyed by the
+bucket, key and ETag of the object: a new version of the object starts over.
+
+Checkpoints are an optimization. A document without one is read from the start,
+and the chunks already in its index are still not embedded again.
+"""
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+import boto3
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+# Checkpoints larger than this are not written, the items of DynamoDB hold up to 400 KB
+MAX_CHECKPOINT_BYTES = 350 * 1024
+
+# Chunk ids are MD5 digests, their first 8 bytes identify them within a document
+SEEN_ID_BYTES = 8
+
+
+def seen_id(chunk_id):
+    """Return the compact form of `chunk_id` kept in `Checkpoint.seen`."""
+    return bytes.fromhex(chunk_id[:SEEN_ID_BYTES * 2]) if chunk_id else None
+
+
+@dataclass
+class Checkpoint:
+    bucket: str
+    key: str
+    etag: str
+    # Position in the object up to which the chunks are indexed, and the state of the text splitter at it
+    offset: int = 0
+    splitter_state: dict = None
+    seen: set = field(default_factory=set)
+    new_chunks: int = 0
+    indexed: int = 0
+    failed: int = 0
+    embedding_seconds: float = 0.0
+    # Invocations that worked on the document
+    invocations: int = 1
+
+    @property
+    def checkpoint_key(self):
+        return checkpoint_key(self.bucket, self.key, self.etag)
+
+    def dumps(self):
+        state = {name: value for name, value in self.__dict__.items() if name != "seen"}
+        state["seen"] = base64.b64encode(b"".join(sorted(self.seen))).decode()
+        return json.dumps(state, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, text):
+        state = json.loads(text)
+        seen = base64.b64decode(state.pop("seen"))
+        state["seen"] = {seen[i:i + SEEN_ID_BYTES] for i in range(0, len(seen), SEEN_ID_BYTES)}
+        return cls(**state)
+
+
+def checkpoint_key(bucket, key, etag):
+    return hashlib.sha256(f"{bucket}\0{key}\0{etag}".encode()).hexdigest()
+
+
+class MemoryCheckpoints:
+    """Checkpoints kept by the container, found again only by the invocations it serves."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._items.get(key)
+
+    def put(self, key, state):
+        with self._lock:
+            self._items[key] = state
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class SQLiteCheckpoints:
+    """Checkpoints stored in a local SQLite file, meant for tests and local runs."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS checkpoints (checkpoint_key TEXT PRIMARY KEY, state TEXT NOT NULL)")
+        self._connection.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT state FROM checkpoints WHERE checkpoint_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, state):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO checkpoints (checkpoint_key, state) VALUES (?, ?)", (key, state))
+            self._connection.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._connection.execute("DELETE FROM checkpoints WHERE checkpoint_key = ?", (key,))
+            self._connection.commit()
+
+
+class DynamoDBCheckpoints:
+    """Checkpoints stored in a DynamoDB table keyed by `checkpoint_key`.
+
+    Checkpoints of documents that are never finished are removed by the table's TTL
+    on the `expires_at` attribute.
+    """
+
+    def __init__(self, table_name, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._table = boto3.resource("dynamodb").Table(table_name)
+
+    def get(self, key):
+        item = self._table.get_item(Key={"checkpoint_key": key}, ConsistentRead=True).get("Item")
+        return item["state"] if item else None
+
+    def put(self, key, state):
+        self._table.put_item(Item={"checkpoint_key": key, "state": state, "expires_at": int(time.time()) + self.ttl_seconds})
+
+    def delete(self, key):
+        self._table.delete_item(Key={"checkpoint_key": key})
+
+
+class CheckpointStore:
+    """Load, save and clear the checkpoints of documents in a backend.
+
+    Failures of the backend are logged, a checkpoint that cannot be read or written
+    only means that the document is read from the start again.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def load(self, bucket, key, etag):
+        try:
+            state = self.backend.get(checkpoint_key(bucket, key, etag))
+            return Checkpoint.loads(state) if state else None
+        except Exception as e:
+            logger.warning(f"Could not load the checkpoint of s3://{bucket}/{key}: {e}")
+            return None
+
+    def save(self, checkpoint):
+        state = checkpoint.dumps()
+        if len(state) > MAX_CHECKPOINT_BYTES:
+            logger.warning(f"Checkpoint of s3://{checkpoint.bucket}/{checkpoint.key} is too large ({len(state)} bytes), not saved")
+            return False
+        try:
+            self.backend.put(checkpoint.checkpoint_key, state)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not save the checkpoint of s3://{checkpoint.bucket}/{checkpoint.key}: {e}")
+            return False
+
+    def clear(self, checkpoint):
+        try:
+            self.backend.delete(checkpoint.checkpoint_key)
+        except Exception as e:
+            logger.warning(f"Could not delete the checkpoint of s3://{checkpoint.bucket}/{checkpoint.key}: {e}")
+
+
+def get_checkpoint_store():
+    """Return the checkpoint store chosen from the environment.
+
+    INGESTION_CHECKPOINT_TABLE selects the DynamoDB backend, INGESTION_CHECKPOINT_PATH a
+    local SQLite file. Without either checkpoints are kept in memory by the container.
+    """
+    ttl_seconds = int(os.environ.get("INGESTION_CHECKPOINT_TTL_DAYS", "7")) * 24 * 3600
+    if os.environ.get("INGESTION_CHECKPOINT_TABLE"):
+        return CheckpointStore(DynamoDBCheckpoints(os.environ["INGESTION_CHECKPOINT_TABLE"], ttl_seconds))
+    if os.environ.get("INGESTION_CHECKPOINT_PATH"):
+        return CheckpointStore(SQLiteCheckpoints(os.environ["INGESTION_CHECKPOINT_PATH"]))
+    return CheckpointStore(MemoryCheckpoints())
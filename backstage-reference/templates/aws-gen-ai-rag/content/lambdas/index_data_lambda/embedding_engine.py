@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from aws_lambda_powertools import Logger
+from rag_common.bedrock import BedrockEmbeddings
+from rag_common.clients import get_bedrock_runtime_client
+from rag_common.embedding_cache import DEFAULT_MODEL_ID, get_embedding_cache
+from rag_common.rate_limiter import INGESTION
+
+logger = Logger(child=True)
+
+
+class EmbeddingEngine:
+    """Embeds texts with Bedrock on a bounded thread pool.
+
+    The engine keeps a single bedrock-runtime client for the lifetime of the container.
+    Texts are split into batches of at most `batch_size` that are embedded concurrently by up
+    to `max_workers` threads, and the vectors are returned in input order. Requests are
+    made within the ingestion budget of the rate limiter, which retries throttled
+    requests and adapts their rate to the available Bedrock quota, giving way to the
+    questions of users (see rag_common.rate_limiter). Texts found in the embedding
+    cache are not sent to Bedrock at all.
+
+    `model_kwargs` are sent with every text, such as the output dimensions of models
+    that support several, and `cache_id` identifies these embeddings in the cache.
+    """
+
+    def __init__(
+        self,
+        region_name,
+        model_id=DEFAULT_MODEL_ID,
+        batch_size=32,
+        max_workers=8,
+        model_kwargs=None,
+        cache_id=None,
+    ):
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.embeddings = BedrockEmbeddings(
+            get_bedrock_runtime_client(max_pool_connections=max_workers, region_name=region_name),
+            model_id,
+            model_kwargs,
+            budget=INGESTION,
+        )
+        self.cache = get_embedding_cache(cache_id or model_id)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def shutdown(self):
+        """Stop the thread pool once the batches already submitted are embedded."""
+        self._executor.shutdown(wait=False)
+
+    def embed(self, texts):
+        return self.cache.get_or_embed(texts, self._embed_uncached)
+
+    def _embed_uncached(self, texts):
+        # Small inputs are spread over all workers instead of filling a single batch
+        batch_size = max(1, min(self.batch_size, -(-len(texts) // self.max_workers)))
+        batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+        logger.info(f"Embedding {len(texts)} texts in {len(batches)} batches")
+        # map yields the batches in submission order regardless of completion order
+        return [vector for batch in self._executor.map(self._embed_batch, batches) for vector in batch]
+
+    def _embed_batch(self, texts):
+        return self.embeddings.embed_documents(texts)
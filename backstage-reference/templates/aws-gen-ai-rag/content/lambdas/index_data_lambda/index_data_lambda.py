@@ -1,99 +1,202 @@
 import json
 import os
+import threading
+import time
 import urllib.parse
+from functools import lru_cache
 import boto3
 from aws_lambda_powertools import Logger, Tracer
 from aws_lambda_powertools.utilities.data_classes import event_source, S3Event
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import hashlib
-from langchain.document_loaders import TextLoader
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, NotFoundError
-from langchain.embeddings import BedrockEmbeddings
+from checkpoints import Checkpoint, get_checkpoint_store, seen_id
+from embedding_engine import EmbeddingEngine
+from s3_stream import S3TextReader, split_text_stream
+from text_splitter import RecursiveCharacterTextSplitter
+from record_executor import is_retryable, process_records, RecordDeferredError, RecordsNotProcessedError
+from rag_common.clients import get_client
+from rag_common.config import get_app_config
+from rag_common.index_versions import get_index_versions
+from rag_common.index_profiles import IndexProfile, get_index_profile
+from rag_common.metrics import MILLISECONDS, add_metric, record_metrics, timed
+from rag_common.payload_logging import payload_logging
+from rag_common.vector_store import (
+    VECTOR_FIELD,
+    IndexAlreadyExistsError,
+    IndexNotFoundError,
+    get_vector_store,
+)
 
 
-param_values = {}
-params_to_retrieve = ['chunk_size', 'chunk_overlap']
+# Optional parameters fall back to these defaults when they are not set in SSM
+param_defaults = {
+    'index_batch_size': '500',
+    'index_batch_bytes': str(5 * 1024 * 1024),
+    'index_max_retries': '3',
+    'embedding_batch_size': '4',
+    'embedding_concurrency': '8',
+    's3_read_bytes': str(1024 * 1024),
+    'record_concurrency': '4',
+    'record_time_reserve_seconds': '60',
+    'index_self_continuation': 'true',
+    'index_max_continuations': '20',
+}
 
-ssm = boto3.client('ssm')
+config = get_app_config(defaults=param_defaults)
 
-app_name = os.environ["APP_NAME"]
+tracer = Tracer()
+logger = Logger()
 
-for param in params_to_retrieve:
-    param_name = f'/opa/gen-ai/{app_name}/{param}'
-    ssm_prompt_response = ssm.get_parameter(
-        Name=param_name)
-    param_value = ssm_prompt_response['Parameter']['Value']
-    param_values[param] = param_value
+s3 = boto3.client("s3")
 
-chunk_size = int(param_values.get('chunk_size'))
-chunk_overlap = int(param_values.get('chunk_overlap'))
+# Sized for the concurrent records and bulk requests of one invocation
+vector_store = get_vector_store(timeout=300, pool_maxsize=25)
 
-tracer = Tracer()
-logger = Logger()
+checkpoint_store = get_checkpoint_store()
+
+# Profiles of the indices known to exist with a compatible mapping in this container
+known_indices = {}
+known_indices_lock = threading.Lock()
 
-endpoint_url = os.environ["OPENSEARCH_ENDPOINT"]
-port= 443
-region = os.environ["AWS_REGION"]
-endpoint = endpoint_url.strip('[]').replace('http://', '').replace('https://', '')
 
+# The text splitter is rebuilt only when its parameters change
+@lru_cache(maxsize=1)
+def _build_text_splitter(chunk_size, chunk_overlap):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len
+    )
 
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len
-)
+def get_text_splitter():
+    return _build_text_splitter(config.get_int('chunk_size'), config.get_int('chunk_overlap'))
 
-service = "aoss"
-credentials = boto3.Session().get_credentials()
-auth = AWSV4SignerAuth(credentials, region, service)
-s3 = boto3.client("s3")
 
-opensearch = OpenSearch(
-    hosts=[{"host": endpoint, "port": int(port)}],
-    http_auth=auth,
-    use_ssl=True,
-    verify_certs=True,
-    connection_class=RequestsHttpConnection,
-    timeout=300,
-)
+# Embedding engine of every index profile, with the settings it was built with
+embedding_engines = {}
+embedding_engines_lock = threading.Lock()
 
 
-@logger.inject_lambda_context(log_event=True)
+def get_embedding_engine(profile):
+    """Return the engine computing the embeddings of the indices built with `profile`.
+
+    The engine is rebuilt when `embedding_batch_size`, `embedding_concurrency` or the
+    profile change, and the thread pool of the engine it replaces is shut down.
+    """
+    settings = (config.get_int('embedding_batch_size'), config.get_int('embedding_concurrency'), profile)
+    with embedding_engines_lock:
+        cached = embedding_engines.get(profile.name)
+        if cached and cached[0] == settings:
+            return cached[1]
+        batch_size, max_workers, _ = settings
+        engine = EmbeddingEngine(
+            os.environ["REGION"],
+            model_id=profile.embedding_model,
+            batch_size=batch_size,
+            max_workers=max_workers,
+            model_kwargs=profile.embedding_kwargs(),
+            cache_id=profile.embedding_cache_id,
+        )
+        embedding_engines[profile.name] = (settings, engine)
+    if cached:
+        logger.info(f"Embedding settings of profile {profile.name} changed, replacing its engine")
+        cached[1].shutdown()
+    return engine
+
+
+def _bulk_options():
+    return {
+        "batch_size": config.get_int('index_batch_size'),
+        "batch_bytes": config.get_int('index_batch_bytes'),
+        "max_retries": config.get_int('index_max_retries'),
+    }
+
+
+@logger.inject_lambda_context
 @tracer.capture_lambda_handler
+@record_metrics
+@payload_logging
 @event_source(data_class=S3Event)
 def lambda_handler(event: S3Event, context):
-    logger.info(event)
-    documents_to_add, documents_to_remove = get_documents_from_s3_record(event)
-    index_documents = []
+    time_reserve_ms = config.get_int('record_time_reserve_seconds') * 1000
 
-    for document in documents_to_add:
-        index_documents.append(add_document_to_index(document))
+    def out_of_time():
+        return context.get_remaining_time_in_millis() < time_reserve_ms
+
+    index_documents, unprocessed, bedrock_unavailable = process_records(
+        list(event.records),
+        lambda record: process_document(record, out_of_time),
+        max_workers=config.get_int('record_concurrency'),
+        context=context,
+        time_reserve_ms=time_reserve_ms,
+    )
 
-    for document in documents_to_remove:
-        index_documents.append(remove_document_from_index(document))
+    publish_index_versions(index_documents)
+
+    if unprocessed:
+        continuation = event.get("continuation", 0)
+        if (
+            not bedrock_unavailable
+            and config.get('index_self_continuation').lower() == 'true'
+            and continuation < config.get_int('index_max_continuations')
+        ):
+            continue_in_new_invocation(unprocessed, continuation + 1, context)
+            return index_documents
+        # Indexing is idempotent, so retrying the whole event only redoes the skipped records.
+        # A continuation would start at once, while Lambda retries a failed event after a
+        # delay that gives an unavailable Bedrock time to recover.
+        error = RecordsNotProcessedError(unprocessed)
+        logger.error(f"Unprocessed records: {error.records}, processed: {index_documents}")
+        raise error
 
     return index_documents
 
 
-def get_documents_from_s3_record(event):
-    logger.debug(f"Getting documents from S3 record: ", event)
-    documents_to_add = []
-    documents_to_remove = []
+def continue_in_new_invocation(records, continuation, context):
+    """Invoke this function asynchronously with the records left, which resume from their checkpoints."""
+    lambda_client = get_client("lambda", lambda: boto3.client("lambda"))
+    payload = {"Records": [record.raw_event for record in records], "continuation": continuation}
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(payload),
+    )
+    logger.info(f"Continuing {len(records)} records in invocation {continuation}")
+    add_metric("continuations", 1)
+
+
+def publish_index_versions(index_documents):
+    """Publish new versions of the indices of the processed records, invalidating cached answers.
 
-    for record in event.records:
-        event_name = record.event_name
-        if event_name.startswith("ObjectCreated"):
-            documents_to_add.append(record)
+    Every index a record was processed for gets a new version, even when none of its
+    chunks changed: a failure to publish fails the invocation, and the retried event
+    finds the chunks already written but still has to publish their versions.
+    """
+    indices = {result["index"] for result in index_documents if isinstance(result, dict) and "index" in result}
+    if indices:
+        get_index_versions().publish(indices)
+        logger.info(f"Published new versions for indices: {sorted(indices)}")
 
-        if event_name.startswith("ObjectRemoved"):
-            documents_to_remove.append(record)
 
-    logger.debug(f"documents_to_add: {documents_to_add}")
-    logger.debug(f"documents_to_remove: {documents_to_remove}")
-    return documents_to_add, documents_to_remove
+def process_document(record, out_of_time=lambda: False):
+    event_name = record.event_name
+    if event_name.startswith("ObjectCreated"):
+        return add_document_to_index(record, out_of_time)
+
+    if event_name.startswith("ObjectRemoved"):
+        return remove_document_from_index(record)
+
+    logger.debug(f"Ignoring event {event_name}")
+    return {"action": "ignored", "event_name": event_name}
 
 
 @tracer.capture_method
-def add_document_to_index(document):
+def add_document_to_index(document, out_of_time=lambda: False):
+    """Index the chunks of an S3 document that are not in its index yet and delete its stale chunks.
+
+    A checkpoint is saved once the chunks of every byte range are indexed. When
+    `out_of_time` returns True between two ranges the document is deferred with
+    RecordDeferredError, and an invocation processing it again, like a retry after a
+    timeout, resumes from the checkpoint of the same version of the object.
+    """
     # Assuming 'document' is a single record from the S3 event
     bucket_name = document['s3']['bucket']['name']
     object_key = urllib.parse.unquote_plus(document['s3']['object']['key'])
@@ -105,84 +208,114 @@ def add_document_to_index(document):
     logger.info(f"Index: {index_name}")
     
     try:
-        resource_properties = {}
-        dimension = resource_properties.get("Dimension", 1536)
-        vector_field = resource_properties.get("VectorField", "vector_field")
-        text_field = resource_properties.get("TextField", "text")
-        metadata_field = resource_properties.get("MetadataField", "metadata")
-        port = resource_properties.get("Port", 443)
-        timeout = resource_properties.get("Timeout", 300)
-        knn_algo_param_ef_search = resource_properties.get("KnnAlgoParamEfSearch", 512)
-        response = create_index(
-            opensearch,
-            index_name,
-            vector_field,
-            text_field,
-            metadata_field,
-            dimension,
-            knn_algo_param_ef_search,
-        )
-        
+        profile = ensure_index(index_name)
     except Exception as e:
+        if is_retryable(e):
+            raise
         logger.error(e)
         error = f"Error creating index {index_name}: {e}"
         logger.error(error)
         return error
 
-
-    logger.info(f"Loading document from s3://{bucket_name}/{object_key}")
-    object_key_local = object_key.replace("/","")
-    local_file_name = '/tmp/' + object_key_local
-
-    s3.download_file(bucket_name, object_key, local_file_name)
-  
-    loader = TextLoader(local_file_name)
-    
-    logger.debug(f"loader: {loader}")
-
-    logger.info(f"Splitting document from s3://{bucket_name}/{object_key}")
-    
-    x=loader.load()
-
-    texts = text_splitter.split_documents(x)
-    
-    logger.debug(f"texts: {texts}")
-
-    text_data = [text.page_content for text in texts]
-    logger.debug(f"text_data: {text_data}")
-    logger.info(text_data)
-
-    text_data_split = [
-        text_data[i : i + chunk_size] for i in range(0, len(text_data), chunk_size)
-    ]
-
-    query_result = []
+    chunk_size = config.get_int('chunk_size')
     logger.info(f"LOG---> indexing document: {object_key} ----- Using chunk_size: {chunk_size} ----- in index: {index_name}")
-    for chunk in text_data_split:
-        query_result_current = _get_embeddings(chunk)
-        query_result.extend(query_result_current)
-
-    data = list(zip(text_data, query_result))
-    print(data)
-    logger.debug(f"data: {data}")
-
-    for item in data:
-        logger.info(f"Indexing document for {object_key}")
-        logger.debug(f"item: {item}")
-        id = hashlib.md5(item[0].encode()).hexdigest()
-        # Remove the 'id' parameter from the opensearch.index call
-        response = opensearch.index(
-            index=index_name,
-            body={"vector_field": item[1], "text": item[0], "url": url},
-        )
+    text_splitter = get_text_splitter()
+    bulk_options = _bulk_options()
+
+    reader = S3TextReader(s3, bucket_name, object_key, config.get_int('s3_read_bytes'))
+    checkpoint = checkpoint_store.load(bucket_name, object_key, reader.etag)
+    if checkpoint:
+        checkpoint.invocations += 1
+        logger.info(f"Resuming {url} from byte {checkpoint.offset} of {reader.size}, {len(checkpoint.seen)} chunks done")
+        add_metric("resumed_bytes", checkpoint.offset)
+    else:
+        checkpoint = Checkpoint(bucket_name, object_key, reader.etag)
+
+    # Chunks indexed by previous invocations are listed too, they are among the chunks seen
+    existing_chunks = _get_indexed_chunks(index_name, url)
+    # Only chunk ids are kept for the whole document, texts and vectors live for one range
+    seen = checkpoint.seen
+
+    text_ranges = reader.ranges(checkpoint.offset)
+    for texts, splitter_state in split_text_stream(text_ranges, text_splitter, checkpoint.splitter_state):
+        new_chunks = []
+        for text in texts:
+            chunk_id = _get_chunk_id(url, text)
+            # Identical chunks of the same document share an id, so they are only stored once
+            if seen_id(chunk_id) in seen:
+                continue
+            seen.add(seen_id(chunk_id))
+            if chunk_id not in existing_chunks:
+                new_chunks.append((chunk_id, text))
+
+        if new_chunks:
+            checkpoint.new_chunks += len(new_chunks)
+            embedding_start = time.perf_counter()
+            # Taken for every range, so that documents switch to an engine rebuilt in the meantime
+            vectors = get_embedding_engine(profile).embed([text for _, text in new_chunks])
+            embedding_batch_seconds = time.perf_counter() - embedding_start
+            checkpoint.embedding_seconds += embedding_batch_seconds
+            add_metric("chunk_embedding", round(embedding_batch_seconds * 1000, 2), MILLISECONDS)
+
+            with timed("chunk_indexing"):
+                batch_result = vector_store.index_chunks(
+                    index_name,
+                    (
+                        {"vector_field": profile.encode_vector(vector), "text": text, "url": url, "chunk_id": chunk_id}
+                        for (chunk_id, text), vector in zip(new_chunks, vectors)
+                    ),
+                    **bulk_options,
+                )
+            checkpoint.indexed += batch_result["indexed"]
+            checkpoint.failed += batch_result["failed"]
+
+        if splitter_state is not None:
+            stopping = out_of_time()
+            # Ranges without new chunks are cheap to read again, they only move the checkpoint when stopping
+            if new_chunks or stopping:
+                checkpoint.offset = reader.offset
+                checkpoint.splitter_state = splitter_state
+                with timed("checkpoint_save"):
+                    checkpoint_store.save(checkpoint)
+            if stopping:
+                raise RecordDeferredError(f"Out of time at byte {checkpoint.offset} of {reader.size} of {url}")
+
+    new_chunk_count = checkpoint.new_chunks
+    embedding_seconds = checkpoint.embedding_seconds
+    result = {"indexed": checkpoint.indexed, "failed": checkpoint.failed}
+    embedding_throughput = round(new_chunk_count / embedding_seconds, 2) if embedding_seconds else 0
+    logger.info(f"Embedded {new_chunk_count} chunks in {embedding_seconds:.2f}s ({embedding_throughput} chunks/s)")
+    logger.info(f"Document {url} indexed in {checkpoint.invocations} invocations: {result}")
+    add_metric("indexed_chunks", result["indexed"])
+
+    stale_document_ids = []
+    for chunk_id, document_ids in existing_chunks.items():
+        # Keep one copy of every chunk that is still part of the document
+        stale_document_ids.extend(document_ids if seen_id(chunk_id) not in seen else document_ids[1:])
+    logger.info(
+        f"Document {url}: {len(seen)} chunks, {new_chunk_count} new, "
+        f"{len(seen) - new_chunk_count} unchanged, {len(stale_document_ids)} stale"
+    )
 
-        print(f"Document {url} added:")
-        print(response)
+    # Stale chunks are only removed once their replacements are written
+    deleted = vector_store.delete_chunks(
+        index_name,
+        stale_document_ids,
+        **bulk_options,
+    )
+    logger.info(f"Stale chunks of {url} deleted: {deleted}")
+    checkpoint_store.clear(checkpoint)
 
     response = {
         "bucket": bucket_name,
         "key": object_key,
-        "indexed": len(query_result),
+        "index": index_name,
+        "index_profile": profile.name,
+        "indexed": result["indexed"],
+        "failed": result["failed"] + deleted["failed"],
+        "unchanged": len(seen) - new_chunk_count,
+        "deleted": deleted["deleted"],
+        "embedding_chunks_per_second": embedding_throughput,
     }
 
     logger.debug(f"response: {response}")
@@ -197,92 +330,137 @@ def remove_document_from_index(document):
     logger.debug(f"object_key: {object_key}")
 
     url = f"s3://{bucket_name}/{object_key}"
-    index_name = object_key.split("/")[0]
+    index_name = object_key.split("/")[0].lower()
 
     try:
         if object_key[-1] == "/":
-            response = opensearch.indices.delete(index=index_name)
+            vector_store.delete_index(index_name)
+            known_indices.pop(index_name, None)
             logger.info(f"Deleted index: {index_name}")
             return {"action": "delete_index", "index": index_name}
         else:
-            search_response = opensearch.search(
-                index=index_name, body={"query": {"match": {"url": url}}}
-            )
-            logger.info(f"Found {search_response['hits']['total']['value']} documents to delete")
-
-            for hit in search_response["hits"]["hits"]:
-                opensearch.delete(index=index_name, id=hit["_id"])
-
-            return {"action": "delete_document", "index": index_name, "url": url, "count": search_response['hits']['total']['value']}
+            result = _delete_document_chunks(index_name, url, _bulk_options())
+            logger.info(f"Deleted chunks of {url}: {result}")
+            return {"action": "delete_document", "index": index_name, "url": url, "count": result["deleted"], "failed": result["failed"]}
     
-    except NotFoundError as e:
+    except IndexNotFoundError as e:
         logger.error(f"Index not found: {index_name}")
         return {"error": "index_not_found", "index": index_name, "message": str(e)}
 
     except Exception as e:
+        if is_retryable(e):
+            raise
         logger.error(f"Error removing document from index: {e}")
         return {"error": "general_error", "message": str(e)}
 
 
-def _get_embeddings(inputs):
-    logger.debug(f"Running get embeddings with inputs: {inputs}")
-
-    embeddings = BedrockEmbeddings(
-        client=get_bedrock_client(),
-    )
-
-    logger.debug("Getting embeddings")
-    query_result = embeddings.embed_documents(inputs)
-    logger.debug(f"embeddings: {query_result}")
+def _get_chunk_id(url, text):
+    content_hash = hashlib.md5(text.encode()).hexdigest()
+    return hashlib.md5(f"{url}#{content_hash}".encode()).hexdigest()
 
-    return query_result
 
+def _get_indexed_chunks(index_name, url):
+    """Return all the chunks already stored for `url` as a dict of chunk id -> document ids.
 
-def get_bedrock_client():
-    region_name=os.environ["REGION"]
-    endpoint_url = f"https://bedrock-runtime.{region_name}.amazonaws.com"
-    return boto3.client(
-        "bedrock-runtime",
-        region_name=region_name,
-        endpoint_url=endpoint_url,
-    )
+    The chunks are listed in full whatever their number, so every chunk still part
+    of the document is found and only the others are treated as new or stale.
+    Chunks indexed before chunk ids were introduced have no `chunk_id` and are
+    grouped under None, so they are treated as stale.
+    """
+    chunks = {}
+    try:
+        for page in vector_store.iter_document_chunks(index_name, url):
+            for document_id, chunk_id in page:
+                chunks.setdefault(chunk_id, []).append(document_id)
+    except IndexNotFoundError:
+        return {}
+    return chunks
+
+
+def _delete_document_chunks(index_name, url, bulk_options):
+    """Delete every chunk stored for `url` with bulk deletes and return the exact counts.
+
+    The chunks are listed in pages sorted on a unique key, so documents of any size are
+    deleted in one sweep, without waiting for the index to refresh between pages. Only
+    the chunks the bulk API reports as deleted are counted as deleted. The chunks that
+    could not be deleted are still stored and counted as failed.
+    """
+    result = {"deleted": 0, "failed": 0, "not_found": 0}
+    for page in vector_store.iter_document_chunks(index_name, url):
+        batch_result = vector_store.delete_chunks(
+            index_name,
+            [document_id for document_id, _ in page],
+            **bulk_options,
+        )
+        for name in result:
+            result[name] += batch_result[name]
+    if result["failed"]:
+        logger.warning(f"{result['failed']} chunks of {url} could not be deleted and are still in {index_name}")
+    return result
+
+
+def ensure_index(index_name):
+    """Create `index_name` if it does not exist yet and check the mapping of existing indices.
+
+    New indices are built with the profile selected by the index_profile parameter,
+    which is recorded in the `_meta` of their mapping. Existing indices keep the
+    profile they were built with. Indices that are known to exist with a compatible
+    mapping are cached for the lifetime of the container, so steady-state ingestion
+    skips this entirely.
+
+    Returns the profile of the index.
+    """
+    if index_name in known_indices:
+        return known_indices[index_name]
+
+    with known_indices_lock:
+        if index_name in known_indices:
+            return known_indices[index_name]
+
+        profile = get_index_profile(config)
+        if vector_store.index_exists(index_name):
+            profile = _verify_index_mapping(index_name, vector_store.get_mappings(index_name), profile)
+        else:
+            try:
+                vector_store.create_index(index_name, profile)
+            except IndexAlreadyExistsError:
+                # Another container created the index in the meantime
+                pass
+        known_indices[index_name] = profile
+        return profile
+
+
+def _verify_index_mapping(index_name, mappings, profile):
+    """Check the mapping of an existing index against the profile it was built with and return that profile.
+
+    Documents are embedded and encoded with the profile of their index, so an index
+    keeps its profile when `profile` is changed. Indices created before profiles
+    existed are reported with the settings they were all built with, the built-in
+    high_recall profile. The field type, dimension and knn method (name, engine,
+    space type and graph parameters) must be those of the profile.
+    """
+    vector_mapping = mappings.get("properties", {}).get(VECTOR_FIELD, {})
+    built_with = IndexProfile.from_meta(mappings.get("_meta")) or get_index_profile(config, "high_recall")
+    expected = {"type": "knn_vector", "dimension": built_with.dimension}
+    actual = {"type": vector_mapping.get("type"), "dimension": vector_mapping.get("dimension")}
+    expected_method = built_with.knn_method()
+    actual_method = vector_mapping.get("method") or {}
+    for key in ("name", "engine", "space_type"):
+        expected[f"method.{key}"] = expected_method[key]
+        actual[f"method.{key}"] = actual_method.get(key)
+    for key in ("m", "ef_construction"):
+        expected[f"method.parameters.{key}"] = expected_method["parameters"][key]
+        actual[f"method.parameters.{key}"] = (actual_method.get("parameters") or {}).get(key)
+    mismatches = {key: actual[key] for key in expected if actual[key] != expected[key]}
+    if mismatches:
+        raise ValueError(
+            f"Index {index_name} has an incompatible {VECTOR_FIELD} mapping {mismatches}, expected {expected}"
+        )
 
-def create_index(
-    opensearch,
-    index_name,
-    vector_field,
-    text_field,
-    metadata_field,
-    dimension,
-    knn_algo_param_ef_search,
-):
-    index_body = {
-        "settings": {
-            "index": {
-                "knn": True,
-                "knn.algo_param.ef_search": knn_algo_param_ef_search,
-            }
-        },
-        "mappings": {
-            "properties": {
-                vector_field: {
-                    "type": "knn_vector",
-                    "dimension": int(dimension),
-                    "method": {
-                        "name": "hnsw",
-                        "space_type": "l2",
-                        "engine": "nmslib",
-                        "parameters": {"ef_construction": 512, "m": 16},
-                    },
-                },
-                text_field: {"type": "text", "index": False},
-                "url": {"type": "text", "index": True},
-            }
-        },
-    }
-    logger.info(f"Creating index {index_name} with body:")
-    logger.info(index_body)
+    if built_with.name != profile.name:
+        logger.info(
+            f"Index {index_name} was built with index profile {built_with.name}, "
+            f"delete it to rebuild it with profile {profile.name}"
+        )
+    return built_with
 
-    response = opensearch.indices.create(index_name, body=index_body)
-    logger.info(response)
-    return response
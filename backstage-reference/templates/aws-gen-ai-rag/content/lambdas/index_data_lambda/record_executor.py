@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+from aws_lambda_powertools import Logger
+from rag_common.opensearch import TransportError
+from rag_common.rate_limiter import BedrockUnavailableError
+
+logger = Logger(child=True)
+
+# Error codes of the AWS services that are worth processing a record again for
+RETRYABLE_ERROR_CODES = {
+    "InternalError",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+
+
+class RecordsNotProcessedError(Exception):
+    """Raised when records were left unprocessed so that Lambda retries the event."""
+
+    def __init__(self, records):
+        self.records = [_record_id(record) for record in records]
+        super().__init__(f"{len(records)} records were not processed: {self.records}")
+
+
+class RecordDeferredError(Exception):
+    """Raised by a handler that stopped before the end of a record, to finish it in a later invocation."""
+
+
+def is_retryable(error):
+    """Return True for the transient failures of the services a record is processed with.
+
+    These are the throttling and server errors of OpenSearch and the AWS services,
+    and connection errors and timeouts.
+    """
+    if isinstance(error, TransportError):
+        return isinstance(error.status_code, int) and (error.status_code == 429 or error.status_code >= 500)
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES or status >= 500
+    return isinstance(error, (BotoCoreError, ConnectionError, TimeoutError))
+
+
+def _record_id(record):
+    return {
+        "event_name": record.event_name,
+        "bucket": record.s3.bucket.name,
+        "key": record.s3.get_object.key,
+    }
+
+
+def process_records(records, handler, max_workers, context, time_reserve_ms):
+    """Run `handler` for every S3 event record, processing different objects concurrently.
+
+    Records for the same bucket and key are handled one after another in event order,
+    so an add followed by a remove of the same object keeps its outcome. An exception
+    raised for one record is returned as that record's result without affecting the
+    others, unless it is a transient failure (see is_retryable). Records that have not
+    started once less than `time_reserve_ms` of the invocation remains are skipped, as
+    are the records deferred by the handler, that Bedrock kept throttling or that
+    failed with a transient error, and the next records for the same object.
+
+    Returns the results in event order, the skipped records in event order, and whether
+    a record was skipped because Bedrock was unavailable (BedrockUnavailableError).
+    """
+    groups = {}
+    for position, record in enumerate(records):
+        groups.setdefault((record.s3.bucket.name, record.s3.get_object.key), []).append((position, record))
+
+    results = {}
+    unprocessed = []
+    bedrock_unavailable = []
+
+    def process_group(group):
+        deferred = False
+        for position, record in group:
+            if deferred or context.get_remaining_time_in_millis() < time_reserve_ms:
+                unprocessed.append((position, record))
+                continue
+            try:
+                results[position] = handler(record)
+            except (RecordDeferredError, BedrockUnavailableError) as e:
+                logger.warning(f"Deferring record {_record_id(record)}: {e}")
+                unprocessed.append((position, record))
+                if isinstance(e, BedrockUnavailableError):
+                    bedrock_unavailable.append(e)
+                deferred = True
+            except Exception as e:
+                if is_retryable(e):
+                    logger.warning(f"Deferring record {_record_id(record)} after a transient error: {e}")
+                    unprocessed.append((position, record))
+                    deferred = True
+                    continue
+                logger.exception(f"Error processing record {_record_id(record)}")
+                results[position] = {"error": "record_error", **_record_id(record), "message": str(e)}
+
+    logger.info(f"Processing {len(records)} records for {len(groups)} objects with {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results so an unexpected error in a worker is raised here
+        list(executor.map(process_group, groups.values()))
+
+    skipped = [record for _, record in sorted(unprocessed, key=lambda item: item[0])]
+    return [results[position] for position in sorted(results)], skipped, bool(bedrock_unavailable)
@@ -0,0 +1,69 @@
+import codecs
+from aws_lambda_powertools import Logger
+from text_splitter import StreamSplitter
+
+logger = Logger(child=True)
+
+
+class S3TextReader:
+    """Read the text of an S3 object one byte range at a time.
+
+    The object is identified by the ETag of the initial HEAD request, and every range
+    is requested with it, so an object overwritten while it is being read fails
+    instead of mixing versions. Multi-byte characters split across ranges are decoded
+    once both halves are read.
+
+    After every range, `offset` is the position in the object up to which the text
+    was returned. Reading can resume from it in another invocation.
+    """
+
+    def __init__(self, s3, bucket_name, object_key, range_bytes):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.range_bytes = range_bytes
+        head = s3.head_object(Bucket=bucket_name, Key=object_key)
+        self.size = head["ContentLength"]
+        self.etag = head["ETag"]
+        self.offset = 0
+
+    def ranges(self, start=0):
+        """Yield the text of the object from byte `start`, which must start a character."""
+        logger.info(
+            f"Streaming s3://{self.bucket_name}/{self.object_key} ({self.size} bytes) from byte {start} "
+            f"in ranges of {self.range_bytes} bytes"
+        )
+        self.offset = start
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while start < self.size:
+            end = min((start // self.range_bytes + 1) * self.range_bytes, self.size) - 1
+            response = self.s3.get_object(
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                Range=f"bytes={start}-{end}",
+                IfMatch=self.etag,
+            )
+            text = decoder.decode(response["Body"].read(), final=end == self.size - 1)
+            # The bytes of a character split across ranges are decoded with the next range
+            self.offset = end + 1 - len(decoder.getstate()[0])
+            start = end + 1
+            yield text
+
+
+def read_text_ranges(s3, bucket_name, object_key, range_bytes):
+    """Yield the text of an S3 object one byte range at a time, see S3TextReader."""
+    return S3TextReader(s3, bucket_name, object_key, range_bytes).ranges()
+
+
+def split_text_stream(text_ranges, text_splitter, state=None):
+    """Split a stream of text incrementally, yielding the list of chunks completed by each range.
+
+    The chunks are the ones `text_splitter.split_text` returns for the whole text,
+    whatever the size of the ranges (see StreamSplitter). Every list is yielded with
+    the state of the splitter at that point, and None after the last range:
+    splitting the rest of the stream from that `state` yields the same chunks.
+    """
+    splitter = StreamSplitter(text_splitter, state)
+    for text in text_ranges:
+        yield splitter.feed(text), splitter.state()
+    yield splitter.finish(), None
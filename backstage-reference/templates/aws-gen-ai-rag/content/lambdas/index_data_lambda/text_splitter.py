@@ -0,0 +1,231 @@
+"""Recursive character text splitter of the Index Lambda.
+
+It splits text exactly like the RecursiveCharacterTextSplitter of langchain that
+the Index Lambda used before, with its default separators, so documents indexed
+before keep the same chunks and chunk ids and are not embedded again. Documents
+read in parts are split with StreamSplitter into the same chunks.
+"""
+import re
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+class RecursiveCharacterTextSplitter:
+    """Split text on the first separator found in it, splitting the pieces that are still
+    too long on the next separators, then merge the pieces into chunks of at most
+    `chunk_size` characters that overlap by up to `chunk_overlap` characters.
+
+    Separators are kept at the start of the piece that follows them and chunks are
+    stripped of surrounding whitespace.
+    """
+
+    def __init__(self, chunk_size=4000, chunk_overlap=200, length_function=len, separators=DEFAULT_SEPARATORS):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
+        self.separators = list(separators)
+
+    def split_text(self, text):
+        return self._split_text(text, self.separators)
+
+    def _split_text(self, text, separators):
+        separator = separators[-1]
+        next_separators = []
+        for position, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if re.search(re.escape(candidate), text):
+                separator = candidate
+                next_separators = separators[position + 1:]
+                break
+
+        chunks = []
+        short_pieces = []
+        for piece in _split_keeping_separator(text, separator):
+            if self.length_function(piece) < self.chunk_size:
+                short_pieces.append(piece)
+                continue
+            if short_pieces:
+                chunks.extend(self._merge(short_pieces))
+                short_pieces = []
+            if next_separators:
+                chunks.extend(self._split_text(piece, next_separators))
+            else:
+                chunks.append(piece)
+        if short_pieces:
+            chunks.extend(self._merge(short_pieces))
+        return chunks
+
+    def _merge(self, pieces):
+        """Merge consecutive pieces into chunks, starting every chunk with the end of the previous one."""
+        chunks = []
+        level = _Level(0)
+        for piece in pieces:
+            self._merge_piece(level, piece, chunks)
+        self._flush(level, chunks)
+        return chunks
+
+    def _merge_piece(self, level, piece, chunks):
+        """Add a piece to the chunk being merged, completing it first when the piece does not fit."""
+        length = self.length_function(piece)
+        if level.total + length > self.chunk_size and level.current:
+            chunk = "".join(level.current).strip()
+            if chunk:
+                chunks.append(chunk)
+            while level.total > self.chunk_overlap or (level.total + length > self.chunk_size and level.total > 0):
+                level.total -= self.length_function(level.current[0])
+                level.current = level.current[1:]
+        level.current.append(piece)
+        level.total += length
+
+    def _flush(self, level, chunks):
+        chunk = "".join(level.current).strip()
+        if chunk:
+            chunks.append(chunk)
+        level.current = []
+        level.total = 0
+
+
+class _Level:
+    """Splitting state of a text stream for the separator at `position`.
+
+    `pending` is the last piece, which the next text may continue, and `current` the
+    short pieces being merged into a chunk. A piece that is already too long is split
+    on the next separator as it arrives, by the `child` level: `pending` then only
+    holds the end of the text that may start a separator.
+    """
+
+    def __init__(self, position, pending="", current=None, total=0, child=None):
+        self.position = position
+        self.pending = pending
+        self.current = current or []
+        self.total = total
+        self.child = child
+
+    def to_state(self):
+        return {
+            "position": self.position,
+            "pending": self.pending,
+            "current": list(self.current),
+            "total": self.total,
+            "child": self.child.to_state() if self.child else None,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        child = cls.from_state(state["child"]) if state["child"] else None
+        return cls(state["position"], state["pending"], list(state["current"]), state["total"], child)
+
+
+class StreamSplitter:
+    """Split a text fed in parts into the chunks `text_splitter.split_text` returns for the whole text.
+
+    Chunks are only returned once the text that follows cannot change them: the
+    pieces a separator delimits are merged once the next separator is read, and a
+    piece is split on the next separators as soon as it is too long to be merged,
+    like split_text does. A separator missing from the text leaves it in one piece,
+    which split_text splits on the next separators too.
+
+    The state of the splitter between two parts is a JSON-serializable dict, to
+    resume splitting in another invocation.
+    """
+
+    def __init__(self, text_splitter, state=None):
+        self.text_splitter = text_splitter
+        self._root = _Level.from_state(state) if state else _Level(0)
+
+    def state(self):
+        return self._root.to_state()
+
+    def feed(self, text):
+        """Return the chunks completed by `text`."""
+        chunks = []
+        self._feed(self._root, text, chunks)
+        return chunks
+
+    def finish(self):
+        """Return the chunks of the rest of the text, once all of it is fed."""
+        chunks = []
+        self._finish(self._root, chunks)
+        return chunks
+
+    def _next_position(self, position):
+        separators = self.text_splitter.separators
+        if separators[position] == "" or position + 1 >= len(separators):
+            return None
+        return position + 1
+
+    def _feed(self, level, text, chunks):
+        separator = self.text_splitter.separators[level.position]
+        text = level.pending + text
+        level.pending = ""
+        if level.child:
+            end = text.find(separator) if separator else -1
+            if end < 0:
+                # The long piece goes on, except for the end of the text that may start a separator
+                kept = len(text) - _separator_prefix_length(text, separator)
+                self._feed(level.child, text[:kept], chunks)
+                level.pending = text[kept:]
+                return
+            self._feed(level.child, text[:end], chunks)
+            self._finish(level.child, chunks)
+            level.child = None
+            text = text[end:]
+
+        pieces = _split_keeping_separator(text, separator)
+        # Every character is a piece of its own when splitting on "", otherwise the last piece may go on
+        last = pieces.pop() if separator and pieces else ""
+        for piece in pieces:
+            self._add_piece(level, piece, chunks)
+        next_position = self._next_position(level.position)
+        if self.text_splitter.length_function(last) >= self.text_splitter.chunk_size and next_position is not None:
+            self.text_splitter._flush(level, chunks)
+            level.child = _Level(next_position)
+            kept = len(last) - _separator_prefix_length(last, separator)
+            self._feed(level.child, last[:kept], chunks)
+            level.pending = last[kept:]
+        else:
+            level.pending = last
+
+    def _finish(self, level, chunks):
+        if level.child:
+            self._feed(level.child, level.pending, chunks)
+            self._finish(level.child, chunks)
+            level.child = None
+        elif level.pending:
+            self._add_piece(level, level.pending, chunks)
+        level.pending = ""
+        self.text_splitter._flush(level, chunks)
+
+    def _add_piece(self, level, piece, chunks):
+        text_splitter = self.text_splitter
+        if text_splitter.length_function(piece) < text_splitter.chunk_size:
+            text_splitter._merge_piece(level, piece, chunks)
+            return
+        text_splitter._flush(level, chunks)
+        next_position = self._next_position(level.position)
+        if next_position is None:
+            chunks.append(piece)
+        else:
+            chunks.extend(text_splitter._split_text(piece, text_splitter.separators[next_position:]))
+
+
+def _separator_prefix_length(text, separator):
+    """Return the length of the longest end of `text` that starts `separator`."""
+    for length in range(min(len(separator) - 1, len(text)), 0, -1):
+        if text.endswith(separator[:length]):
+            return length
+    return 0
+
+
+def _split_keeping_separator(text, separator):
+    if not separator:
+        return list(text)
+    parts = re.split(f"({re.escape(separator)})", text)
+    pieces = [parts[0]] + [parts[i] + parts[i + 1] for i in range(1, len(parts) - 1, 2)]
+    if len(parts) % 2 == 0:
+        pieces.append(parts[-1])
+    return [piece for piece in pieces if piece != ""]
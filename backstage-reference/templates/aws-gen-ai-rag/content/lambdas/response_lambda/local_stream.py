@@ -0,0 +1,36 @@
+"""Stream an answer of the response stage locally, as server-sent events on stdout.
+
+Lambda functions behind the REST API return the whole answer at once, so this
+script exposes the streaming interface for local testing. Run it from this folder
+with AWS credentials, the app configuration in SSM and the common layer on the path:
+
+    PYTHONPATH=../common_layer APP_NAME=<app-name> REGION=<region> \\
+        python local_stream.py ../../events/response.json
+
+Every token is written as a `data:` event as soon as Bedrock generates it, followed
+by a `done` event with the time to first token and the non-streaming payload.
+"""
+import json
+import sys
+from rag_common.stages import ResponseRequest, stream_response
+
+
+def main(event_path):
+    with open(event_path) as event_file:
+        request = ResponseRequest.from_payload(json.load(event_file))
+
+    stream = stream_response(request)
+    for token in stream:
+        sys.stdout.write(f"data: {json.dumps({'token': token})}\n\n")
+        sys.stdout.flush()
+
+    done = {
+        "time_to_first_token_ms": stream.time_to_first_token_ms,
+        "total_ms": stream.total_ms,
+        "payload": stream.result.to_payload(),
+    }
+    sys.stdout.write(f"event: done\ndata: {json.dumps(done)}\n\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
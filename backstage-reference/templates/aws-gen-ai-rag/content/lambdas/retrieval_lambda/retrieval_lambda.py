@@ -1,29 +1,12 @@
-import os
-import boto3
 import json
 from aws_lambda_powertools import Logger, Tracer
 from aws_lambda_powertools.event_handler import APIGatewayHttpResolver, CORSConfig
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.utilities.typing import LambdaContext
-from langchain.embeddings import BedrockEmbeddings
-from langchain.vectorstores import OpenSearchVectorSearch
-from opensearchpy import RequestsHttpConnection, AWSV4SignerAuth
-
-param_values = {}
-params_to_retrieve = ['relevant_documents_count']
-
-ssm = boto3.client('ssm')
-
-app_name = os.environ["APP_NAME"]
-
-for param in params_to_retrieve:
-    param_name = f'/opa/gen-ai/{app_name}/{param}'
-    ssm_prompt_response = ssm.get_parameter(Name=param_name)
-    param_value = ssm_prompt_response['Parameter']['Value']
-    param_values[param] = param_value
-
-# Constants
-relevant_documents_count = int(param_values.get('relevant_documents_count'))
+from rag_common.metrics import record_metrics
+from rag_common.payload_logging import log_payload, payload_logging
+from rag_common.rate_limiter import BedrockUnavailableError, too_many_requests
+from rag_common.stages import RetrievalRequest, retrieve_documents
 
 # Initialize Tracer for X-Ray tracing
 tracer = Tracer()
@@ -35,13 +18,6 @@ cors_config = CORSConfig(allow_origin="*", max_age=300)
 # Create an API Gateway HTTP resolver with CORS configuration
 app = APIGatewayHttpResolver(cors=cors_config)
 
-def get_aws4_auth():
-    region = os.environ["REGION"]
-    service = "aoss"
-    session = boto3.Session(region_name=region)
-    credentials = boto3.Session().get_credentials()
-    return AWSV4SignerAuth(credentials, region, service)
-
 @app.post("/api/retriever")
 @tracer.capture_method
 def get_relevant_documents(event):
@@ -50,79 +26,23 @@ def get_relevant_documents(event):
         body = json.loads(event['body'])
         message_text = body["message"]
         index = body["index"]
+        indices = body.get("indices", [])
+        ef_search = body.get("ef_search")
     else:
         message_text = event["message"]
         index = event["index"]
-    
-    print(f'message: {message_text}')
-    print(f'index: {index}')
+        indices = event.get("indices", [])
+        ef_search = event.get("ef_search")
 
-    logger.info(f"Received message: {message_text}, Index: {index}")
+    logger.info(f"Index: {index}, candidate indices: {indices}")
+    log_payload("message", message_text)
     index_name = index
     
-    # Construct OpenSearch endpoint URL
-    os_endpoint_url = os.environ["OPENSEARCH_ENDPOINT"]
-    region = os.environ["REGION"]
-    endpoint = os_endpoint_url.strip('[]') + ":443"
-
-    endpoint_url =  f"https://bedrock-runtime.{region}.amazonaws.com"
-    
-    
-    bedrock_client = boto3.client(
-        "bedrock-runtime",
-        endpoint_url=endpoint_url,
-    )
-
-    # Try block to handle potential errors during vector store creation
-    try:
-        ### Bedrock Embeddings Class Below
-        embeddings = BedrockEmbeddings(client=bedrock_client)
-
-        # Initialize OpenSearchVectorSearch with the necessary parameters selecting the index defined before in chunk size index
-        vector_store = OpenSearchVectorSearch(
-            index_name=index_name,
-            embedding_function=embeddings,
-            opensearch_url=endpoint,
-            http_auth=get_aws4_auth(),
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection,
-        )
-    except Exception as e:
-        # Handle exceptions and log error
-        response = {
-            "response": [],
-            "error_explication": "Looks like we dont have Bedrock Boto3 SDK client Implemented",
-            "error": "boto3 not implemented"
-        }
-        logger.info(response)
-        return {
-            "statusCode": 500,
-            "body": json.dumps(response),
-            "headers": {"Content-Type": "application/json"}
-        }
-
-    # Create a retriever from the vector store
-    retriever = vector_store.as_retriever(search_kwargs={'k': relevant_documents_count})
-    logger.info(retriever)
-
     # Retrieve relevant documents based on the query
-    docs = retriever.get_relevant_documents(message_text)
-    logger.info(docs)
-
-    response = {
-        "response": [
-            {
-                "page_content": doc.page_content,
-                "metadata": {
-                    k: v for k, v in doc.metadata.items() if k != "vector_field"
-                },
-            }
-            for doc in docs
-        ],
-    }
+    result = retrieve_documents(RetrievalRequest(message=message_text, index=index_name, indices=indices, ef_search=ef_search))
+    response = result.to_payload()
 
-    logger.info(response)
+    log_payload("response", response)
 
     return {
         "statusCode": 200,
@@ -130,11 +50,16 @@ def get_relevant_documents(event):
         "headers": {"Content-Type": "application/json"}
     }
 
-@logger.inject_lambda_context(log_event=True, correlation_id_path=correlation_paths.API_GATEWAY_REST)
+@logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
 @tracer.capture_lambda_handler
+@record_metrics
+@payload_logging
 def lambda_handler(event: dict, context: LambdaContext) -> dict:
     try:
         return get_relevant_documents(event)
+    except BedrockUnavailableError as e:
+        logger.warning(f"Bedrock unavailable: {e}")
+        return too_many_requests(e)
     except Exception as e:
         logger.error(f"Exception in lambda_handler: {e}")
         return {
@@ -1,4 +1,5 @@
 import json
+import time
 import boto3
 import os
 
@@ -20,6 +21,10 @@ def lambda_handler(event, context):
 
             parameter_name = f'/opa/gen-ai/{app_name}/{key}'
 
+            # Objects such as index profiles are stored as JSON
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value)
+
             ssm.put_parameter(
                 Name=parameter_name,
                 Value=str(value),
@@ -27,6 +32,14 @@ def lambda_handler(event, context):
                 Overwrite=True
             )
 
+        # Lets warm lambda containers detect the change with a single parameter read
+        ssm.put_parameter(
+            Name=f'/opa/gen-ai/{app_name}/config_version',
+            Value=str(time.time_ns()),
+            Type='String',
+            Overwrite=True
+        )
+
         response_message = "Parameters pushed to SSM Parameter Store successfully"
         status_code = 200
     else:
@@ -0,0 +1,89 @@
+"""Unit tests of the lambda functions, run against the stand-ins of the benchmarks.
+
+    python -m unittest discover -s tests -t .
+
+Like the benchmarks, the tests import the functions the way Lambda does, with the
+folder of every function and of the common layer on the path. The functions create
+their clients when they are imported, so the tests that import them call
+`install_stand_ins` first.
+"""
+import os
+import sys
+import threading
+
+CONTENT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS_PATH = os.path.join(CONTENT_PATH, "lambdas")
+
+os.environ.update({
+    "VECTOR_STORE": "opensearch",
+    "APP_NAME": "tests",
+    "REGION": "us-east-1",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "OPENSEARCH_ENDPOINT": "localhost",
+    "CONFIG_TTL_SECONDS": "3600",
+    "POWERTOOLS_TRACE_DISABLED": "true",
+    "POWERTOOLS_LOG_LEVEL": "CRITICAL",
+})
+for name in ("EMBEDDING_CACHE_TABLE", "EMBEDDING_CACHE_PATH", "INGESTION_CHECKPOINT_TABLE", "INGESTION_CHECKPOINT_PATH"):
+    os.environ.pop(name, None)
+
+for path in (
+    os.path.join(LAMBDAS_PATH, "common_layer"),
+    os.path.join(LAMBDAS_PATH, "index_data_lambda"),
+    os.path.join(LAMBDAS_PATH, "retrieval_lambda"),
+    os.path.join(LAMBDAS_PATH, "response_lambda"),
+    os.path.join(LAMBDAS_PATH, "classification_lambda"),
+    os.path.join(CONTENT_PATH, "benchmarks"),
+):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from rag_common.metrics import set_sink  # noqa: E402
+
+# The metrics of the functions are only collected by the benchmarks
+set_sink(lambda line: None)
+
+BUCKET_NAME = "tests-data-bucket"
+
+_stand_ins = None
+_stand_ins_lock = threading.Lock()
+
+
+class StandIns:
+    def __init__(self, ssm, s3, bedrock_runtime, opensearch):
+        self.ssm = ssm
+        self.s3 = s3
+        self.bedrock_runtime = bedrock_runtime
+        self.opensearch = opensearch
+
+
+def install_stand_ins():
+    """Route the clients of the functions to the stand-ins, once per test run, and return them.
+
+    The parameters are the ones of the benchmarks, and the bucket starts empty.
+    """
+    global _stand_ins
+    with _stand_ins_lock:
+        if _stand_ins is None:
+            import stand_ins
+            from run_benchmarks import load_parameters
+
+            parameters = load_parameters({})
+            _stand_ins = StandIns(
+                ssm=stand_ins.LocalSSM({f"/opa/gen-ai/{os.environ['APP_NAME']}/{name}": value for name, value in parameters.items()}),
+                s3=stand_ins.LocalS3({}),
+                bedrock_runtime=stand_ins.LocalBedrockRuntime(),
+                opensearch=stand_ins.LocalOpenSearch(),
+            )
+            stand_ins.install(_stand_ins.ssm, _stand_ins.s3, _stand_ins.bedrock_runtime, _stand_ins.opensearch)
+    return _stand_ins
+
+
+def s3_event(event_name, key):
+    """Return the S3 notification of `event_name` on `key` of the data bucket."""
+    return {"Records": [{
+        "eventVersion": "2.1",
+        "eventSource": "aws:s3",
+        "eventName": event_name,
+        "s3": {"bucket": {"name": BUCKET_NAME}, "object": {"key": key}},
+    }]}
@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+from answer_cache import AnswerCache
+from stand_ins import hashed_embedding
+
+DIMENSION = 256
+QUESTION = "How many days of paid vacation do employees get per year?"
+INDICES = ("hr", "policies")
+
+
+def _embedding(text):
+    return hashed_embedding(text, DIMENSION)
+
+
+class AnswerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.versions = {"hr": 1, "policies": 4}
+
+    def _index_versions(self, indices):
+        return tuple(self.versions.get(index_name) for index_name in indices)
+
+    def _store(self, cache, question=QUESTION, answer="25 days", settings_digest="settings"):
+        cache.store(_embedding(question), answer, INDICES, settings_digest, self._index_versions(INDICES))
+
+    def _lookup(self, cache, question=QUESTION, settings_digest="settings"):
+        return cache.lookup(_embedding(question), settings_digest, self._index_versions)
+
+    def test_similar_questions_get_the_cached_answer(self):
+        cache = AnswerCache(threshold=0.8)
+        self._store(cache)
+
+        entry = self._lookup(cache, "How many days of paid vacation do employees get each year?")
+
+        self.assertEqual(entry["answer"], "25 days")
+        self.assertGreaterEqual(entry["similarity"], 0.8)
+        self.assertIsNone(self._lookup(cache, "Who approves the travel expenses?"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_the_most_similar_question_is_answered(self):
+        cache = AnswerCache(threshold=0.5)
+        self._store(cache, "How many days of paid vacation do employees get?", "vacation")
+        self._store(cache, "How many days of sick leave do employees get?", "sick leave")
+
+        self.assertEqual(self._lookup(cache, "How many days of sick leave do employees get per year?")["answer"], "sick leave")
+
+    def test_answers_expire_with_the_settings(self):
+        cache = AnswerCache()
+        self._store(cache)
+
+        self.assertIsNone(self._lookup(cache, settings_digest="new settings"))
+        self.assertIsNotNone(self._lookup(cache))
+
+    def test_answers_expire_with_the_indices(self):
+        cache = AnswerCache()
+        self._store(cache)
+
+        self.versions["policies"] += 1
+
+        self.assertIsNone(self._lookup(cache))
+        self.versions["policies"] -= 1
+        # The entry was dropped when the index changed
+        self.assertIsNone(self._lookup(cache))
+
+    def test_answers_expire_after_their_ttl(self):
+        cache = AnswerCache(ttl_seconds=60)
+        with mock.patch("answer_cache.time.monotonic", return_value=1000.0):
+            self._store(cache)
+        with mock.patch("answer_cache.time.monotonic", return_value=1059.0):
+            self.assertIsNotNone(self._lookup(cache))
+        with mock.patch("answer_cache.time.monotonic", return_value=1060.0):
+            self.assertIsNone(self._lookup(cache))
+
+    def test_the_least_recently_used_answer_is_evicted(self):
+        cache = AnswerCache(max_entries=2)
+        questions = ["Where is the office?", "When is the payday?", "Who is the manager?"]
+        self._store(cache, questions[0], "first")
+        self._store(cache, questions[1], "second")
+        self._lookup(cache, questions[0])
+
+        self._store(cache, questions[2], "third")
+
+        self.assertEqual([self._lookup(cache, question) is not None for question in questions], [True, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
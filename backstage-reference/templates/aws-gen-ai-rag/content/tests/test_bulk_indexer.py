@@ -0,0 +1,118 @@
+import json
+import unittest
+from unittest import mock
+from rag_common.bulk_indexer import bulk_delete, bulk_index
+from rag_common.opensearch import AuthorizationError, TransportError
+from stand_ins import LocalOpenSearch
+
+
+class FlakyOpenSearch(LocalOpenSearch):
+    """Local OpenSearch whose bulk requests reject items with the statuses of `rejections`.
+
+    Every request takes the next list of statuses, one per operation, where None lets
+    the operation through, or the next exception, which fails the whole request.
+    """
+
+    def __init__(self, rejections):
+        super().__init__()
+        self.rejections = list(rejections)
+        self.requests = []
+
+    def bulk(self, body):
+        operations = _operations(body)
+        self.requests.append(len(operations))
+        statuses = self.rejections.pop(0) if self.rejections else [None] * len(operations)
+        if isinstance(statuses, Exception):
+            raise statuses
+        accepted = [operation for operation, status in zip(operations, statuses) if status is None]
+        items = iter(super().bulk("".join(accepted))["items"] if accepted else [])
+        return {"errors": True, "items": [
+            next(items) if status is None else {"index": {"status": status, "error": {"type": "rejected"}}}
+            for status in statuses
+        ]}
+
+
+def _operations(body):
+    lines = body.splitlines(keepends=True)
+    operations = []
+    while lines:
+        line = lines.pop(0)
+        if "delete" not in json.loads(line):
+            line += lines.pop(0)
+        operations.append(line)
+    return operations
+
+
+def _documents(count):
+    return [{"text": f"chunk {number}"} for number in range(count)]
+
+
+@mock.patch("rag_common.bulk_indexer.time.sleep")
+class BulkIndexTest(unittest.TestCase):
+    def test_only_rejected_items_are_sent_again(self, sleep):
+        opensearch = FlakyOpenSearch([[None, 429, None, 503]])
+
+        result = bulk_index(opensearch, "chunks", _documents(4), 10, 1_000_000, 3)
+
+        self.assertEqual(result, {"indexed": 4, "failed": 0})
+        self.assertEqual(opensearch.requests, [4, 2])
+        self.assertEqual(len(opensearch.local_indices["chunks"].documents), 4)
+        sleep.assert_called_once()
+
+    def test_failed_requests_are_sent_again(self, sleep):
+        opensearch = FlakyOpenSearch([ConnectionError("Connection reset by peer"), TransportError(503, "unavailable")])
+
+        result = bulk_index(opensearch, "chunks", _documents(3), 10, 1_000_000, 3)
+
+        self.assertEqual(result, {"indexed": 3, "failed": 0})
+        self.assertEqual(opensearch.requests, [3, 3, 3])
+
+    def test_rejected_requests_are_raised(self, sleep):
+        opensearch = FlakyOpenSearch([AuthorizationError(403, "security_exception")])
+
+        with self.assertRaises(AuthorizationError):
+            bulk_index(opensearch, "chunks", _documents(3), 10, 1_000_000, 3)
+
+        self.assertEqual(opensearch.requests, [3])
+        sleep.assert_not_called()
+
+    def test_items_fail_after_the_last_retry(self, sleep):
+        opensearch = FlakyOpenSearch([[None, 429]] + [[429]] * 3)
+
+        result = bulk_index(opensearch, "chunks", _documents(2), 10, 1_000_000, 3)
+
+        self.assertEqual(result, {"indexed": 1, "failed": 1})
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_rejected_items_are_not_sent_again(self, sleep):
+        opensearch = FlakyOpenSearch([[400, None]])
+
+        result = bulk_index(opensearch, "chunks", _documents(2), 10, 1_000_000, 3)
+
+        self.assertEqual(result, {"indexed": 1, "failed": 1})
+        self.assertEqual(opensearch.requests, [2])
+        sleep.assert_not_called()
+
+    def test_batches_are_limited_in_count_and_bytes(self, sleep):
+        by_count = FlakyOpenSearch([])
+        bulk_index(by_count, "chunks", _documents(25), 10, 1_000_000, 3)
+        by_bytes = FlakyOpenSearch([])
+        operation_bytes = len(f'{json.dumps({"index": {"_index": "chunks"}})}\n{json.dumps(_documents(1)[0])}\n')
+        bulk_index(by_bytes, "chunks", _documents(4), 10, 2 * operation_bytes + 1, 3)
+
+        self.assertEqual(by_count.requests, [10, 10, 5])
+        self.assertEqual(by_bytes.requests, [2, 2])
+
+    def test_documents_already_deleted_are_counted_apart(self, sleep):
+        opensearch = FlakyOpenSearch([])
+        bulk_index(opensearch, "chunks", _documents(2), 10, 1_000_000, 3)
+        document_ids = list(opensearch.local_indices["chunks"].documents)
+
+        result = bulk_delete(opensearch, "chunks", [*document_ids, "missing"], 10, 1_000_000, 3)
+
+        self.assertEqual(result, {"deleted": 2, "failed": 0, "not_found": 1})
+        self.assertEqual(opensearch.local_indices["chunks"].documents, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
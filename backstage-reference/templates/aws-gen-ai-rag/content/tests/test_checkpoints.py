@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from checkpoints import (
+    MAX_CHECKPOINT_BYTES,
+    SEEN_ID_BYTES,
+    Checkpoint,
+    CheckpointStore,
+    MemoryCheckpoints,
+    SQLiteCheckpoints,
+    seen_id,
+)
+
+
+def _chunk_id(number):
+    return hashlib.md5(f"chunk {number}".encode()).hexdigest()
+
+
+def _checkpoint(chunks=3):
+    return Checkpoint(
+        "bucket",
+        "docs/report.txt",
+        '"etag"',
+        offset=8192,
+        splitter_state={"levels": [{"position": 0, "pending": "", "current": ["last"], "total": 4}]},
+        seen={seen_id(_chunk_id(number)) for number in range(chunks)},
+        new_chunks=2,
+        indexed=2,
+        embedding_seconds=0.5,
+        invocations=2,
+    )
+
+
+class CheckpointTest(unittest.TestCase):
+    def test_dumps_and_loads(self):
+        checkpoint = _checkpoint()
+
+        self.assertEqual(Checkpoint.loads(checkpoint.dumps()), checkpoint)
+
+    def test_seen_ids_are_prefixes_of_chunk_ids(self):
+        self.assertEqual(seen_id(_chunk_id(1)).hex(), _chunk_id(1)[:SEEN_ID_BYTES * 2])
+        self.assertIsNone(seen_id(None))
+
+
+class CheckpointStoreTest(unittest.TestCase):
+    def _stores(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return {
+            "memory": CheckpointStore(MemoryCheckpoints()),
+            "sqlite": CheckpointStore(SQLiteCheckpoints(os.path.join(directory.name, "checkpoints.db"))),
+        }
+
+    def test_save_load_and_clear(self):
+        for name, store in self._stores().items():
+            with self.subTest(backend=name):
+                checkpoint = _checkpoint()
+
+                self.assertTrue(store.save(checkpoint))
+                self.assertEqual(store.load("bucket", "docs/report.txt", '"etag"'), checkpoint)
+                self.assertIsNone(store.load("bucket", "docs/report.txt", '"new etag"'))
+                store.clear(checkpoint)
+                self.assertIsNone(store.load("bucket", "docs/report.txt", '"etag"'))
+
+    def test_checkpoints_of_an_older_format_are_ignored(self):
+        store = CheckpointStore(MemoryCheckpoints())
+        checkpoint = _checkpoint()
+        state = json.loads(checkpoint.dumps())
+        del state["splitter_state"]
+        state["carry"] = "text of the previous range"
+        store.backend.put(checkpoint.checkpoint_key, json.dumps(state))
+
+        self.assertIsNone(store.load("bucket", "docs/report.txt", '"etag"'))
+
+    def test_checkpoints_too_large_are_not_saved(self):
+        store = CheckpointStore(MemoryCheckpoints())
+        # Base64 takes 4 characters for every 3 bytes
+        checkpoint = _checkpoint(MAX_CHECKPOINT_BYTES * 3 // 4 // SEEN_ID_BYTES + 1)
+
+        self.assertFalse(store.save(checkpoint))
+        self.assertIsNone(store.load("bucket", "docs/report.txt", '"etag"'))
+
+    def test_failures_of_the_backend_are_not_raised(self):
+        class BrokenCheckpoints(MemoryCheckpoints):
+            def get(self, *args):
+                raise ConnectionError("unreachable")
+
+            put = delete = get
+
+        store = CheckpointStore(BrokenCheckpoints())
+
+        self.assertFalse(store.save(_checkpoint()))
+        self.assertIsNone(store.load("bucket", "docs/report.txt", '"etag"'))
+        store.clear(_checkpoint())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from rag_common.context_packer import (
+    CHARS_PER_TOKEN,
+    CONTEXT_RESERVE_TOKENS,
+    MIN_DOCUMENT_TOKENS,
+    context_token_budget,
+    estimate_tokens,
+    pack_documents,
+)
+from rag_common.stages import Document
+
+
+def _document(text, score):
+    return Document(text, {"url": f"s3://bucket/{score}.txt"}, score)
+
+
+def _sentences(count, prefix="Sentence"):
+    return " ".join(f"{prefix} number {number} of the document." for number in range(count))
+
+
+class ContextTokenBudgetTest(unittest.TestCase):
+    def test_budget_is_what_the_prompt_and_answer_leave(self):
+        prompt = "x" * 350
+
+        self.assertEqual(estimate_tokens(prompt), 100)
+        self.assertEqual(context_token_budget("anthropic.claude-v2", 1000, prompt), 100000 - 1000 - 100 - CONTEXT_RESERVE_TOKENS)
+        self.assertEqual(context_token_budget("anthropic.claude-v2:1", 1000, prompt), 200000 - 1000 - 100 - CONTEXT_RESERVE_TOKENS)
+
+    def test_budget_is_capped(self):
+        self.assertEqual(context_token_budget("anthropic.claude-v2", 1000, "", max_context_tokens=4000), 4000)
+        self.assertEqual(context_token_budget("anthropic.claude-v2", 200000, ""), 0)
+
+
+class PackDocumentsTest(unittest.TestCase):
+    def test_documents_are_packed_by_score(self):
+        documents = [_document("low", 0.1), _document("high", 0.9), _document("unscored", None)]
+
+        packed, stats = pack_documents(documents, 1000)
+
+        self.assertEqual([document.page_content for document in packed], ["high", "low", "unscored"])
+        self.assertEqual(stats["packed"], 3)
+
+    def test_duplicates_are_dropped(self):
+        text = _sentences(3)
+        documents = [_document(text, 0.9), _document(f" {text}\n", 0.8), _document(text[10:40], 0.7)]
+
+        packed, stats = pack_documents(documents, 1000)
+
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(stats["duplicates"], 2)
+
+    def test_overlaps_of_the_text_splitter_are_removed(self):
+        text = _sentences(10)
+        first, second = _document(text[:300], 0.9), _document(text[200:], 0.8)
+
+        packed, stats = pack_documents([first, second], 1000, max_overlap=100)
+
+        self.assertEqual(packed[1].page_content, text[300:].strip())
+        self.assertEqual(stats["overlap_chars"], 100)
+        _, without_overlap = pack_documents([first, second], 1000)
+        self.assertEqual(without_overlap["overlap_chars"], 0)
+
+    def test_the_last_document_is_truncated_at_a_sentence(self):
+        documents = [_document(_sentences(20, "First"), 0.9), _document(_sentences(20, "Second"), 0.8)]
+        budget = estimate_tokens(documents[0].page_content) + 2 * MIN_DOCUMENT_TOKENS
+
+        packed, stats = pack_documents(documents, budget)
+
+        self.assertEqual(stats["truncated"], 1)
+        self.assertTrue(packed[1].page_content.endswith("of the document."))
+        self.assertLessEqual(len(packed[1].page_content), 2 * MIN_DOCUMENT_TOKENS * CHARS_PER_TOKEN)
+        self.assertLessEqual(stats["tokens"], budget)
+
+    def test_documents_too_short_once_truncated_are_dropped(self):
+        documents = [_document(_sentences(20, "First"), 0.9), _document(_sentences(20, "Second"), 0.8)]
+
+        packed, stats = pack_documents(documents, estimate_tokens(documents[0].page_content) + MIN_DOCUMENT_TOKENS // 2)
+
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(stats["dropped"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from boto3.dynamodb.types import Binary
+from rag_common.embedding_cache import BATCH_GET_MAX_ATTEMPTS, DynamoDBBackend, get_embedding_cache
+
+TABLE_NAME = "embeddings"
+
+
+def _response(found, unprocessed):
+    return {
+        "Responses": {TABLE_NAME: [{"cache_key": key, "vector": Binary(key.encode())} for key in found]},
+        "UnprocessedKeys": {TABLE_NAME: {"Keys": [{"cache_key": key} for key in unprocessed]}} if unprocessed else {},
+    }
+
+
+@mock.patch("rag_common.embedding_cache.time.sleep")
+class DynamoDBBackendTest(unittest.TestCase):
+    def _backend(self, *responses):
+        with mock.patch("rag_common.embedding_cache.boto3.resource"):
+            backend = DynamoDBBackend(TABLE_NAME)
+        backend._dynamodb.batch_get_item.side_effect = responses
+        return backend
+
+    def test_unprocessed_keys_are_read_again_after_a_backoff(self, sleep):
+        backend = self._backend(_response(["a"], ["b", "c"]), _response(["b"], ["c"]), _response(["c"], []))
+
+        found = backend.get_many(["a", "b", "c"])
+
+        self.assertEqual(found, {"a": b"a", "b": b"b", "c": b"c"})
+        first, second = [call.args[0] for call in sleep.call_args_list]
+        self.assertLess(first, second)
+        retried = backend._dynamodb.batch_get_item.call_args.kwargs["RequestItems"][TABLE_NAME]["Keys"]
+        self.assertEqual(retried, [{"cache_key": "c"}])
+
+    def test_keys_left_unprocessed_are_misses(self, sleep):
+        backend = self._backend(*[_response([], ["a"])] * BATCH_GET_MAX_ATTEMPTS)
+
+        self.assertEqual(backend.get_many(["a"]), {})
+        self.assertEqual(backend._dynamodb.batch_get_item.call_count, BATCH_GET_MAX_ATTEMPTS)
+        self.assertEqual(sleep.call_count, BATCH_GET_MAX_ATTEMPTS - 1)
+
+
+class GetEmbeddingCacheTest(unittest.TestCase):
+    def test_threads_share_one_cache_per_model(self):
+        threads = 8
+        barrier = threading.Barrier(threads)
+
+        def get_cache(_):
+            barrier.wait()
+            return get_embedding_cache("tests.concurrent-model")
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            caches = list(executor.map(get_cache, range(threads)))
+
+        self.assertEqual(len({id(cache) for cache in caches}), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
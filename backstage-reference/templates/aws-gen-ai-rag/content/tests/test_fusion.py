@@ -0,0 +1,87 @@
+import importlib
+import unittest
+from unittest import mock
+from run_benchmarks import LambdaContext
+from tests import install_stand_ins, s3_event
+
+
+def _documents(index_name, scores):
+    from rag_common.stages import Document
+
+    return [Document(f"{index_name} {rank}", {"index": index_name}, score) for rank, score in enumerate(scores)]
+
+
+class FuseTest(unittest.TestCase):
+    def test_scores_are_normalized_within_every_index(self):
+        from rag_common.fusion import SCORE, fuse
+
+        # Scores of an l2 index and of a cosinesimil index, on very different scales
+        fused = fuse({"l2": _documents("l2", [0.02, 0.015, 0.01]), "cosine": _documents("cosine", [0.9, 0.85, 0.8])}, SCORE)
+
+        self.assertEqual({document.page_content for document in fused[:2]}, {"l2 0", "cosine 0"})
+        self.assertEqual([document.score for document in fused[:2]], [1.0, 1.0])
+        self.assertEqual([document.score for document in fused[-2:]], [0.0, 0.0])
+
+    def test_documents_keep_their_best_score(self):
+        from rag_common.fusion import SCORE, fuse
+
+        shared = _documents("shared", [0.5])[0]
+        fused = fuse({"first": [*_documents("first", [0.9]), shared], "second": [shared, *_documents("second", [0.1])]}, SCORE)
+
+        self.assertEqual({document.page_content: document.score for document in fused}["shared 0"], 1.0)
+
+    def test_a_single_score_is_the_best(self):
+        from rag_common.fusion import SCORE, fuse
+
+        fused = fuse({"flat": _documents("flat", [0.3, 0.3]), "other": _documents("other", [0.9, 0.1])}, SCORE)
+
+        self.assertEqual({document.page_content: document.score for document in fused}["flat 1"], 1.0)
+
+    def test_reciprocal_rank_fusion_favors_documents_found_twice(self):
+        from rag_common.fusion import RRF, fuse
+
+        shared = _documents("shared", [0.1])[0]
+        fused = fuse({"first": [*_documents("first", [0.9]), shared], "second": [*_documents("second", [0.8]), shared]}, RRF, k=2)
+
+        self.assertEqual(fused[0].page_content, "shared 0")
+        self.assertEqual(len(fused), 2)
+
+    def test_unknown_method(self):
+        from rag_common.fusion import fuse
+
+        with self.assertRaises(ValueError):
+            fuse({}, "sum")
+
+
+class RetrievalAcrossProfilesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        stand_ins = install_stand_ins()
+        index_lambda = importlib.import_module("index_data_lambda")
+        lines = ["apples and pears grow in {0}", "the harbour of {0} opens at dawn", "orchards need water in {0}"]
+        for key, profile in (("fusionl2/fruits.txt", "high_recall"), ("fusioncosine/fruits.txt", "compact_byte")):
+            stand_ins.s3.objects[key] = "\n\n".join(lines).format(profile).encode()
+            with mock.patch.dict(index_lambda.config._values, {"index_profile": profile, "chunk_size": "60", "chunk_overlap": "0"}):
+                index_lambda.lambda_handler(s3_event("ObjectCreated:Put", key), LambdaContext("IndexLambda"))
+
+    def _retrieve(self, fusion_method):
+        from rag_common.config import get_app_config
+        from rag_common.stages import RetrievalRequest, retrieve_documents
+
+        parameters = {"fanout_indices": "2", "fusion_method": fusion_method, "relevant_documents_count": "6"}
+        with mock.patch.dict(get_app_config()._values, parameters):
+            return retrieve_documents(RetrievalRequest("apples and pears", "fusionl2", ["fusionl2", "fusioncosine"])).documents
+
+    def test_indices_of_different_profiles_are_both_retrieved(self):
+        from rag_common.stages import get_index_profile_of
+
+        self.assertNotEqual(get_index_profile_of("fusionl2").space_type, get_index_profile_of("fusioncosine").space_type)
+        for fusion_method in ("score", "rrf"):
+            with self.subTest(fusion_method=fusion_method):
+                documents = self._retrieve(fusion_method)
+                self.assertEqual({document.metadata["index"] for document in documents[:2]}, {"fusionl2", "fusioncosine"})
+                self.assertTrue(all(document.page_content.startswith("apples") for document in documents[:2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
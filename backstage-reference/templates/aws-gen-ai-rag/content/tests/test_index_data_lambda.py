@@ -0,0 +1,128 @@
+import importlib
+import unittest
+from unittest import mock
+from run_benchmarks import LambdaContext
+from tests import BUCKET_NAME, install_stand_ins, s3_event
+
+# More chunks than the deepest page of a from/size search
+LARGE_DOCUMENT_LINES = 12000
+
+
+class IndexDataLambdaTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_ins = install_stand_ins()
+        cls.index_lambda = importlib.import_module("index_data_lambda")
+
+    def setUp(self):
+        # One chunk per line
+        self.small_chunks = mock.patch.dict(self.index_lambda.config._values, {"chunk_size": "20", "chunk_overlap": "0"})
+        self.small_chunks.start()
+        self.addCleanup(self.small_chunks.stop)
+
+    def _handle(self, event_name, key):
+        return self.index_lambda.lambda_handler(s3_event(event_name, key), LambdaContext("IndexLambda"))
+
+    def _put(self, key, lines):
+        self.stand_ins.s3.objects[key] = "\n".join(lines).encode()
+
+    def _store_chunks(self, index_name, url, texts):
+        """Write chunks to the index directly, without embedding them."""
+        self.index_lambda.ensure_index(index_name)
+        self.index_lambda.vector_store.index_chunks(
+            index_name,
+            ({"text": text, "url": url, "chunk_id": self.index_lambda._get_chunk_id(url, text)} for text in texts),
+            batch_size=5000,
+            batch_bytes=1 << 30,
+            max_retries=0,
+        )
+
+    def _embedding_calls(self):
+        return self.stand_ins.bedrock_runtime.calls["invoke_model"]
+
+    def test_unchanged_large_document_is_not_embedded_again(self):
+        key = "large/unchanged.txt"
+        url = f"s3://{BUCKET_NAME}/{key}"
+        lines = [f"line {number:05d}" for number in range(LARGE_DOCUMENT_LINES)]
+        self._put(key, lines)
+        self._store_chunks("large", url, lines + [f"stale {number}" for number in range(30)])
+        calls = self._embedding_calls()
+
+        [result] = self._handle("ObjectCreated:Put", key)
+
+        self.assertEqual(self._embedding_calls(), calls)
+        self.assertEqual(result["unchanged"], LARGE_DOCUMENT_LINES)
+        self.assertEqual(result["deleted"], 30)
+        self.assertEqual(len(self.index_lambda._get_indexed_chunks("large", url)), LARGE_DOCUMENT_LINES)
+
+    def test_removed_large_document_is_deleted_entirely(self):
+        key = "large/removed.txt"
+        url = f"s3://{BUCKET_NAME}/{key}"
+        self._store_chunks("large", url, [f"line {number:05d}" for number in range(LARGE_DOCUMENT_LINES)])
+        self._store_chunks("large", f"s3://{BUCKET_NAME}/large/other.txt", ["other document"])
+
+        [result] = self._handle("ObjectRemoved:Delete", key)
+
+        self.assertEqual(result["count"], LARGE_DOCUMENT_LINES)
+        self.assertEqual(result["failed"], 0)
+        self.assertEqual(self.index_lambda._get_indexed_chunks("large", url), {})
+        self.assertEqual(len(self.index_lambda._get_indexed_chunks("large", f"s3://{BUCKET_NAME}/large/other.txt")), 1)
+
+    def test_changed_document_only_embeds_new_chunks(self):
+        key = "changes/document.txt"
+        self._put(key, ["first line", "second line", "third line"])
+        [first] = self._handle("ObjectCreated:Put", key)
+        self.assertEqual(first["indexed"], 3)
+
+        self._put(key, ["first line", "third line", "fourth line"])
+        calls = self._embedding_calls()
+        [second] = self._handle("ObjectCreated:Put", key)
+
+        self.assertEqual(self._embedding_calls() - calls, 1)
+        self.assertEqual((second["indexed"], second["unchanged"], second["deleted"]), (1, 2, 1))
+
+    def test_embedding_engine_is_replaced_when_its_settings_change(self):
+        profile = self.index_lambda.ensure_index("engines")
+        engine = self.index_lambda.get_embedding_engine(profile)
+        self.assertIs(self.index_lambda.get_embedding_engine(profile), engine)
+
+        with mock.patch.dict(self.index_lambda.config._values, {"embedding_concurrency": "2"}):
+            replacement = self.index_lambda.get_embedding_engine(profile)
+
+        self.assertIsNot(replacement, engine)
+        self.assertEqual(replacement.max_workers, 2)
+        with self.assertRaises(RuntimeError):
+            engine._executor.submit(print)
+
+    def test_transient_errors_leave_the_records_unprocessed(self):
+        from rag_common.opensearch import TransportError
+
+        key = "transient/document.txt"
+        self._put(key, ["some line"])
+        error = TransportError(503, "service_unavailable_exception")
+        with mock.patch.object(self.index_lambda.vector_store, "iter_document_chunks", side_effect=error), \
+                mock.patch.object(self.index_lambda, "continue_in_new_invocation") as continue_in_new_invocation:
+            self._handle("ObjectCreated:Put", key)
+
+        [records, continuation, _] = continue_in_new_invocation.call_args.args
+        self.assertEqual([record.s3.get_object.key for record in records], [key])
+        self.assertEqual(continuation, 1)
+
+    def test_records_deferred_while_bedrock_is_unavailable_fail_the_invocation(self):
+        from record_executor import RecordsNotProcessedError
+        from rag_common.rate_limiter import BedrockUnavailableError
+
+        key = "unavailable/document.txt"
+        self._put(key, ["some line"])
+        error = BedrockUnavailableError("amazon.titan-embed-text-v1", "circuit open", 30)
+        with mock.patch("embedding_engine.EmbeddingEngine.embed", side_effect=error), \
+                mock.patch.object(self.index_lambda, "continue_in_new_invocation") as continue_in_new_invocation:
+            with self.assertRaises(RecordsNotProcessedError) as raised:
+                self._handle("ObjectCreated:Put", key)
+
+        self.assertEqual([record["key"] for record in raised.exception.records], [key])
+        continue_in_new_invocation.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from botocore.credentials import Credentials
+from botocore.exceptions import HTTPClientError
+from rag_common.opensearch import RETRY_MAX_DELAY, NotFoundError, OpenSearchClient
+
+
+def _response(status_code, content=b"{}"):
+    return SimpleNamespace(status_code=status_code, content=content)
+
+
+@mock.patch("rag_common.opensearch.time.sleep")
+class PerformRequestTest(unittest.TestCase):
+    def _client(self, *responses):
+        client = OpenSearchClient("localhost", "us-east-1", Credentials("key", "secret"), max_retries=3)
+        client._http = mock.Mock()
+        client._http.send.side_effect = responses
+        return client
+
+    def test_unavailable_cluster_is_retried_with_backoff(self, sleep):
+        client = self._client(_response(503), HTTPClientError(error="reset"), _response(200, b'{"took": 1}'))
+
+        self.assertEqual(client.search("chunks", {}), {"took": 1})
+        self.assertEqual(client._http.send.call_count, 3)
+        first, second = [call.args[0] for call in sleep.call_args_list]
+        self.assertLess(first, second)
+        self.assertGreater(first, 0)
+
+    def test_retries_stop_after_max_retries(self, sleep):
+        client = self._client(*[HTTPClientError(error="reset")] * 4)
+
+        with self.assertRaises(HTTPClientError):
+            client.search("chunks", {})
+
+        self.assertEqual(sleep.call_count, 3)
+        self.assertTrue(all(call.args[0] <= RETRY_MAX_DELAY for call in sleep.call_args_list))
+
+    def test_errors_of_the_request_are_not_retried(self, sleep):
+        client = self._client(_response(404, b'{"error": {"type": "index_not_found_exception"}}'))
+
+        with self.assertRaises(NotFoundError) as raised:
+            client.search("chunks", {})
+
+        self.assertEqual(raised.exception.error, "index_not_found_exception")
+        sleep.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
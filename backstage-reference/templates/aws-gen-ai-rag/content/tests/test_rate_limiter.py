@@ -0,0 +1,170 @@
+import json
+import time
+import unittest
+from dataclasses import replace
+from unittest import mock
+from botocore.exceptions import ClientError
+from rag_common.rate_limiter import (
+    DEFAULT_POLICIES,
+    INGESTION,
+    INTERACTIVE,
+    MIN_RATE,
+    AdaptiveTokenBucket,
+    BedrockUnavailableError,
+    CircuitBreaker,
+    MemoryThrottleSignals,
+    RateLimiter,
+    ThrottleSignal,
+    too_many_requests,
+)
+from stand_ins import LocalBedrockRuntime
+
+MODEL_ID = "amazon.titan-embed-text-v1"
+
+# Sleeps are skipped, so the buckets never refill while the tests wait for them
+POLICIES = {budget: replace(policy, max_wait=3600) for budget, policy in DEFAULT_POLICIES.items()}
+
+
+def _error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "InvokeModel")
+
+
+class _Bedrock(LocalBedrockRuntime):
+    """Local Bedrock failing its first calls with the error codes of `failures`."""
+
+    def __init__(self, *failures):
+        super().__init__()
+        self.failures = list(failures)
+
+    def invoke_model(self, **kwargs):
+        if self.failures:
+            self._count("invoke_model")
+            raise _error(self.failures.pop(0))
+        return super().invoke_model(**kwargs)
+
+    def embed(self, limiter, budget=INTERACTIVE):
+        request = {"modelId": MODEL_ID, "body": json.dumps({"inputText": "question"})}
+        return limiter.call(MODEL_ID, lambda: self.invoke_model(**request), budget)
+
+
+@mock.patch("rag_common.rate_limiter.time.sleep")
+class RateLimiterTest(unittest.TestCase):
+    def test_throttled_calls_are_retried(self, sleep):
+        limiter = RateLimiter(POLICIES)
+        bedrock = _Bedrock("ThrottlingException", "ThrottlingException")
+
+        bedrock.embed(limiter)
+
+        stats = limiter.stats()[MODEL_ID][INTERACTIVE]
+        self.assertEqual(bedrock.calls["invoke_model"], 3)
+        self.assertEqual((stats["requests"], stats["throttles"], stats["retries"]), (3, 2, 2))
+        self.assertEqual(stats["circuit"], "closed")
+
+    def test_calls_still_throttled_after_their_retries_are_unavailable(self, sleep):
+        limiter = RateLimiter(POLICIES)
+        bedrock = _Bedrock(*["ThrottlingException"] * 10)
+
+        with self.assertRaises(BedrockUnavailableError) as raised:
+            bedrock.embed(limiter)
+
+        self.assertEqual(bedrock.calls["invoke_model"], DEFAULT_POLICIES[INTERACTIVE].max_retries + 1)
+        response = too_many_requests(raised.exception)
+        self.assertEqual(response["statusCode"], 429)
+        self.assertEqual(response["headers"]["Retry-After"], "2")
+
+    def test_failures_of_the_ingestion_do_not_reject_questions(self, sleep):
+        limiter = RateLimiter(POLICIES, circuit_failures=2)
+        bedrock = _Bedrock("InternalServerException", "InternalServerException")
+
+        for _ in range(2):
+            with self.assertRaises(ClientError):
+                bedrock.embed(limiter, INGESTION)
+        with self.assertRaises(BedrockUnavailableError):
+            bedrock.embed(limiter, INGESTION)
+        bedrock.embed(limiter, INTERACTIVE)
+
+        stats = limiter.stats()[MODEL_ID]
+        self.assertEqual(bedrock.calls["invoke_model"], 3)
+        self.assertEqual((stats[INGESTION]["circuit"], stats[INGESTION]["rejections"]), ("open", 1))
+        self.assertEqual(stats[INTERACTIVE]["circuit"], "closed")
+
+    def test_errors_of_the_requests_do_not_open_the_circuit(self, sleep):
+        limiter = RateLimiter(POLICIES, circuit_failures=2)
+        bedrock = _Bedrock(*["ValidationException"] * 3)
+
+        for _ in range(3):
+            with self.assertRaises(ClientError):
+                bedrock.embed(limiter)
+
+        self.assertEqual(limiter.stats()[MODEL_ID][INTERACTIVE]["circuit"], "closed")
+
+    def test_throttled_questions_slow_down_the_ingestion_of_other_containers(self, sleep):
+        signals = MemoryThrottleSignals()
+        question_limiter = RateLimiter(POLICIES, signal=ThrottleSignal(signals, interval=0))
+        ingestion_limiter = RateLimiter(POLICIES, signal=ThrottleSignal(signals, interval=0))
+        bedrock = _Bedrock()
+        for _ in range(4):
+            bedrock.embed(ingestion_limiter, INGESTION)
+        self.assertIsNone(ingestion_limiter.stats()[MODEL_ID][INGESTION]["rate"])
+
+        bedrock.failures.append("ThrottlingException")
+        bedrock.embed(question_limiter)
+        self.assertIsNotNone(signals.get(MODEL_ID))
+        # Published by a question throttled after the ingestion container started
+        signals.put(MODEL_ID, int(time.time() * 1000) + 1000)
+        bedrock.embed(ingestion_limiter, INGESTION)
+
+        # Lowered from the rate of the 4 calls that succeeded, then raised by the one that followed
+        policy = DEFAULT_POLICIES[INGESTION]
+        rate = 4 * policy.decrease_factor
+        self.assertEqual(ingestion_limiter.stats()[MODEL_ID][INGESTION]["rate"], rate + policy.increase_per_second / rate)
+
+
+class AdaptiveTokenBucketTest(unittest.TestCase):
+    def test_rate_is_lowered_once_per_second(self):
+        bucket = AdaptiveTokenBucket(max_rate=10, decrease_factor=0.5)
+        for _ in range(6):
+            bucket.on_success()
+        self.assertEqual(bucket.rate, 10)
+
+        bucket.on_throttle(time.monotonic())
+        bucket.on_throttle(time.monotonic())
+
+        # Half the rate of the requests that succeeded over the last second
+        self.assertEqual(bucket.rate, 3)
+        self.assertIsNone(bucket.acquire(max_wait=0))
+
+    def test_rate_stays_above_its_minimum(self):
+        bucket = AdaptiveTokenBucket(decrease_factor=0.1)
+
+        bucket.on_throttle(time.monotonic())
+
+        self.assertEqual(bucket.rate, MIN_RATE)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_a_single_trial_call_closes_the_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+
+        self.assertEqual(breaker.allow(), 0)
+        self.assertEqual(breaker.state, "half_open")
+        self.assertEqual(breaker.allow(), 1.0)
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_a_failed_trial_call_opens_the_circuit_again(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+        breaker.opened_at = time.monotonic() - 30
+        breaker.allow()
+
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, "open")
+        self.assertGreater(breaker.allow(), 29)
+
+
+if __name__ == "__main__":
+    unittest.main()
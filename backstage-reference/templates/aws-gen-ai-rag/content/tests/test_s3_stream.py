@@ -0,0 +1,74 @@
+import json
+import os
+import random
+import unittest
+from s3_stream import S3TextReader, split_text_stream
+from stand_ins import LocalS3
+from text_splitter import RecursiveCharacterTextSplitter
+from tests import CONTENT_PATH
+
+
+def _parts(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+def _stream_chunks(parts, text_splitter, state=None):
+    return [chunk for chunks, _ in split_text_stream(iter(parts), text_splitter, state) for chunk in chunks]
+
+
+class SplitTextStreamTest(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(CONTENT_PATH, "sample-files", "amazon", "Amazon 2022 Annual Report.txt"), encoding="utf-8") as document:
+            self.document = document.read()
+
+    def test_chunks_do_not_depend_on_the_ranges(self):
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        expected = text_splitter.split_text(self.document)
+        for size in (100, 999, 8192, len(self.document)):
+            with self.subTest(size=size):
+                self.assertEqual(_stream_chunks(_parts(self.document, size), text_splitter), expected)
+
+    def test_separators_found_late_in_the_text(self):
+        rng = random.Random(7)
+        words = ["word", "a" * 30, " ", "  ", "\n", "\n\n", "\n\n\n"]
+        for trial in range(200):
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=rng.choice([10, 40, 100]), chunk_overlap=rng.randint(0, 10))
+            text = "".join(rng.choices(words, weights=[4, 1, 4, 1, 2, 1, 1], k=rng.randint(0, 300)))
+            if trial % 3 == 0:
+                # Paragraphs only start after a long text split on new lines
+                text = text.replace("\n\n", "\n") + "\n\n" + text
+            with self.subTest(trial=trial):
+                self.assertEqual(_stream_chunks(_parts(text, rng.randint(1, 50)), text_splitter), text_splitter.split_text(text))
+
+    def test_resume_from_the_state_of_a_range(self):
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+        parts = _parts(self.document, 4096)
+        stream = split_text_stream(iter(parts[:3]), text_splitter)
+        chunks = []
+        for _ in range(3):
+            texts, state = next(stream)
+            chunks.extend(texts)
+        # The state is saved as JSON in the checkpoints
+        chunks.extend(_stream_chunks(parts[3:], text_splitter, json.loads(json.dumps(state))))
+        self.assertEqual(chunks, text_splitter.split_text(self.document))
+
+
+class S3TextReaderTest(unittest.TestCase):
+    def test_characters_split_across_ranges(self):
+        text = "Prix: 12 €, délai: 3 jours.\n" * 20
+        s3 = LocalS3({"doc.txt": text.encode("utf-8")})
+        reader = S3TextReader(s3, "bucket", "doc.txt", range_bytes=7)
+        self.assertEqual("".join(reader.ranges()), text)
+
+    def test_resume_from_the_offset(self):
+        text = "Prix: 12 €, délai: 3 jours.\n" * 20
+        content = text.encode("utf-8")
+        reader = S3TextReader(LocalS3({"doc.txt": content}), "bucket", "doc.txt", range_bytes=7)
+        ranges = reader.ranges()
+        read = next(ranges) + next(ranges)
+        self.assertEqual(content[:reader.offset].decode("utf-8"), read)
+        self.assertEqual(read + "".join(reader.ranges(reader.offset)), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from unittest import mock
+from tests import install_stand_ins
+
+
+class GenerateResponseTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_ins = install_stand_ins()
+
+    def test_failed_stream_falls_back_to_its_prompt(self):
+        from rag_common import stages
+        from rag_common.stages import Document, ResponseRequest, generate_response
+
+        request = ResponseRequest("when does the harbour open?", [Document("the harbour opens at dawn")])
+        failure = mock.patch.object(
+            self.stand_ins.bedrock_runtime, "invoke_model_with_response_stream", side_effect=RuntimeError("stream closed")
+        )
+        with failure, mock.patch.object(stages, "_build_response_prompt", wraps=stages._build_response_prompt) as build:
+            result = generate_response(request)
+
+        self.assertEqual(build.call_count, 1)
+        self.assertIn("the harbour opens at dawn", result.answer)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import importlib
+import unittest
+from unittest import mock
+from run_benchmarks import LambdaContext
+from rag_common.vector_store import VECTOR_FIELD, OpenSearchVectorStore
+from stand_ins import LocalOpenSearch, hashed_embedding
+from tests import install_stand_ins, s3_event
+from topic_router import MISSING_CENTROID_RETRY_SECONDS, TopicRouter, index_name_for_topic
+
+DIMENSION = 64
+TOPICS = ["'Finance'", " 'Travel'"]
+CHUNKS = {
+    "finance": ["quarterly revenue and profit", "income tax of the budget", "operating profit margin and revenue"],
+    "travel": ["flight to the beach hotel", "passport for the flight", "hotel booking near the beach"],
+}
+
+
+def _embedding(text):
+    return hashed_embedding(text, DIMENSION)
+
+
+class TopicRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.vector_store = OpenSearchVectorStore(LocalOpenSearch())
+        for index_name, texts in CHUNKS.items():
+            self.vector_store.index_chunks(
+                index_name, [{"text": text, VECTOR_FIELD: _embedding(text)} for text in texts], 100, 1 << 20, 0
+            )
+        self.versions = dict.fromkeys(CHUNKS, 1)
+        self.sampled = mock.patch.object(self.vector_store, "sample_vectors", wraps=self.vector_store.sample_vectors).start()
+        self.add_metric = mock.patch("topic_router.add_metric").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _route(self, router, question, topics=TOPICS):
+        embedding = _embedding(question)
+        return router.route({index_name_for_topic(topic): embedding for topic in topics}, topics, self.versions.get)
+
+    def test_questions_are_routed_to_the_closest_topic(self):
+        decision = self._route(TopicRouter(self.vector_store), "profit and revenue of the year")
+
+        self.assertEqual((decision["index"], decision["reason"]), ("finance", "routed"))
+        self.assertEqual([index_name for index_name, _ in decision["candidates"]], ["finance", "travel"])
+        self.assertGreater(decision["margin"], 0.05)
+        self.add_metric.assert_called_once_with("router_routed", 1)
+
+    def test_unclear_questions_fall_back_to_the_llm(self):
+        low_margin = self._route(TopicRouter(self.vector_store, margin=2), "profit and revenue of the year")
+        low_similarity = self._route(TopicRouter(self.vector_store, min_similarity=0.99), "profit and revenue of the year")
+
+        self.assertEqual((low_margin["index"], low_margin["reason"]), (None, "fallback_low_margin"))
+        self.assertEqual((low_similarity["index"], low_similarity["reason"]), (None, "fallback_low_similarity"))
+        self.assertEqual(len(low_margin["candidates"]), 2)
+
+    def test_topics_without_centroid_fall_back_to_the_llm(self):
+        router = TopicRouter(self.vector_store)
+
+        missing_index = self._route(router, "profit and revenue", [*TOPICS, "'Empty'"])
+        other_dimension = router.route(
+            {"finance": _embedding("profit"), "travel": hashed_embedding("profit", DIMENSION * 2)}, TOPICS, self.versions.get
+        )
+        not_embedded = router.route({"finance": _embedding("profit")}, TOPICS, self.versions.get)
+
+        self.assertEqual(missing_index["reason"], "fallback_missing_centroid")
+        self.assertEqual(other_dimension["reason"], "fallback_missing_centroid")
+        self.assertEqual([index_name for index_name, _ in other_dimension["candidates"]], ["finance"])
+        self.assertEqual(not_embedded["reason"], "fallback_missing_centroid")
+
+    def test_centroids_are_computed_once_per_index_version(self):
+        router = TopicRouter(self.vector_store)
+        self._route(router, "profit")
+        self._route(router, "hotel")
+        self.assertEqual(self.sampled.call_count, 2)
+
+        self.versions["travel"] += 1
+        self._route(router, "hotel")
+
+        self.assertEqual(self.sampled.call_args.args[0], "travel")
+        self.assertEqual(self.sampled.call_count, 3)
+
+    def test_missing_centroids_are_sampled_again_later(self):
+        router = TopicRouter(self.vector_store)
+        topics = [*TOPICS, "'Empty'"]
+        with mock.patch("topic_router.time.monotonic", return_value=1000.0):
+            self._route(router, "profit", topics)
+            self._route(router, "profit", topics)
+        self.assertEqual(self.sampled.call_count, 3)
+
+        with mock.patch("topic_router.time.monotonic", return_value=1000.0 + MISSING_CENTROID_RETRY_SECONDS):
+            self._route(router, "profit", topics)
+
+        self.assertEqual(self.sampled.call_args.args[0], "empty")
+        self.assertEqual(self.sampled.call_count, 4)
+
+    def test_fallbacks_record_whether_the_llm_agreed(self):
+        router = TopicRouter(self.vector_store, margin=2)
+        decision = self._route(router, "profit and revenue")
+
+        router.record_fallback(decision, "Finance")
+        router.record_fallback(decision, "Travel")
+
+        self.add_metric.assert_any_call("router_fallback_agreed", 1)
+        self.add_metric.assert_any_call("router_fallback_disagreed", 1)
+
+    def test_index_names_of_topics(self):
+        self.assertEqual(index_name_for_topic(" 'Human Resources'"), "human resources")
+        self.assertEqual(index_name_for_topic('"HR"'), "hr")
+
+
+class RoutingAcrossProfilesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        stand_ins = install_stand_ins()
+        index_lambda = importlib.import_module("index_data_lambda")
+        for index_name, profile in (("routingl2", "high_recall"), ("routingbyte", "compact_byte")):
+            key = f"{index_name}/{index_name}.txt"
+            stand_ins.s3.objects[key] = "\n\n".join(CHUNKS["finance" if profile == "high_recall" else "travel"]).encode()
+            with mock.patch.dict(index_lambda.config._values, {"index_profile": profile, "chunk_size": "40", "chunk_overlap": "0"}):
+                index_lambda.lambda_handler(s3_event("ObjectCreated:Put", key), LambdaContext("IndexLambda"))
+        cls.classify_lambda = importlib.import_module("classify_lambda")
+
+    def test_questions_are_routed_to_indices_of_other_profiles(self):
+        from rag_common.stages import get_embeddings, get_index_profile_of
+
+        question = "hotel booking near the beach"
+        self.assertNotEqual(
+            get_index_profile_of("routingbyte").embedding_cache_id, get_index_profile_of("routingl2").embedding_cache_id
+        )
+        question_embedding = get_embeddings().embed_query(question)
+
+        _, decision = self.classify_lambda.route_question(question, question_embedding, ["'RoutingL2'", "'RoutingByte'"])
+
+        self.assertEqual((decision["index"], decision["reason"]), ("routingbyte", "routed"))
+
+
+if __name__ == "__main__":
+    unittest.main()